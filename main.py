@@ -1,7 +1,17 @@
 import streamlit as st
 
+from models.image_archive import ImageArchive, global_footprint
+from models.telemetry import start_metrics_server
+from models.warmup import start_warmup, warmup_status
+
 if 'images_archive' not in st.session_state:
-    st.session_state.images_archive = []
+    st.session_state.images_archive = ImageArchive()
+
+# Эндпоинт /metrics в формате Prometheus (один на процесс)
+start_metrics_server()
+# Фоновая загрузка и прогрев всех моделей (один раз на процесс). torch
+# импортируется только в этом потоке — главная страница его не ждёт
+start_warmup()
 
 # 1. Сначала описываем сами страницы (путь к файлу, название в меню, иконка)
 # Функция для главной страницы (ваша текущая инфо-страница)
@@ -17,7 +27,9 @@ def show_main_page():
     1.  **⚽ Спортивные фотографии**: Определение вида спорта по фото.
     2.  **🔬 Клетки крови**: Классификация типов клеток.
     3.  **🏞️ Природные сцены**: Распознавание типов ландшафтов.
-    4.  **📊 Сводная информация**: Детальные метрики обучения.
+    4.  **🧩 Все модели сразу**: Одно изображение во все три модели.
+    5.  **📊 Сводная информация**: Детальные метрики обучения.
+    6.  **🛠️ Операционные метрики**: Где тратится время под нагрузкой.
 
     ---
     ### Технологический стек
@@ -35,7 +47,15 @@ def show_main_page():
         - Просмотр статистики распределения классов в датасетах.
         """)
     st.info("Выберите интересующий вас раздел в меню слева, чтобы начать работу.")
-    st.write(f"Сейчас в памяти сохранено изображений: {len(st.session_state.images_archive)}")
+    st.write(f"Сейчас в памяти сохранено изображений: {st.session_state.images_archive.describe()}")
+    st.caption(f"Всего по всем сессиям: {global_footprint() / 1024 / 1024:.1f} МБ")
+
+    warmup = warmup_status()
+    if warmup["ready"]:
+        if warmup.get("elapsed") is not None:
+            st.caption(f"✅ Модели загружены и прогреты за {warmup['elapsed']:.1f} с")
+    else:
+        st.caption("⏳ Модели загружаются в фоне — первая классификация может занять чуть дольше")
 
 # 2. Инициализируем объекты страниц
 # Здесь мы связываем файлы из папки pages/ с красивыми названиями
@@ -44,13 +64,15 @@ sports_page = st.Page("pages/1_sports_images_classif.py", title="Виды спо
 blood_page = st.Page("pages/2_Классификация клеток крови.py", title="Клетки крови", icon="🔬")
 intel_page = st.Page("pages/3_Intel_image_classification.py", title="Природные сцены", icon="🏞️")
 summary_page = st.Page("pages/4_summary.py", title="Сводная информация", icon="📊")
+all_models_page = st.Page("pages/5_all_models.py", title="Все модели сразу", icon="🧩")
+operations_page = st.Page("pages/6_operations.py", title="Операционные метрики", icon="🛠️")
 
 # 3. Настраиваем навигацию
 # Можно сгруппировать страницы по разделам
 pg = st.navigation({
     "Меню": [main_page],
-    "Модели классификации": [sports_page, blood_page, intel_page],
-    "Аналитика": [summary_page]
+    "Модели классификации": [sports_page, blood_page, intel_page, all_models_page],
+    "Аналитика": [summary_page, operations_page]
 })
 
 # 4. Общие настройки (выполняются один раз для всех страниц)
@@ -0,0 +1,190 @@
+import json
+import logging
+import os
+
+import torch
+
+from models.preprocessing import get_preprocessor
+from models.registry import checkpoint_version, load_eager, model_size_bytes
+
+try:
+    import onnxruntime as ort
+except ImportError:   # необязательная зависимость: pip install onnxruntime onnx (см. README)
+    ort = None
+
+logger = logging.getLogger(__name__)
+
+# ===================== КОНСТАНТЫ =====================
+
+BACKENDS = ("eager", "torchscript", "onnx")
+ARTIFACT_SUFFIX = {"torchscript": ".ts.pt", "onnx": ".onnx"}
+
+# Допуск по вероятностям при сверке с eager
+PARITY_ATOL = {"torchscript": 1e-4, "onnx": 1e-3}
+PARITY_PROBES = 8
+
+
+def artifact_path(spec, backend):
+    """models/intel_model.pt -> models/intel_model.ts.pt / models/intel_model.onnx"""
+    root, _ = os.path.splitext(spec.path)
+    return root + ARTIFACT_SUFFIX[backend]
+
+
+def _is_fresh(spec, backend):
+    path = artifact_path(spec, backend)
+    try:
+        with open(path + ".json", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return os.path.exists(path) and meta.get("source_version") == checkpoint_version(spec.path)
+
+
+def _write_meta(spec, backend):
+    with open(artifact_path(spec, backend) + ".json", "w", encoding="utf-8") as f:
+        json.dump({"source_version": checkpoint_version(spec.path), "backend": backend}, f)
+
+
+def _example_input(spec, batch_size=1):
+    h, w = get_preprocessor(spec.name).spec.output_size
+    return torch.zeros(batch_size, 3, h, w)
+
+
+# ===================== TORCHSCRIPT =====================
+
+def export_torchscript(spec, eager):
+    """trace -> freeze -> optimize_for_inference (свёртка BN, oneDNN)."""
+    with torch.no_grad():
+        traced = torch.jit.trace(eager, _example_input(spec))
+        frozen = torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+    torch.jit.save(frozen, artifact_path(spec, "torchscript"))
+    _write_meta(spec, "torchscript")
+
+
+class TorchScriptModel:
+    """
+    Замороженный TorchScript-модуль с интерфейсом модуля страницы.
+
+    После freeze веса становятся константами графа и state_dict() пуст,
+    поэтому размер (для лимита памяти реестра) берётся у eager-модели,
+    из которой модуль экспортирован.
+    """
+
+    def __init__(self, module, size_bytes):
+        self.module = module
+        self.size_bytes = size_bytes
+
+    def __call__(self, batch):
+        return self.module(batch)
+
+    def eval(self):
+        return self
+
+    def to(self, device):
+        return self
+
+
+def load_torchscript(spec, size_bytes=0):
+    module = torch.jit.load(artifact_path(spec, "torchscript"), map_location="cpu")
+    module.eval()
+    return TorchScriptModel(module, size_bytes)
+
+
+# ===================== ONNX RUNTIME =====================
+
+class OnnxModel:
+    """
+    Обёртка над onnxruntime.InferenceSession с интерфейсом модуля:
+    model(batch) -> logits (torch.Tensor), .eval() и .to() ничего не делают.
+    """
+
+    def __init__(self, path):
+        if ort is None:
+            raise ImportError("Для backend='onnx' нужен пакет onnxruntime")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.size_bytes = os.path.getsize(path)
+
+    def __call__(self, batch):
+        logits = self.session.run(None, {self.input_name: batch.detach().cpu().numpy()})[0]
+        return torch.from_numpy(logits)
+
+    def eval(self):
+        return self
+
+    def to(self, device):
+        return self
+
+
+def export_onnx(spec, eager):
+    torch.onnx.export(
+        eager, _example_input(spec), artifact_path(spec, "onnx"),
+        input_names=["input"], output_names=["logits"],
+        dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=17, dynamo=False,
+    )
+    _write_meta(spec, "onnx")
+
+
+def load_onnx(spec, size_bytes=0):
+    return OnnxModel(artifact_path(spec, "onnx"))
+
+
+EXPORTERS = {"torchscript": export_torchscript, "onnx": export_onnx}
+LOADERS = {"torchscript": load_torchscript, "onnx": load_onnx}
+
+
+# ===================== СВЕРКА И ВЫБОР =====================
+
+def parity_inputs(spec, n=PARITY_PROBES):
+    """Реальные картинки из images/ (если есть) плюс случайный шум."""
+    preprocessor = get_preprocessor(spec.name)
+    files = [os.path.join("images", f) for f in sorted(os.listdir("images"))
+             if f.endswith((".jpg", ".png"))][:n]
+    batch = preprocessor.batch([preprocessor.open(f) for f in files]).clone() if files else None
+    noise = torch.randn(max(1, n - len(files)), 3, *preprocessor.spec.output_size)
+    return noise if batch is None else torch.cat([batch, noise])
+
+
+def check_parity(reference, candidate, inputs, atol):
+    """Совпадают ли top-1 и вероятности в пределах atol."""
+    with torch.no_grad():
+        expected = torch.softmax(reference(inputs), dim=1)
+        actual = torch.softmax(candidate(inputs), dim=1)
+    max_diff = (expected - actual).abs().max().item()
+    same_top1 = torch.equal(expected.argmax(dim=1), actual.argmax(dim=1))
+    return same_top1 and max_diff <= atol, max_diff
+
+
+def load_backend(spec, backend=None):
+    """
+    Модель с нужным backend'ом.
+
+    Артефакт берётся из кэша рядом с .pt или экспортируется заново, если
+    чекпоинт изменился. Перед тем как отдать модель, её ответы сверяются
+    с eager; при расхождении используется eager.
+    """
+    backend = backend or spec.backend
+    if backend not in BACKENDS:
+        raise ValueError(f"Неизвестный backend: {backend}")
+
+    eager = load_eager(spec)
+    if backend == "eager":
+        return eager
+
+    try:
+        if not _is_fresh(spec, backend):
+            EXPORTERS[backend](spec, eager)
+        candidate = LOADERS[backend](spec, model_size_bytes(eager))
+        ok, max_diff = check_parity(eager, candidate, parity_inputs(spec), PARITY_ATOL[backend])
+    except Exception:
+        logger.exception("backend %s для %s недоступен, используется eager", backend, spec.name)
+        return eager
+
+    if not ok:
+        logger.warning("backend %s для %s не прошёл сверку (max |Δp| = %.2e), используется eager",
+                       backend, spec.name, max_diff)
+        return eager
+    return candidate
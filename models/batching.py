@@ -0,0 +1,292 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from functools import partial
+
+import torch
+
+from models.cascade import maybe_cascade
+from models.embedding_index import maybe_indexed
+from models.scheduler import get_scheduler, priority_for
+from models.telemetry import TELEMETRY, ENABLED, SIZE_BUCKETS
+
+# ===================== КОНСТАНТЫ =====================
+
+# MICRO_BATCHING=0 — страницы вызывают модель напрямую, как раньше
+MICRO_BATCHING = os.environ.get("MICRO_BATCHING", "1") != "0"
+# Сколько ждать соседние запросы после первого, миллисекунды
+WINDOW_MS = float(os.environ.get("BATCH_WINDOW_MS", 5))
+# Больше стольких изображений в один forward не собираем
+MAX_BATCH = int(os.environ.get("BATCH_MAX_SIZE", 32))
+
+
+class _Request:
+    __slots__ = ("batch", "future", "enqueued", "priority")
+
+    def __init__(self, batch, future, enqueued, priority):
+        self.batch = batch
+        self.future = future
+        self.enqueued = enqueued
+        self.priority = priority
+
+    @property
+    def size(self):
+        return self.batch.shape[0]
+
+
+def _registry_model(name):
+    from models.registry import get_model
+    return get_model(name)
+
+
+# ===================== СЕРВЕР МИКРОБАТЧЕЙ =====================
+
+class BatchingServer:
+    """
+    Общий на процесс сервис инференса с динамическим микробатчингом.
+
+    Для каждой модели — своя asyncio-очередь в фоновом цикле событий.
+    Запросы, пришедшие в течение window_ms после первого, склеиваются в один
+    батч (не больше max_batch изображений) и идут в модель одним forward;
+    каждый вызывающий получает свой срез логитов через Future.
+
+    Forward выполняет InferenceScheduler (models/scheduler.py): допуск
+    проверяется сразу в submit(), а у одной модели одновременно не больше
+    workers - 1 батчей, чтобы пакетная загрузка не заняла все воркеры.
+    """
+
+    def __init__(self, window_ms=WINDOW_MS, max_batch=MAX_BATCH, model_loader=_registry_model,
+                 scheduler=None):
+        self.window = window_ms / 1000
+        self.max_batch = max(1, max_batch)
+        self._load = model_loader
+        self.scheduler = scheduler or get_scheduler()
+        self._queues = {}
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True,
+                                        name="batching-loop")
+        self._thread.start()
+
+    # -------- Приём запросов (из любых потоков) --------
+
+    def submit(self, name, batch, priority=None):
+        """
+        Ставит тензор [N, 3, H, W] в очередь модели; возвращает Future с логитами [N, C].
+
+        Если очередь планировщика заполнена — сразу SchedulerBusy.
+        """
+        size = batch.shape[0]
+        self.scheduler.admit(name, size)
+        future = Future()
+        request = _Request(batch, future, time.perf_counter(),
+                           priority_for(size) if priority is None else priority)
+        self._loop.call_soon_threadsafe(self._enqueue, name, request)
+        return future
+
+    def __call__(self, name, batch):
+        return self.submit(name, batch).result()
+
+    def _enqueue(self, name, request):
+        queue = self._queues.get(name)
+        if queue is None:
+            queue = self._queues[name] = asyncio.Queue()
+            self._loop.create_task(self._collect(name, queue))
+        queue.put_nowait(request)
+
+    # -------- Сборка батчей (в цикле событий) --------
+
+    async def _collect(self, name, queue):
+        inflight = asyncio.Semaphore(max(1, self.scheduler.workers - 1))
+        carry = None
+        while True:
+            await inflight.acquire()
+            first = carry or await queue.get()
+            carry = None
+            requests, size = [first], first.size
+            deadline = self._loop.time() + self.window
+
+            while size < self.max_batch:
+                timeout = deadline - self._loop.time()
+                try:
+                    request = (queue.get_nowait() if timeout <= 0
+                               else await asyncio.wait_for(queue.get(), timeout))
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+                if size + request.size > self.max_batch:
+                    carry = request   # пойдёт первым в следующий батч
+                    break
+                requests.append(request)
+                size += request.size
+
+            # Пока батчи модели заняты, новые запросы копятся в очереди
+            job = self.scheduler.submit(
+                name, partial(self._run, name, requests), size,
+                priority=min(r.priority for r in requests), admitted=True,
+                enqueued=tuple(r.enqueued for r in requests),
+            )
+            job.add_done_callback(lambda _: self._loop.call_soon_threadsafe(inflight.release))
+
+    # -------- Forward (в воркере планировщика) --------
+
+    def _run(self, name, requests):
+        requests = [r for r in requests if r.future.set_running_or_notify_cancel()]
+        if not requests:
+            return
+        try:
+            model = self._load(name)
+            # Склеиваем только тензоры одинакового размера
+            groups = {}
+            for r in requests:
+                groups.setdefault(tuple(r.batch.shape[1:]), []).append(r)
+            with torch.no_grad():
+                for group in groups.values():
+                    logits = model(torch.cat([r.batch for r in group]))
+                    offset = 0
+                    for r in group:
+                        r.future.set_result(logits[offset:offset + r.size])
+                        offset += r.size
+        except Exception as e:
+            for r in requests:
+                if not r.future.done():
+                    r.future.set_exception(e)
+
+        if ENABLED:
+            TELEMETRY.observe("inference_microbatch_size", sum(r.size for r in requests),
+                              buckets=SIZE_BUCKETS, model=name)
+
+    async def _shutdown(self):
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result(timeout=1)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=1)
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def get_batching_server():
+    """Один сервер на процесс — общий для всех сессий Streamlit."""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = BatchingServer()
+        return _server
+
+
+# ===================== ЗАМЕНА МОДЕЛИ НА СТРАНИЦАХ =====================
+
+class BatchedModel:
+    """
+    Подставляется вместо модели: model(batch) уходит в общий BatchingServer.
+
+    Совместима с predict_tensor_batch / predict_batch / stream_predictions;
+    eval() и to() ничего не делают — модель живёт в реестре.
+    """
+
+    def __init__(self, name, server=None):
+        self.name = name
+        self.server = server or get_batching_server()
+
+    def __call__(self, batch):
+        return self.server.submit(self.name, batch).result()
+
+    def eval(self):
+        return self
+
+    def to(self, *args, **kwargs):
+        return self
+
+
+def get_batched_model(name, record=True):
+    """
+    Модель для страницы: через микробатчинг или (MICRO_BATCHING=0) напрямую.
+
+    Модель загружается сразу, чтобы ошибка загрузки и describe_model
+    остались на странице. record=False — для прогрева: кэш почти-дубликатов
+    не читается и не пополняется.
+    """
+    model = _registry_model(name)
+    if MICRO_BATCHING:
+        model = BatchedModel(name)
+    # NEAR_DUPLICATES=<модель>: почти-дубликаты отвечают из кэша эмбеддингов
+    model = maybe_indexed(name, model, record)
+    # CASCADE=<модель>: сначала малое разрешение, см. models/cascade.py
+    return maybe_cascade(name, model)
+
+
+# ===================== НАГРУЗОЧНЫЙ ТЕСТ =====================
+
+def _percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def load_test(model, sessions=20, requests_per_session=10, batching=True,
+              window_ms=WINDOW_MS, max_batch=MAX_BATCH, size=224):
+    """
+    sessions потоков, каждый по очереди шлёт requests_per_session запросов
+    из одного изображения — как пользователи на странице.
+
+    Возвращает {"throughput": изобр./с, "p50"/"p95"/"p99": задержка, с}.
+    """
+    server = BatchingServer(window_ms, max_batch, model_loader=lambda name: model) if batching else None
+    latencies, lock = [], threading.Lock()
+    image = torch.randn(1, 3, size, size)
+    barrier = threading.Barrier(sessions)
+
+    def session():
+        barrier.wait()
+        for _ in range(requests_per_session):
+            start = time.perf_counter()
+            if server is not None:
+                server("bench", image)
+            else:
+                with torch.no_grad():
+                    model(image)
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=session) for _ in range(sessions)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    if server is not None:
+        server.close()
+
+    return {
+        "throughput": len(latencies) / elapsed,
+        "p50": _percentile(latencies, 0.50),
+        "p95": _percentile(latencies, 0.95),
+        "p99": _percentile(latencies, 0.99),
+    }
+
+
+if __name__ == "__main__":
+    # python -m models.batching [N сессий] [запросов на сессию]
+    from models.registry import build_resnet18
+
+    sessions = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    per_session = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    model = build_resnet18(6).eval()
+
+    print(f"{sessions} сессий × {per_session} запросов, окно {WINDOW_MS:g} мс, "
+          f"батч до {MAX_BATCH}")
+    for batching in (False, True):
+        r = load_test(model, sessions, per_session, batching=batching)
+        print(f"{'с микробатчингом' if batching else 'без микробатчинга':18s} "
+              f"{r['throughput']:7.1f} изобр./с   p50 {r['p50'] * 1000:7.1f} мс   "
+              f"p95 {r['p95'] * 1000:7.1f} мс   p99 {r['p99'] * 1000:7.1f} мс")
@@ -0,0 +1,228 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from io import BytesIO
+
+import numpy as np
+import torch
+from PIL import Image
+
+from models.preprocessing import PREPROCESS_SPECS, PreprocessSpec, Preprocessor
+from models.registry import MODEL_SPECS, build_model, get_registry
+
+# ===================== КОНСТАНТЫ =====================
+
+STAGES = ("decode", "preprocess", "forward", "postprocess")
+DEFAULT_BATCH_SIZES = (1, 8, 32)
+DEFAULT_THREADS = (1, 2, 4)
+DEFAULT_RESOLUTIONS = (160, 224)
+REGRESSION_THRESHOLD = 0.10   # +10% к p50 относительно baseline — регрессия
+
+
+# ===================== ДАННЫЕ =====================
+
+def bundled_images():
+    """Байты картинок из images/ (JPEG/PNG)."""
+    files = [os.path.join("images", f) for f in sorted(os.listdir("images"))
+             if f.endswith((".jpg", ".png"))]
+    return [open(f, "rb").read() for f in files]
+
+
+def synthetic_images(n=16, size=(1024, 768), seed=0):
+    """Случайные JPEG — если images/ недоступна."""
+    rng = np.random.default_rng(seed)
+    out = []
+    for _ in range(n):
+        arr = rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+        buf = BytesIO()
+        Image.fromarray(arr).save(buf, format="JPEG", quality=90)
+        out.append(buf.getvalue())
+    return out
+
+
+def reset_peak_rss():
+    """Сбрасывает VmHWM процесса (Linux ≥ 4.0); False — если сбросить нельзя."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_bytes():
+    """Пиковый RSS (VmHWM) с последнего reset_peak_rss(), иначе с запуска процесса."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def load_for_benchmark(name):
+    """Модель через тот же реестр, что и страницы; без чекпоинта — случайные веса."""
+    spec = MODEL_SPECS[name]
+    if os.path.exists(spec.path):
+        return get_registry().get(name), False
+    return build_model(spec.arch, spec.num_classes).eval(), True
+
+
+def scaled_spec(spec, resolution):
+    """Та же предобработка, но с выходом resolution×resolution."""
+    k = resolution / spec.output_size[0]
+    if spec.crop is not None:
+        return PreprocessSpec(resize=int(round(spec.resize * k)), crop=resolution,
+                              mean=spec.mean, std=spec.std)
+    return PreprocessSpec(resize=(resolution, resolution), mean=spec.mean, std=spec.std)
+
+
+# ===================== ИЗМЕРЕНИЯ =====================
+
+def percentiles(samples):
+    arr = np.asarray(samples) * 1000
+    return {
+        "p50_ms": float(np.percentile(arr, 50)),
+        "p95_ms": float(np.percentile(arr, 95)),
+        "p99_ms": float(np.percentile(arr, 99)),
+        "mean_ms": float(arr.mean()),
+    }
+
+
+def run_case(model, preprocessor, raw_images, batch_size, iterations, warmup=2):
+    """
+    Одна точка сетки: время и пиковый RSS по стадиям на батч.
+
+    Пик — VmHWM, сброшенный перед стадией, поэтому учитывается и память,
+    выделенная и освобождённая внутри неё. Если сброс недоступен (не Linux),
+    peak_rss_per_stage=False и пик — с начала процесса.
+    """
+    times = {stage: [] for stage in STAGES}
+    peak_rss = {stage: 0 for stage in STAGES}
+    per_stage = True
+    total_images, total_time = 0, 0.0
+
+    def measure(stage, fn, record):
+        nonlocal per_stage
+        if record:
+            per_stage = reset_peak_rss() and per_stage
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        if record:
+            times[stage].append(elapsed)
+            peak_rss[stage] = max(peak_rss[stage], peak_rss_bytes())
+        return result, elapsed
+
+    for it in range(warmup + iterations):
+        record = it >= warmup
+        chunk = [raw_images[(it * batch_size + j) % len(raw_images)] for j in range(batch_size)]
+
+        images, t_decode = measure("decode", lambda: [preprocessor.open(d) for d in chunk], record)
+        batch, t_pre = measure("preprocess", lambda: preprocessor.batch(images), record)
+        with torch.no_grad():
+            logits, t_fwd = measure("forward", lambda: model(batch), record)
+            _, t_post = measure(
+                "postprocess",
+                lambda: [t.tolist() for t in torch.max(torch.softmax(logits, dim=1), dim=1)],
+                record,
+            )
+        if record:
+            total_images += batch_size
+            total_time += t_decode + t_pre + t_fwd + t_post
+
+    return {
+        "stages": {
+            stage: {**percentiles(times[stage]), "peak_rss_mb": peak_rss[stage] / 1024 / 1024}
+            for stage in STAGES
+        },
+        "images_per_sec": total_images / total_time if total_time else 0.0,
+        "peak_rss_per_stage": per_stage,
+    }
+
+
+def run_suite(names, batch_sizes, threads, resolutions, iterations, synthetic=False):
+    raw_images = synthetic_images() if synthetic else bundled_images()
+    results = {
+        "meta": {
+            "torch": torch.__version__,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "images": "synthetic" if synthetic else "images/",
+            "iterations": iterations,
+        },
+        "cases": {},
+    }
+    initial_threads = torch.get_num_threads()
+    try:
+        for name in names:
+            model, random_weights = load_for_benchmark(name)
+            for resolution in resolutions:
+                preprocessor = Preprocessor(scaled_spec(PREPROCESS_SPECS[name], resolution))
+                for n_threads in threads:
+                    torch.set_num_threads(n_threads)
+                    for batch_size in batch_sizes:
+                        key = f"{name}/res{resolution}/threads{n_threads}/bs{batch_size}"
+                        case = run_case(model, preprocessor, raw_images, batch_size, iterations)
+                        case["random_weights"] = random_weights
+                        results["cases"][key] = case
+                        print(f"{key}: {case['images_per_sec']:.1f} img/s, forward p50 "
+                              f"{case['stages']['forward']['p50_ms']:.1f} мс", file=sys.stderr)
+    finally:
+        torch.set_num_threads(initial_threads)
+    return results
+
+
+# ===================== СРАВНЕНИЕ С BASELINE =====================
+
+def compare(current, baseline, threshold=REGRESSION_THRESHOLD):
+    """Список строк-отличий; регрессии помечены «!»."""
+    lines = []
+    for key, case in current["cases"].items():
+        base = baseline.get("cases", {}).get(key)
+        if base is None:
+            lines.append(f"  {key}: нет в baseline")
+            continue
+        for stage in STAGES:
+            now = case["stages"][stage]["p50_ms"]
+            was = base["stages"][stage]["p50_ms"]
+            change = (now - was) / was if was else 0.0
+            mark = "!" if change > threshold else " "
+            lines.append(f"{mark} {key} {stage}: p50 {was:.2f} -> {now:.2f} мс ({change:+.0%})")
+        now, was = case["images_per_sec"], base["images_per_sec"]
+        mark = "!" if was and (was - now) / was > threshold else " "
+        lines.append(f"{mark} {key} throughput: {was:.1f} -> {now:.1f} img/s")
+    return lines
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк инференса трёх классификаторов")
+    parser.add_argument("--model", choices=list(MODEL_SPECS), action="append")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=list(DEFAULT_BATCH_SIZES))
+    parser.add_argument("--threads", type=int, nargs="+", default=list(DEFAULT_THREADS))
+    parser.add_argument("--resolutions", type=int, nargs="+", default=list(DEFAULT_RESOLUTIONS))
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--synthetic", action="store_true", help="случайные JPEG вместо images/")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    results = run_suite(args.model or list(MODEL_SPECS), args.batch_sizes, args.threads,
+                        args.resolutions, args.iterations, args.synthetic)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"Результаты: {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            lines = compare(results, json.load(f))
+        print("\n".join(lines))
+        sys.exit(1 if any(line.startswith("!") for line in lines) else 0)
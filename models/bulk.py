@@ -0,0 +1,401 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import resource
+import sys
+import time
+
+from models.metrics import MetricsAccumulator, metrics_path
+from models.pipeline import DECODE_WORKERS, stream_predictions
+from models.preprocessing import get_preprocessor
+from models.registry import MODEL_SPECS, get_model, load_class_names
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:   # pyarrow нужен только для --format parquet
+    pa = pq = None
+
+# ===================== КОНСТАНТЫ =====================
+
+FORMATS = ("csv", "jsonl", "parquet")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff")
+BATCH_SIZE = 32
+TOP_K = 3
+# Строк в одном файле-части Parquet (столько же максимум держим в памяти)
+PARQUET_ROWS = 10_000
+PROGRESS_EVERY = 1000
+METRICS_CHUNK = 4096
+
+
+# ===================== ВХОДНЫЕ ДАННЫЕ =====================
+
+def iter_directory(root):
+    """Все изображения в дереве каталогов, в детерминированном порядке."""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(dirpath, name)
+
+
+def iter_manifest(path):
+    """
+    Пути из файла-манифеста: по одному на строку (# — комментарий)
+    или CSV с колонкой path. Относительные пути — от каталога манифеста.
+    """
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            rows = (row.get("path") or next(iter(row.values()), "") for row in csv.DictReader(f))
+        else:
+            rows = (line.strip() for line in f if not line.lstrip().startswith("#"))
+        for row in rows:
+            if row:
+                yield row if os.path.isabs(row) else os.path.join(base, row)
+
+
+def iter_inputs(specs):
+    """
+    Каталоги, glob-шаблоны и манифесты — лениво, без списка в памяти.
+
+    Порядок детерминирован (для glob — пока не меняется содержимое каталогов),
+    на этом держится продолжение после прерывания.
+    """
+    for spec in specs:
+        if os.path.isdir(spec):
+            yield from iter_directory(spec)
+        elif glob.has_magic(spec):
+            yield from (p for p in glob.iglob(spec, recursive=True)
+                        if p.lower().endswith(IMAGE_EXTENSIONS))
+        else:
+            yield from iter_manifest(spec)
+
+
+# ===================== ЗАПИСИ =====================
+
+def columns(top_k):
+    cols = ["path", "label", "class_id", "confidence"]
+    for i in range(1, top_k + 1):
+        cols += [f"top{i}_label", f"top{i}_prob"]
+    return cols + ["batch_size", "image_ms", "error"]
+
+
+def make_record(path, pred, error, top_k):
+    record = dict.fromkeys(columns(top_k))
+    record["path"] = path
+    if error is not None:
+        record["error"] = str(error)
+        return record
+    record.update(label=str(pred.label), class_id=pred.class_id,
+                  confidence=round(pred.confidence, 6),
+                  batch_size=pred.batch_size, image_ms=round(pred.image_time * 1000, 3))
+    for i, (label, prob) in enumerate(pred.top_k or [(pred.label, pred.confidence)], start=1):
+        record[f"top{i}_label"] = str(label)
+        record[f"top{i}_prob"] = round(prob, 6)
+    return record
+
+
+# ===================== ЗАПИСЬ РЕЗУЛЬТАТОВ =====================
+
+def _drop_partial_line(path):
+    """Обрезает недописанную последнюю строку (процесс прервали посреди записи)."""
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        pos = size
+        while pos > 0:
+            step = min(64 * 1024, pos)
+            f.seek(pos - step)
+            chunk = f.read(step)
+            newline = chunk.rfind(b"\n")
+            if newline != -1:
+                pos = pos - step + newline + 1
+                break
+            pos -= step
+        if pos != size:
+            f.truncate(pos)
+
+
+class CsvWriter:
+    def __init__(self, path, cols):
+        self.path = path
+        self.cols = cols
+        self._file = None
+
+    def open(self, resume):
+        """Открывает файл; возвращает (число готовых записей, путь последней)."""
+        done, last = 0, None
+        if resume and os.path.exists(self.path) and os.path.getsize(self.path):
+            _drop_partial_line(self.path)
+            with open(self.path, "r", encoding="utf-8", newline="") as f:
+                for row in csv.DictReader(f):
+                    done, last = done + 1, row["path"]
+        new = not (resume and os.path.exists(self.path) and os.path.getsize(self.path))
+        self._file = open(self.path, "w" if new else "a", encoding="utf-8", newline="")
+        self._writer = csv.DictWriter(self._file, self.cols)
+        if new:
+            self._writer.writeheader()
+        return done, last
+
+    def write(self, record):
+        self._writer.writerow(record)
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class JsonlWriter:
+    def __init__(self, path, cols):
+        self.path = path
+        self._file = None
+
+    def open(self, resume):
+        done, last = 0, None
+        if resume and os.path.exists(self.path):
+            _drop_partial_line(self.path)
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    done, last = done + 1, json.loads(line)["path"]
+        self._file = open(self.path, "a" if resume else "w", encoding="utf-8")
+        return done, last
+
+    def write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter:
+    """
+    Каталог part-NNNNN.parquet по PARQUET_ROWS строк.
+
+    Каждая часть пишется во временный файл и переименовывается, поэтому
+    на диске нет недописанных частей; pandas/pyarrow читают каталог целиком.
+    При аварийном завершении (kill -9) теряется только текущая неполная часть.
+    """
+
+    def __init__(self, path, cols):
+        if pa is None:
+            raise RuntimeError("Для --format parquet нужен pyarrow")
+        self.path = path
+        self.cols = cols
+        self._rows = []
+        self._parts = 0
+        types = {"class_id": pa.int64(), "batch_size": pa.int64(),
+                 "confidence": pa.float64(), "image_ms": pa.float64()}
+        self.schema = pa.schema([
+            (c, types.get(c, pa.float64() if c.endswith("_prob") else pa.string()))
+            for c in cols
+        ])
+
+    def _part_files(self):
+        return sorted(f for f in os.listdir(self.path)
+                      if f.startswith("part-") and f.endswith(".parquet"))
+
+    def open(self, resume):
+        os.makedirs(self.path, exist_ok=True)
+        parts = self._part_files()
+        if not resume:
+            for f in parts:
+                os.remove(os.path.join(self.path, f))
+            parts = []
+        done = sum(pq.ParquetFile(os.path.join(self.path, f)).metadata.num_rows for f in parts)
+        last = None
+        if parts:
+            table = pq.read_table(os.path.join(self.path, parts[-1]), columns=["path"])
+            last = table.column("path")[-1].as_py()
+        self._parts = len(parts)
+        return done, last
+
+    def write(self, record):
+        self._rows.append(record)
+        if len(self._rows) >= PARQUET_ROWS:
+            self._write_part()
+
+    def flush(self):
+        pass   # неполная часть пишется при закрытии (в том числе по Ctrl+C)
+
+    def _write_part(self):
+        if not self._rows:
+            return
+        name = os.path.join(self.path, f"part-{self._parts:05d}.parquet")
+        pq.write_table(pa.Table.from_pylist(self._rows, schema=self.schema), name + ".tmp")
+        os.replace(name + ".tmp", name)
+        self._parts += 1
+        self._rows = []
+
+    def close(self):
+        self._write_part()
+
+
+WRITERS = {"csv": CsvWriter, "jsonl": JsonlWriter, "parquet": ParquetWriter}
+
+
+def detect_format(path):
+    ext = os.path.splitext(path)[1].lower().lstrip(".")
+    return {"json": "jsonl", "ndjson": "jsonl", "pq": "parquet"}.get(ext, ext)
+
+
+# ===================== ПАКЕТНАЯ КЛАССИФИКАЦИЯ =====================
+
+def _skip_done(paths, done, last):
+    """Пропускает уже обработанные входы и проверяет, что вход не изменился."""
+    seen = None
+    for _ in range(done):
+        seen = next(paths, None)
+    if done and seen != last:
+        raise ValueError(
+            f"Входные данные изменились: запись №{done} в результатах — {last!r}, "
+            f"а во входе — {seen!r}. Запустите с --no-resume."
+        )
+
+
+def classify(model_name, inputs, output, fmt=None, top_k=TOP_K, batch_size=BATCH_SIZE,
+             workers=DECODE_WORKERS, resume=True, log=sys.stderr):
+    """
+    Классифицирует все изображения из inputs и дописывает результаты в output.
+
+    Память не растёт с числом файлов: пути читаются лениво, декодирование
+    ограничено очередью конвейера, результаты сразу уходят в файл.
+    Возвращает {"done", "errors", "skipped", "elapsed"}.
+    """
+    fmt = fmt or detect_format(output)
+    if fmt not in FORMATS:
+        raise ValueError(f"Неизвестный формат {fmt!r}, доступны: {', '.join(FORMATS)}")
+
+    model = get_model(model_name)
+    class_names = load_class_names(model_name)
+    preprocessor = get_preprocessor(model_name)
+
+    writer = WRITERS[fmt](output, columns(top_k))
+    skipped, last = writer.open(resume)
+    paths = iter_inputs(inputs)
+    _skip_done(paths, skipped, last)
+    if skipped:
+        print(f"Продолжение: пропущено {skipped} уже обработанных изображений", file=log)
+
+    inflight = {}
+
+    def sources():
+        for i, path in enumerate(paths):
+            inflight[i] = path
+            yield path
+
+    # Ошибки декодирования приходят раньше результатов своего батча —
+    # восстанавливаем порядок, чтобы файл всегда был префиксом входа
+    ready, next_out = {}, 0
+    done = errors = 0
+    start = time.perf_counter()
+    try:
+        for index, pred, error in stream_predictions(
+                model, sources(), preprocessor, class_names, batch_size=batch_size,
+                decode_workers=workers, model_name=model_name, top_k=top_k):
+            ready[index] = (pred, error)
+            while next_out in ready:
+                pred, error = ready.pop(next_out)
+                writer.write(make_record(inflight.pop(next_out), pred, error, top_k))
+                errors += error is not None
+                next_out += 1
+                done += 1
+                if done % PROGRESS_EVERY == 0:
+                    rate = done / (time.perf_counter() - start)
+                    print(f"{skipped + done} изобр., {rate:.0f} изобр./с, ошибок {errors}",
+                          file=log)
+            writer.flush()
+    finally:
+        writer.close()
+
+    return {"done": done, "errors": errors, "skipped": skipped,
+            "elapsed": time.perf_counter() - start}
+
+
+# ===================== МЕТРИКИ ПО ГОТОВОМУ ФАЙЛУ =====================
+
+def iter_results(output, fmt=None):
+    """Записи из файла результатов — потоком, в том же порядке."""
+    fmt = fmt or detect_format(output)
+    if fmt == "csv":
+        with open(output, "r", encoding="utf-8", newline="") as f:
+            yield from csv.DictReader(f)
+    elif fmt == "jsonl":
+        with open(output, "r", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+    else:
+        for name in sorted(os.listdir(output)):
+            if name.startswith("part-") and name.endswith(".parquet"):
+                for batch in pq.ParquetFile(os.path.join(output, name)).iter_batches():
+                    yield from batch.to_pylist()
+
+
+def evaluate_results(output, class_names, top_k=TOP_K, fmt=None):
+    """
+    Метрики по уже записанным результатам, если истинный класс — имя папки
+    (раскладка ImageFolder). Считается по файлу, а не по ходу классификации,
+    поэтому после продолжения прерванного запуска метрики покрывают все записи.
+    """
+    items = class_names.items() if isinstance(class_names, dict) else enumerate(class_names)
+    index = {str(name): i for i, name in items}
+    acc = MetricsAccumulator(len(index), (1, top_k), class_names)
+    labels, tops = [], []
+    for record in iter_results(output, fmt):
+        if record.get("error"):
+            continue
+        true = index.get(os.path.basename(os.path.dirname(record["path"])))
+        ids = [index.get(record.get(f"top{i}_label")) for i in range(1, top_k + 1)]
+        if true is None or None in ids:
+            continue
+        labels.append(true)
+        tops.append(ids)
+        if len(labels) >= METRICS_CHUNK:
+            acc.update_topk(tops, labels)
+            labels, tops = [], []
+    if labels:
+        acc.update_topk(tops, labels)
+    return acc
+
+
+if __name__ == "__main__":
+    # python -m models.bulk blood_cells /data/smears -o blood.csv
+    # python -m models.bulk intel "scenes/**/*.jpg" -o intel.parquet --top-k 3
+    parser = argparse.ArgumentParser(description="Пакетная классификация без интерфейса")
+    parser.add_argument("model", choices=list(MODEL_SPECS))
+    parser.add_argument("inputs", nargs="+", help="каталог, glob-шаблон или файл-манифест")
+    parser.add_argument("-o", "--output", required=True, help="results.csv / .jsonl / .parquet")
+    parser.add_argument("--format", choices=FORMATS, help="по умолчанию — по расширению")
+    parser.add_argument("--top-k", type=int, default=TOP_K)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=DECODE_WORKERS,
+                        help="потоков декодирования")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="начать заново, перезаписав результаты")
+    parser.add_argument("--labels-from-dirs", action="store_true",
+                        help="истинный класс — имя папки: посчитать метрики (*.metrics.json)")
+    args = parser.parse_args()
+
+    result = classify(args.model, args.inputs, args.output, args.format, args.top_k,
+                      args.batch_size, args.workers, resume=not args.no_resume)
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    rate = result["done"] / result["elapsed"] if result["elapsed"] else 0
+    print(f"Готово: {result['done']} изобр. за {result['elapsed']:.1f} с ({rate:.0f} изобр./с), "
+          f"ошибок {result['errors']}, пропущено {result['skipped']}, "
+          f"пиковая память {peak_mb:.0f} МБ", file=sys.stderr)
+
+    if args.labels_from_dirs:
+        metrics = evaluate_results(args.output, load_class_names(args.model), args.top_k,
+                                   args.format)
+        metrics.save(metrics_path(args.output))
+        summary = metrics.summary()
+        print(f"Метрики по {summary['total']} изобр.: accuracy {summary['accuracy']:.4f}, "
+              f"macro F1 {summary['macro_f1']:.4f}, weighted F1 {summary['weighted_f1']:.4f} "
+              f"-> {metrics_path(args.output)}", file=sys.stderr)
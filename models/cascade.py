@@ -0,0 +1,328 @@
+import argparse
+import json
+import logging
+import os
+from dataclasses import asdict, dataclass
+from functools import partial
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from models.inference import forward_with_tiers
+from models.registry import TEACHER_ARCH, MODEL_SPECS, checkpoint_version
+from models.telemetry import count
+
+logger = logging.getLogger(__name__)
+
+# ===================== КОНСТАНТЫ =====================
+
+# Модели, для которых включён каскад, например CASCADE="sports".
+# Пороги берутся из <чекпоинт>.cascade.json (python -m models.cascade calibrate)
+CASCADE_MODELS = tuple(n for n in os.environ.get("CASCADE", "").split(",") if n)
+
+LOW_RES_CANDIDATES = (128, 160)
+CRITERIA = ("prob", "margin")   # top-1 вероятность | разница top-1 и top-2
+FULL_RES = 224
+MAX_ACCURACY_DROP = 0.005
+
+TIER_LOW = "low"
+TIER_FULL = "full"
+
+
+def cascade_path(checkpoint):
+    """models/model_sic100.pt -> models/model_sic100.cascade.json"""
+    return os.path.splitext(checkpoint)[0] + ".cascade.json"
+
+
+# ===================== СТОИМОСТЬ =====================
+
+def _out(size, kernel, stride, padding):
+    return (size + 2 * padding - kernel) // stride + 1
+
+
+def resnet18_macs(resolution, num_classes=1000):
+    """Умножения-сложения ResNet18 на квадратном входе resolution × resolution (224 -> ~1.82 G)."""
+    h = w = resolution
+    macs = 0
+
+    def conv(h, w, cin, cout, kernel, stride, padding):
+        oh, ow = _out(h, kernel, stride, padding), _out(w, kernel, stride, padding)
+        return oh, ow, oh * ow * cin * cout * kernel * kernel
+
+    h, w, m = conv(h, w, 3, 64, 7, 2, 3)
+    macs += m
+    h, w = _out(h, 3, 2, 1), _out(w, 3, 2, 1)   # maxpool
+    cin = 64
+    for cout, stride in ((64, 1), (128, 2), (256, 2), (512, 2)):
+        for block in range(2):
+            s = stride if block == 0 else 1
+            oh, ow, m1 = conv(h, w, cin, cout, 3, s, 1)
+            _, _, m2 = conv(oh, ow, cout, cout, 3, 1, 1)
+            macs += m1 + m2
+            if s != 1 or cin != cout:
+                macs += conv(h, w, cin, cout, 1, s, 0)[2]   # downsample
+            h, w, cin = oh, ow, cout
+    return macs + 512 * num_classes
+
+
+def count_macs(model, resolution):
+    """Умножения-сложения свёрток и линейных слоёв любой модели — по одному проходу с хуками."""
+    if not isinstance(model, nn.Module):
+        raise ValueError("MACs считаются только для eager-модели (MODEL_BACKEND=eager)")
+    total = 0
+
+    def hook(module, inputs, output):
+        nonlocal total
+        if isinstance(module, nn.Conv2d):
+            kernel = module.kernel_size[0] * module.kernel_size[1]
+            total += output[0].numel() * kernel * module.in_channels // module.groups
+        else:
+            total += module.in_features * module.out_features
+
+    handles = [m.register_forward_hook(hook) for m in model.modules()
+               if isinstance(m, (nn.Conv2d, nn.Linear))]
+    try:
+        with torch.no_grad():
+            model(torch.zeros(1, 3, resolution, resolution))
+    finally:
+        for handle in handles:
+            handle.remove()
+    return total
+
+
+def flops_saved(low_res, escalation_rate, full_res=FULL_RES, num_classes=1000, macs=None):
+    """
+    Доля сэкономленных FLOPs на изображение: 1 - (low + p * full) / full.
+
+    macs(resolution) — стоимость модели; по умолчанию формула ResNet18.
+    """
+    macs = macs or partial(resnet18_macs, num_classes=num_classes)
+    full = macs(full_res)
+    return 1 - (macs(low_res) + escalation_rate * full) / full
+
+
+# ===================== КАСКАД =====================
+
+@dataclass
+class CascadeConfig:
+    """Порог уверенности для ответа с малого разрешения и итоги калибровки."""
+    low_res: int
+    criterion: str
+    threshold: float
+    full_res: int = FULL_RES
+    target_accuracy: float = None
+    full_accuracy: float = None
+    cascade_accuracy: float = None
+    escalation_rate: float = None
+    flops_saved: float = None
+    samples: int = 0
+    source_version: str = ""
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(asdict(self), f, ensure_ascii=False, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(**json.load(f))
+
+
+def downscale(batch, resolution):
+    """Тензор после предобработки -> resolution × resolution (нормализация линейна, пересчёт не нужен)."""
+    return F.interpolate(batch, size=(resolution, resolution), mode="bilinear",
+                         align_corners=False, antialias=True)
+
+
+def confidence(logits, criterion):
+    top = torch.softmax(logits, dim=1).topk(2, dim=1).values
+    return top[:, 0] if criterion == "prob" else top[:, 0] - top[:, 1]
+
+
+class CascadeModel:
+    """
+    Обёртка над моделью страницы: сначала проход на low_res, на полное
+    разрешение уходят только изображения с уверенностью ниже порога.
+
+    ResNet18 (и ученики) с adaptive avgpool принимают любой размер входа, поэтому это
+    та же модель и те же веса. forward_with_tiers(batch) возвращает логиты и
+    уровень ("low" / "full") для каждого изображения — его кладёт в
+    Prediction.tier predict_tensor_batch. Вызов model(batch) — как у обычной модели.
+    """
+
+    def __init__(self, model, config, name=""):
+        self.model = model
+        self.config = config
+        self.name = name
+
+    def forward_with_tiers(self, batch):
+        config = self.config
+        tiers = [TIER_LOW] * batch.shape[0]
+        with torch.no_grad():
+            logits = self.model(downscale(batch, config.low_res))
+            escalate = confidence(logits, config.criterion) < config.threshold
+            index = escalate.nonzero().flatten()
+            if len(index):
+                logits = logits.clone()
+                logits[index], full_tiers = forward_with_tiers(self.model, batch[index])
+                for i, tier in zip(index.tolist(), full_tiers):
+                    tiers[i] = tier or TIER_FULL
+        count("cascade_images_total", batch.shape[0] - len(index), model=self.name, tier=TIER_LOW)
+        count("cascade_images_total", len(index), model=self.name, tier=TIER_FULL)
+        return logits, tiers
+
+    def __call__(self, batch):
+        return self.forward_with_tiers(batch)[0]
+
+    def eval(self):
+        self.model.eval()
+        return self
+
+    def to(self, *args, **kwargs):
+        self.model.to(*args, **kwargs)
+        return self
+
+
+def load_config(name):
+    """Калибровка модели или None (нет файла или он от другого чекпоинта)."""
+    spec = MODEL_SPECS[name]
+    path = cascade_path(spec.path)
+    if not os.path.exists(path):
+        return None
+    config = CascadeConfig.load(path)
+    if config.source_version and config.source_version != checkpoint_version(spec.path):
+        logger.warning("%s откалиброван для другой версии чекпоинта, каскад выключен", path)
+        return None
+    return config
+
+
+def maybe_cascade(name, model):
+    """model -> CascadeModel, если каскад включён для модели (CASCADE) и откалиброван."""
+    if name not in CASCADE_MODELS:
+        return model
+    config = load_config(name)
+    if config is None:
+        logger.warning("CASCADE включён для %s, но нет калибровки %s", name,
+                       cascade_path(MODEL_SPECS[name].path))
+        return model
+    return CascadeModel(model, config, name)
+
+
+# ===================== КАЛИБРОВКА =====================
+
+def collect(model, loader, low_resolutions=LOW_RES_CANDIDATES):
+    """
+    Один проход по отложенной выборке: верность на полном разрешении и,
+    для каждого low_res, уверенность (по обоим критериям) и верность.
+    """
+    full_correct = []
+    low = {res: {"correct": [], **{c: [] for c in CRITERIA}} for res in low_resolutions}
+    model.eval()
+    with torch.inference_mode():
+        for images, labels in loader:
+            full_correct.append(model(images).argmax(dim=1) == labels)
+            for res in low_resolutions:
+                logits = model(downscale(images, res))
+                low[res]["correct"].append(logits.argmax(dim=1) == labels)
+                for criterion in CRITERIA:
+                    low[res][criterion].append(confidence(logits, criterion))
+    full_correct = torch.cat(full_correct)
+    return full_correct, {res: {k: torch.cat(v) for k, v in d.items()} for res, d in low.items()}
+
+
+def calibrate_threshold(scores, low_correct, full_correct, target):
+    """
+    Наименьший порог, при котором точность каскада не ниже target.
+
+    Изображения сортируются по убыванию уверенности; принять k самых
+    уверенных с малого разрешения — точность (верных low среди k + верных
+    full среди остальных) / n. Берётся наибольшее k, не разрывающее группы
+    равных значений. Возвращает (порог, точность, доля эскалаций).
+    """
+    n = len(scores)
+    order = scores.argsort(descending=True)
+    s = scores[order]
+    zero = torch.zeros(1, dtype=torch.float64)
+    low_hits = torch.cat([zero, low_correct[order].double().cumsum(0)])
+    full_rest = torch.cat([full_correct[order].double().flip(0).cumsum(0).flip(0), zero])
+    accuracy = (low_hits + full_rest) / n                  # для k = 0..n
+    boundary = torch.cat([torch.ones(1, dtype=torch.bool), s[:-1] > s[1:],
+                          torch.ones(1, dtype=torch.bool)])
+    ok = ((accuracy >= target) & boundary).nonzero().flatten()
+    k = int(ok.max()) if len(ok) else 0
+    threshold = s[k - 1].item() if k > 0 else float("inf")
+    return threshold, accuracy[k].item(), 1 - k / n
+
+
+def calibrate(name, loader, target_accuracy=None, max_drop=MAX_ACCURACY_DROP,
+              low_resolutions=LOW_RES_CANDIDATES):
+    """
+    Перебирает low_res и критерий, для каждого — порог под целевую точность
+    (по умолчанию точность на полном разрешении минус max_drop). Выбирается
+    вариант с наибольшей экономией FLOPs.
+    """
+    from models.registry import get_model
+
+    spec = MODEL_SPECS[name]
+    model = get_model(name)
+    full_correct, low = collect(model, loader, low_resolutions)
+    # Формула resnet18_macs верна только для учителя; ученики (MODEL_ARCH) — замером
+    macs = (partial(resnet18_macs, num_classes=spec.num_classes) if spec.arch == TEACHER_ARCH
+            else partial(count_macs, model))
+    full_accuracy = full_correct.double().mean().item()
+    target = target_accuracy if target_accuracy is not None else full_accuracy - max_drop
+
+    best = None
+    for res, data in low.items():
+        for criterion in CRITERIA:
+            threshold, accuracy, rate = calibrate_threshold(data[criterion], data["correct"],
+                                                            full_correct, target)
+            saved = flops_saved(res, rate, macs=macs)
+            if best is None or saved > best.flops_saved:
+                best = CascadeConfig(res, criterion, threshold, FULL_RES, target, full_accuracy,
+                                     accuracy, rate, saved, len(full_correct),
+                                     checkpoint_version(spec.path))
+    return best
+
+
+if __name__ == "__main__":
+    # python -m models.cascade calibrate sports data/sports/valid
+    parser = argparse.ArgumentParser(description="Каскад малое -> полное разрешение")
+    sub = parser.add_subparsers(dest="command", required=True)
+    cal = sub.add_parser("calibrate", help="подобрать порог на отложенной выборке (ImageFolder)")
+    cal.add_argument("model", choices=list(MODEL_SPECS))
+    cal.add_argument("root")
+    cal.add_argument("--target-accuracy", type=float, help="абсолютная цель (иначе full - drop)")
+    cal.add_argument("--max-drop", type=float, default=MAX_ACCURACY_DROP)
+    cal.add_argument("--low-res", type=int, action="append",
+                     help=f"кандидаты разрешения (по умолчанию {LOW_RES_CANDIDATES})")
+    cal.add_argument("--batch-size", type=int, default=64)
+    cal.add_argument("--workers", type=int, default=0)
+    sub.add_parser("flops", help="стоимость ResNet18 по разрешениям")
+    args = parser.parse_args()
+
+    if args.command == "flops":
+        full = resnet18_macs(FULL_RES)
+        for res in (*LOW_RES_CANDIDATES, FULL_RES):
+            macs = resnet18_macs(res)
+            print(f"{res}×{res}: {macs / 1e9:.2f} GMAC ({macs / full:.0%} от {FULL_RES})")
+    else:
+        from torchvision import datasets
+
+        from models.preprocessing import get_preprocessor
+
+        dataset = datasets.ImageFolder(args.root,
+                                       transform=get_preprocessor(args.model).reference_transform())
+        loader = torch.utils.data.DataLoader(dataset, batch_size=args.batch_size,
+                                             num_workers=args.workers)
+        config = calibrate(args.model, loader, args.target_accuracy, args.max_drop,
+                           tuple(args.low_res or LOW_RES_CANDIDATES))
+        path = cascade_path(MODEL_SPECS[args.model].path)
+        config.save(path)
+        print(f"{args.model}: {config.low_res}px, {config.criterion} ≥ {config.threshold:.4f}; "
+              f"точность {config.full_accuracy:.4f} -> {config.cascade_accuracy:.4f} "
+              f"(цель {config.target_accuracy:.4f}), эскалаций {config.escalation_rate:.1%}, "
+              f"экономия FLOPs {config.flops_saved:.1%} на {config.samples} изобр. -> {path}")
+        if config.flops_saved <= 0:
+            print("Каскад не экономит вычисления при такой цели — не включайте CASCADE для модели")
@@ -0,0 +1,222 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset
+from torchvision import datasets
+
+from models.preprocessing import PREPROCESS_SPECS, Preprocessor
+
+# ===================== КОНСТАНТЫ =====================
+
+CACHE_ROOT = os.path.join("data", "cache")
+IMAGES_FILE = "images.npy"   # uint8 [N, 3, H, W], читается через mmap
+LABELS_FILE = "labels.npy"   # int64 [N]
+META_FILE = "meta.json"
+BUILD_WORKERS = os.cpu_count() or 1
+CHUNK = 256
+
+
+def default_cache_dir(model_name, root):
+    """data/cache/<модель>-<хеш пути к датасету>."""
+    digest = hashlib.sha1(os.path.abspath(root).encode("utf-8")).hexdigest()[:8]
+    return os.path.join(CACHE_ROOT, f"{model_name}-{digest}")
+
+
+def _spec_dict(spec):
+    # Как после json.load: кортежи становятся списками
+    resize = spec.resize if isinstance(spec.resize, int) else list(spec.resize)
+    return {"resize": resize, "crop": spec.crop, "mean": list(spec.mean), "std": list(spec.std)}
+
+
+def read_meta(cache_dir):
+    path = os.path.join(cache_dir, META_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# ===================== СБОРКА КЭША =====================
+
+def build_cache(root, cache_dir, spec, workers=BUILD_WORKERS, force=False, log=print):
+    """
+    ImageFolder-дерево -> uint8-шард фиксированного размера + массив меток.
+
+    Resize/CenterCrop выполняются один раз (декодирование полное, без draft,
+    чтобы пиксели совпадали с transforms.Resize); в шарде лежат байты после
+    геометрии, до нормализации. Классы и порядок файлов берутся из
+    datasets.ImageFolder, поэтому индексы классов совпадают.
+    Если кэш уже собран из того же дерева с той же предобработкой — ничего не делает.
+    """
+    folder = datasets.ImageFolder(root)
+    expected = {
+        "root": os.path.abspath(root),
+        "spec": _spec_dict(spec),
+        "count": len(folder.samples),
+        "classes": folder.classes,
+    }
+    meta = read_meta(cache_dir)
+    if not force and meta and all(meta.get(k) == v for k, v in expected.items()):
+        return meta
+
+    h, w = spec.output_size
+    n = len(folder.samples)
+    tmp_dir = cache_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    images = np.lib.format.open_memmap(os.path.join(tmp_dir, IMAGES_FILE), mode="w+",
+                                       dtype=np.uint8, shape=(n, 3, h, w))
+    labels = np.asarray(folder.targets, dtype=np.int64)
+    preprocessor = Preprocessor(spec, fast_decode=False)
+
+    def load(path):
+        arr = np.asarray(preprocessor.resize_crop(preprocessor.open(path)))
+        return arr.transpose(2, 0, 1)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for first in range(0, n, CHUNK):
+            paths = [p for p, _ in folder.samples[first:first + CHUNK]]
+            for i, arr in enumerate(pool.map(load, paths)):
+                images[first + i] = arr
+            log(f"{min(first + CHUNK, n)}/{n} изображений")
+    images.flush()
+    del images
+    np.save(os.path.join(tmp_dir, LABELS_FILE), labels)
+
+    meta = dict(expected, class_to_idx=folder.class_to_idx, shape=[n, 3, h, w],
+                build_time=time.perf_counter() - start)
+    with open(os.path.join(tmp_dir, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.replace(tmp_dir, cache_dir)
+    return meta
+
+
+# ===================== DATASET =====================
+
+class CachedImageDataset(Dataset):
+    """
+    Dataset поверх собранного шарда: (тензор [3, H, W], метка).
+
+    Изображение берётся из mmap без копии, на лету только перевод в float,
+    нормализация и (если hflip > 0) случайное отражение по горизонтали.
+    Атрибуты classes / class_to_idx / targets — как у ImageFolder.
+    Файл открывается лениво в каждом процессе DataLoader, поэтому при
+    spawn-воркерах шард не копируется через pickle.
+    """
+
+    def __init__(self, cache_dir, normalize=True, hflip=0.0):
+        meta = read_meta(cache_dir)
+        if meta is None:
+            raise FileNotFoundError(f"Кэш не найден: {cache_dir} (соберите build_cache)")
+        self.cache_dir = cache_dir
+        self.meta = meta
+        self.classes = meta["classes"]
+        self.class_to_idx = meta["class_to_idx"]
+        self.targets = np.load(os.path.join(cache_dir, LABELS_FILE)).tolist()
+        self.hflip = hflip
+        self.normalize = normalize
+        std = torch.tensor(meta["spec"]["std"]).view(3, 1, 1)
+        mean = torch.tensor(meta["spec"]["mean"]).view(3, 1, 1)
+        # (x / 255 - mean) / std == x * scale - shift — как в Preprocessor
+        self._scale = 1.0 / (255.0 * std)
+        self._shift = mean / std
+        self._images = None
+
+    @property
+    def images(self):
+        if self._images is None:
+            self._images = np.load(os.path.join(self.cache_dir, IMAGES_FILE), mmap_mode="r")
+        return self._images
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_images"] = None
+        return state
+
+    def __len__(self):
+        return len(self.targets)
+
+    def __getitem__(self, index):
+        x = torch.from_numpy(np.ascontiguousarray(self.images[index])).float()
+        if self.hflip and torch.rand(()) < self.hflip:
+            x = x.flip(-1)
+        if self.normalize:
+            x = x.mul_(self._scale).sub_(self._shift)
+        return x, self.targets[index]
+
+
+def cached_image_folder(root, model_name, cache_dir=None, hflip=0.0, log=print):
+    """Замена datasets.ImageFolder(root, transform): собирает кэш при первом вызове."""
+    cache_dir = cache_dir or default_cache_dir(model_name, root)
+    build_cache(root, cache_dir, PREPROCESS_SPECS[model_name], log=log)
+    return CachedImageDataset(cache_dir, hflip=hflip)
+
+
+# ===================== ПРОВЕРКА И ЗАМЕР =====================
+
+def check_parity(root, dataset, spec, samples=16):
+    """Совпадение классов, меток и пикселей с ImageFolder + torchvision-преобразованием."""
+    reference = Preprocessor(spec, fast_decode=False).reference_transform()
+    folder = datasets.ImageFolder(root, transform=reference)
+    assert folder.class_to_idx == dataset.class_to_idx, "class_to_idx не совпадает"
+    assert folder.targets == dataset.targets, "метки не совпадают"
+    step = max(1, len(folder) // samples)
+    diff = 0.0
+    for i in range(0, len(folder), step):
+        diff = max(diff, (folder[i][0] - dataset[i][0]).abs().max().item())
+    return diff
+
+
+def epoch_time(dataset, batch_size=64, workers=0):
+    """Одна эпоха чтения (без модели): только загрузка и предобработка."""
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=True, num_workers=workers)
+    start = time.perf_counter()
+    for _ in loader:
+        pass
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    # python -m models.dataset_cache data/intel/seg_train/seg_train --model intel --check --benchmark
+    parser = argparse.ArgumentParser(description="Кэш предобработанного датасета (uint8 mmap)")
+    parser.add_argument("root", help="каталог в формате ImageFolder")
+    parser.add_argument("--model", choices=list(PREPROCESS_SPECS), required=True,
+                        help="чья предобработка (размер, нормализация)")
+    parser.add_argument("--out", help="каталог кэша (по умолчанию data/cache/...)")
+    parser.add_argument("--force", action="store_true", help="пересобрать")
+    parser.add_argument("--check", action="store_true", help="сравнить с ImageFolder")
+    parser.add_argument("--benchmark", action="store_true", help="время эпохи до и после")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=0, help="num_workers для замера")
+    args = parser.parse_args()
+
+    spec = PREPROCESS_SPECS[args.model]
+    cache_dir = args.out or default_cache_dir(args.model, args.root)
+    meta = build_cache(args.root, cache_dir, spec, force=args.force)
+    size_mb = os.path.getsize(os.path.join(cache_dir, IMAGES_FILE)) / 1024 / 1024
+    print(f"Кэш {cache_dir}: {meta['count']} изображений, {len(meta['classes'])} классов, "
+          f"{size_mb:.0f} МБ, сборка {meta['build_time']:.1f} с")
+
+    dataset = CachedImageDataset(cache_dir)
+    if args.check:
+        diff = check_parity(args.root, dataset, spec)
+        print(f"Классы и метки совпадают с ImageFolder, max |diff| пикселей = {diff:.2e}")
+    if args.benchmark:
+        # «До» — как в ноутбуках: ImageFolder + transforms.Compose на каждой эпохе
+        folder = datasets.ImageFolder(args.root,
+                                      transform=Preprocessor(spec).reference_transform())
+        before = epoch_time(folder, args.batch_size, args.workers)
+        after = epoch_time(dataset, args.batch_size, args.workers)
+        print(f"Эпоха: ImageFolder {before:.1f} с, кэш {after:.1f} с (x{before / after:.1f}), "
+              f"num_workers={args.workers}")
@@ -0,0 +1,335 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import torch
+import torch.nn.functional as F
+from torch.utils.data import Dataset
+from torchvision.models import MobileNet_V3_Large_Weights, MobileNet_V3_Small_Weights
+
+from models.feature_cache import check_deterministic, dataset_fingerprint
+from models.metrics import MetricsAccumulator, evaluate, metrics_path
+from models.preprocessing import PREPROCESS_SPECS
+from models.quantization import measure_latency
+from models.registry import (CHECKPOINTS, ModelSpec, build_mobilenet, build_model,
+                             checkpoint_version, load_eager, student_path)
+from models.training import (BATCH_SIZE, DATA_DIRS, SEED, Trainer, make_datasets, make_loader,
+                             save_checkpoint)
+
+# ===================== КОНСТАНТЫ =====================
+
+# Ученики: mobilenet_v3_* стартуют с весов ImageNet, resnet10 — с блоков учителя
+STUDENTS = ("mobilenet_v3_small", "mobilenet_v3_large", "resnet10")
+DEFAULT_STUDENT = "mobilenet_v3_small"
+IMAGENET_WEIGHTS = {
+    "mobilenet_v3_small": MobileNet_V3_Small_Weights.DEFAULT,
+    "mobilenet_v3_large": MobileNet_V3_Large_Weights.DEFAULT,
+}
+
+TEMPERATURE = 4.0
+ALPHA = 0.7                 # вес мягких целей учителя, 1 - ALPHA — обычная CE по меткам
+EPOCHS = {"sports": 20, "blood_cells": 15, "intel": 10}
+LR = 1e-3
+
+# Логиты учителя на обучающей выборке: считаются один раз на (чекпоинт, датасет)
+TEACHER_LOGITS_ROOT = os.path.join("data", "cache", "teacher_logits")
+LATENCY_BATCHES = (1, 32)
+
+
+def resolve_dirs(model_name, train_dir=None, valid_dir=None):
+    """Папки по умолчанию — как у models.training."""
+    default_train, default_valid = DATA_DIRS[model_name]
+    train_dir = train_dir or default_train
+    return train_dir, valid_dir or (default_valid if train_dir == default_train else None)
+
+
+def teacher_spec(name):
+    """Спецификация учителя — исходный ResNet18, даже если MODEL_ARCH переключил страницу на ученика."""
+    path, num_classes = CHECKPOINTS[name]
+    return ModelSpec(name, path, num_classes)
+
+
+def report_path(checkpoint):
+    """models/intel_model.mobilenet_v3_small.pt -> models/intel_model.mobilenet_v3_small.distillation.json"""
+    return os.path.splitext(checkpoint)[0] + ".distillation.json"
+
+
+# ===================== УЧИТЕЛЬ =====================
+
+def teacher_logits_path(name, teacher_path, dataset):
+    key = hashlib.sha256(f"{checkpoint_version(teacher_path)}\n"
+                         f"{dataset_fingerprint(dataset)}".encode()).hexdigest()[:16]
+    return os.path.join(TEACHER_LOGITS_ROOT, f"{name}-{key}.pt")
+
+
+def teacher_logits(teacher, dataset, path, batch_size=BATCH_SIZE, workers=0, log=print):
+    """[N, C] float32 — логиты учителя в порядке dataset; из path, если уже посчитаны."""
+    if os.path.exists(path):
+        log(f"Логиты учителя из кэша {path}")
+        return torch.load(path)
+    check_deterministic(dataset, "Логиты учителя")
+    loader = make_loader(dataset, batch_size, False, workers)
+    chunks = []
+    teacher.eval()
+    with torch.inference_mode():
+        for images, _ in loader:
+            chunks.append(teacher(images).float())
+            log(f"  учитель: {sum(len(c) for c in chunks)}/{len(dataset)} изображений")
+    logits = torch.cat(chunks)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    torch.save(logits, path + ".tmp")
+    os.replace(path + ".tmp", path)
+    return logits
+
+
+class WithTeacherLogits(Dataset):
+    """(image, label) -> (image, label, логиты учителя) по тому же индексу."""
+
+    def __init__(self, dataset, logits):
+        if len(dataset) != len(logits):
+            raise ValueError(f"{len(logits)} логитов на {len(dataset)} изображений")
+        self.dataset = dataset
+        self.logits = logits
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def __getitem__(self, index):
+        image, label = self.dataset[index]
+        return image, label, self.logits[index]
+
+
+# ===================== УЧЕНИК =====================
+
+def initial_student(arch, num_classes, teacher=None):
+    """
+    Ученик с новой головой. MobileNetV3 — с весами ImageNet; resnet10 берёт
+    у учителя stem, первый блок каждой стадии и fc (имена слоёв совпадают).
+    """
+    if arch in IMAGENET_WEIGHTS:
+        return build_mobilenet(arch, num_classes, IMAGENET_WEIGHTS[arch])
+    model = build_model(arch, num_classes)
+    if teacher is not None:
+        own = model.state_dict()
+        shared = {k: v for k, v in teacher.state_dict().items()
+                  if k in own and v.shape == own[k].shape}
+        model.load_state_dict(shared, strict=False)
+    return model
+
+
+def distillation_loss(student, teacher, labels, temperature=TEMPERATURE, alpha=ALPHA):
+    """
+    alpha · T² · KL(softmax(t / T) ‖ softmax(s / T)) + (1 - alpha) · CE(s, labels).
+
+    T² возвращает градиенту мягкой части тот же масштаб, что у CE.
+    Считается во float32 и при bf16-autocast.
+    """
+    student = student.float()
+    soft = F.kl_div(F.log_softmax(student / temperature, dim=1),
+                    F.log_softmax(teacher.float() / temperature, dim=1),
+                    reduction="batchmean", log_target=True)
+    hard = F.cross_entropy(student, labels)
+    return alpha * temperature ** 2 * soft + (1 - alpha) * hard
+
+
+class DistillationTrainer(Trainer):
+    """Trainer, у которого батчи обучения несут логиты учителя; валидация — обычная CE."""
+
+    def __init__(self, model, num_classes, temperature=TEMPERATURE, alpha=ALPHA, **kwargs):
+        super().__init__(model, num_classes, **kwargs)
+        self.temperature = temperature
+        self.alpha = alpha
+
+    def loss(self, logits, batch):
+        if len(batch) < 3:
+            return super().loss(logits, batch)
+        return distillation_loss(logits, batch[2], batch[1], self.temperature, self.alpha)
+
+
+def distill(model_name, arch=DEFAULT_STUDENT, train_dir=None, valid_dir=None, output=None,
+            epochs=None, lr=LR, temperature=TEMPERATURE, alpha=ALPHA, batch_size=BATCH_SIZE,
+            workers=0, bf16=False, channels_last=False, mmap_dataset=False, overwrite=False,
+            log=print):
+    """
+    Обучение ученика arch на мягких целях учителя (ResNet18 страницы).
+
+    Чекпоинт с лучшим macro F1 на валидации сохраняется в output (по
+    умолчанию — туда, откуда его возьмёт страница при MODEL_ARCH) вместе
+    с *.metrics.json. Уже сохранённый ученик заменяется, только если новый
+    лучше его F1 из *.metrics.json (или overwrite=True). Возвращает (отчёт,
+    валидационный датасет).
+    """
+    torch.manual_seed(SEED)
+    train_dir, valid_dir = resolve_dirs(model_name, train_dir, valid_dir)
+    epochs = epochs or EPOCHS[model_name]
+    teacher_path = teacher_spec(model_name).path
+    output = output or student_path(teacher_path, arch)
+    previous_f1 = -1.0 if overwrite else previous_best_f1(output)
+
+    train_set, valid_set, classes = make_datasets(model_name, train_dir, valid_dir, mmap_dataset)
+    teacher = load_eager(teacher_spec(model_name))
+    start = time.perf_counter()
+    logits = teacher_logits(teacher, train_set,
+                            teacher_logits_path(model_name, teacher_path, train_set),
+                            batch_size, workers, log)
+    logits_time = time.perf_counter() - start
+
+    student = initial_student(arch, len(classes), teacher)
+    del teacher
+    trainer = DistillationTrainer(student, len(classes), temperature, alpha,
+                                  bf16=bf16, channels_last=channels_last)
+    train_loader = make_loader(WithTeacherLogits(train_set, logits), batch_size, True, workers)
+    valid_loader = make_loader(valid_set, batch_size, False, workers)
+    optimizer = torch.optim.AdamW(student.parameters(), lr=lr)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, T_max=epochs)
+
+    history = {"train_loss": [], "train_acc": [], "valid_loss": [], "valid_acc": [],
+               "valid_f1": [], "epoch_time": []}
+    best_f1, best_epoch = previous_f1, None
+    if previous_f1 >= 0:
+        log(f"{output} уже есть (macro F1 {previous_f1:.4f}): заменится только лучшим учеником")
+    start = time.perf_counter()
+    for epoch in range(epochs):
+        epoch_start = time.perf_counter()
+        train_loss, train_metrics = trainer.run_epoch(train_loader, optimizer)
+        valid_loss, valid_metrics = trainer.run_epoch(valid_loader)
+        scheduler.step()
+        history["train_loss"].append(train_loss)
+        history["train_acc"].append(train_metrics.accuracy)
+        history["valid_loss"].append(valid_loss)
+        history["valid_acc"].append(valid_metrics.accuracy)
+        history["valid_f1"].append(valid_metrics.macro_f1)
+        history["epoch_time"].append(time.perf_counter() - epoch_start)
+        improved = valid_metrics.macro_f1 > best_f1
+        if improved:
+            best_f1, best_epoch = valid_metrics.macro_f1, epoch + 1
+            save_checkpoint(student, output)
+            valid_metrics.class_names = classes
+            valid_metrics.save(metrics_path(output))
+        log(f"  эпоха {epoch + 1}/{epochs}: train loss {train_loss:.4f} "
+            f"acc {train_metrics.accuracy:.3f} | valid loss {valid_loss:.4f} "
+            f"acc {valid_metrics.accuracy:.3f} f1 {valid_metrics.macro_f1:.3f} | "
+            f"{history['epoch_time'][-1]:.1f} с{' *' if improved else ''}")
+
+    report = {
+        "model": model_name, "arch": arch, "teacher": teacher_path, "checkpoint": output,
+        "classes": classes,
+        "settings": {"epochs": epochs, "lr": lr, "temperature": temperature, "alpha": alpha,
+                     "batch_size": batch_size, "workers": workers, "bf16": bf16,
+                     "channels_last": channels_last},
+        "teacher_logits_time": logits_time,
+        "history": history, "best_epoch": best_epoch, "best_valid_f1": best_f1,
+        "previous_valid_f1": previous_f1 if previous_f1 >= 0 else None,
+        "train_time": time.perf_counter() - start,
+    }
+    return report, valid_set
+
+
+def previous_best_f1(output):
+    """macro F1 уже сохранённого ученика (-1, если его нет); без *.metrics.json — ошибка."""
+    if not os.path.exists(output):
+        return -1.0
+    path = metrics_path(output)
+    if not os.path.exists(path):
+        raise FileExistsError(f"{output} уже есть, но без {path}: не с чем сравнить нового "
+                              f"ученика — укажите другой --output или --overwrite")
+    # F1 пересчитывается из матрицы ошибок, а не берётся из summary
+    return MetricsAccumulator.load(path).macro_f1
+
+
+# ===================== СРАВНЕНИЕ =====================
+
+def profile(model, path, loader, num_classes, input_size, batch_sizes=LATENCY_BATCHES):
+    """Латентность по размерам батча, размер на диске, число параметров, accuracy и F1."""
+    model.eval()
+    metrics = evaluate(model, loader, num_classes)
+    return {
+        "latency_ms": {str(b): measure_latency(model, (b, 3, *input_size)) * 1000
+                       for b in batch_sizes},
+        "size_mb": os.path.getsize(path) / 1024 / 1024,
+        "params_m": sum(p.numel() for p in model.parameters()) / 1e6,
+        "accuracy": metrics.accuracy,
+        "macro_f1": metrics.macro_f1,
+        "weighted_f1": metrics.weighted_f1,
+    }
+
+
+def compare(model_name, student_checkpoint, arch, valid_set, batch_size=BATCH_SIZE, workers=0):
+    """Учитель против ученика на одной и той же валидации и одном числе потоков."""
+    teacher = teacher_spec(model_name)
+    student = ModelSpec(model_name, student_checkpoint, teacher.num_classes, arch=arch)
+    loader = make_loader(valid_set, batch_size, False, workers)
+    input_size = PREPROCESS_SPECS[model_name].output_size
+    result = {"threads": torch.get_num_threads(), "images": len(valid_set)}
+    for role, spec in (("teacher", teacher), ("student", student)):
+        result[role] = dict(profile(load_eager(spec), spec.path, loader, spec.num_classes,
+                                    input_size), arch=spec.arch, checkpoint=spec.path)
+    t, s = result["teacher"], result["student"]
+    result["speedup"] = {b: t["latency_ms"][b] / s["latency_ms"][b] for b in t["latency_ms"]}
+    result["size_ratio"] = s["size_mb"] / t["size_mb"]
+    result["delta_accuracy"] = s["accuracy"] - t["accuracy"]
+    result["delta_macro_f1"] = s["macro_f1"] - t["macro_f1"]
+    return result
+
+
+def print_comparison(result):
+    rows = (("арх.", "arch", "{}"), ("размер, МБ", "size_mb", "{:.1f}"),
+            ("параметров, M", "params_m", "{:.2f}"), ("accuracy", "accuracy", "{:.4f}"),
+            ("macro F1", "macro_f1", "{:.4f}"))
+    print(f"{'':16s}{'учитель':>20s}{'ученик':>20s}")
+    for title, key, fmt in rows:
+        print(f"{title:16s}{fmt.format(result['teacher'][key]):>20s}"
+              f"{fmt.format(result['student'][key]):>20s}")
+    for b, speedup in result["speedup"].items():
+        print(f"{'батч ' + b + ', мс':16s}{result['teacher']['latency_ms'][b]:>20.1f}"
+              f"{result['student']['latency_ms'][b]:>20.1f}   ×{speedup:.2f}")
+    print(f"Δ accuracy {result['delta_accuracy']:+.4f}, Δ macro F1 {result['delta_macro_f1']:+.4f} "
+          f"на {result['images']} изобр., {result['threads']} потоков")
+
+
+if __name__ == "__main__":
+    # python -m models.distillation intel --arch mobilenet_v3_small --workers 4
+    # MODEL_ARCH="intel=mobilenet_v3_small" streamlit run main.py
+    parser = argparse.ArgumentParser(description="Дистилляция ResNet18 страницы в компактного ученика")
+    parser.add_argument("model", choices=list(CHECKPOINTS))
+    parser.add_argument("--arch", choices=STUDENTS, default=DEFAULT_STUDENT)
+    parser.add_argument("--train-dir", help="ImageFolder для обучения (по умолчанию как в ноутбуке)")
+    parser.add_argument("--valid-dir", help="ImageFolder для валидации (иначе 80/20 от train)")
+    parser.add_argument("-o", "--output", help="куда сохранить state_dict ученика")
+    parser.add_argument("--epochs", type=int, help="по умолчанию EPOCHS[модель]")
+    parser.add_argument("--lr", type=float, default=LR)
+    parser.add_argument("--temperature", type=float, default=TEMPERATURE)
+    parser.add_argument("--alpha", type=float, default=ALPHA, help="вес мягких целей учителя")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument("--bf16", action="store_true", help="autocast в bfloat16")
+    parser.add_argument("--channels-last", action="store_true")
+    parser.add_argument("--mmap-dataset", action="store_true",
+                        help="изображения из кэша models.dataset_cache")
+    parser.add_argument("--overwrite", action="store_true",
+                        help="заменить сохранённого ученика, даже если он лучше нового")
+    parser.add_argument("--compare-only", action="store_true",
+                        help="не обучать: сравнить уже сохранённого ученика с учителем")
+    args = parser.parse_args()
+
+    if args.compare_only:
+        checkpoint = args.output or student_path(teacher_spec(args.model).path, args.arch)
+        _, valid_set, _ = make_datasets(args.model, *resolve_dirs(args.model, args.train_dir,
+                                                                  args.valid_dir),
+                                        args.mmap_dataset)
+        report = {"model": args.model, "arch": args.arch, "checkpoint": checkpoint}
+    else:
+        report, valid_set = distill(args.model, args.arch, args.train_dir, args.valid_dir,
+                                    args.output, args.epochs, args.lr, args.temperature,
+                                    args.alpha, args.batch_size, args.workers, args.bf16,
+                                    args.channels_last, args.mmap_dataset, args.overwrite)
+        checkpoint = report["checkpoint"]
+
+    report["comparison"] = compare(args.model, checkpoint, args.arch, valid_set,
+                                   args.batch_size, args.workers)
+    with open(report_path(checkpoint), "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print_comparison(report["comparison"])
+    print(f"Отчёт: {report_path(checkpoint)}; на странице: MODEL_ARCH=\"{args.model}={args.arch}\"")
@@ -0,0 +1,470 @@
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from functools import partial
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from models.preprocessing import PREPROCESS_SPECS, get_preprocessor
+from models.registry import TEACHER_ARCH, MODEL_SPECS, checkpoint_version, get_model, spec_version
+from models.scheduler import get_scheduler
+from models.shared_trunk import STAGES, run_stages
+from models.telemetry import count
+
+logger = logging.getLogger(__name__)
+
+# ===================== КОНСТАНТЫ =====================
+
+EMBED_DIM = 512
+TRUNK = STAGES[:-1]           # всё до fc: выход avgpool
+INDEX_DIR = os.path.join("data", "index")
+
+STORAGES = ("fp32", "fp16", "pq")
+PQ_SUBSPACES = 64             # 512 / 64 = 8 измерений на подпространство
+PQ_CENTROIDS = 256            # код подпространства — один байт
+PQ_ITERATIONS = 20
+SEARCH_CHUNK = 8192
+
+# Модели, для которых почти-дубликаты отвечают из кэша, например NEAR_DUPLICATES="sports,intel"
+NEAR_DUPLICATE_MODELS = tuple(n for n in os.environ.get("NEAR_DUPLICATES", "").split(",") if n)
+# Порог косинусного расстояния (1 - cos) до ранее классифицированного изображения
+NEAR_DUP_DISTANCE = float(os.environ.get("NEAR_DUP_DISTANCE", 0.02))
+NEAR_DUP_CAPACITY = int(os.environ.get("NEAR_DUP_CAPACITY", 10_000))
+SAVE_EVERY = 256
+
+TIER_NEAR_DUP = "near_dup"
+
+
+def has_trunk(spec):
+    """
+    Эмбеддинг — выход avgpool после стадий STAGES (ResNet18, 512). У учеников
+    другой каркас: у resnet10 нет layerN.1, у MobileNet — ни одной из стадий.
+    """
+    return spec.arch == TEACHER_ARCH
+
+
+def embed(model, batch):
+    """[N, 3, H, W] -> L2-нормированные эмбеддинги avgpool [N, 512] (и признаки до нормировки)."""
+    features = run_stages(model, batch, TRUNK).flatten(1)
+    return F.normalize(features, dim=1), features
+
+
+def _save_npz(path, **arrays):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path[:-len(".npz")] + ".tmp.npz"
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+
+
+# ===================== PRODUCT QUANTIZATION =====================
+
+def _kmeans(x, k, iterations, rng):
+    centroids = x[rng.choice(len(x), k, replace=len(x) < k)].copy()
+    for _ in range(iterations):
+        distances = ((x * x).sum(1)[:, None] - 2 * x @ centroids.T
+                     + (centroids * centroids).sum(1)[None, :])
+        assign = distances.argmin(1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, x)
+        counts = np.bincount(assign, minlength=k)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+class ProductQuantizer:
+    """
+    512-d вектор -> PQ_SUBSPACES байт: в каждом подпространстве из 8 измерений
+    хранится номер ближайшего из 256 центроидов. Скалярное произведение
+    запроса с кодом — сумма по таблице [подпространство, центроид].
+    """
+
+    def __init__(self, centroids=None, subspaces=PQ_SUBSPACES):
+        self.subspaces = subspaces
+        self.centroids = centroids    # [M, K, D / M]
+
+    def train(self, x, iterations=PQ_ITERATIONS, seed=0):
+        rng = np.random.default_rng(seed)
+        parts = np.split(x.astype(np.float32), self.subspaces, axis=1)
+        self.centroids = np.stack([_kmeans(p, PQ_CENTROIDS, iterations, rng) for p in parts])
+        return self
+
+    def encode(self, x):
+        parts = np.split(x.astype(np.float32), self.subspaces, axis=1)
+        codes = [(-2 * p @ c.T + (c * c).sum(1)[None, :]).argmin(1)
+                 for p, c in zip(parts, self.centroids)]
+        return np.stack(codes, axis=1).astype(np.uint8)
+
+    def scores(self, queries, codes):
+        """Асимметричные скалярные произведения [Q, N]."""
+        parts = np.split(queries.astype(np.float32), self.subspaces, axis=1)
+        table = np.stack([p @ c.T for p, c in zip(parts, self.centroids)], axis=1)   # [Q, M, K]
+        rows = np.arange(self.subspaces)[None, :]
+        return np.stack([t[rows, codes].sum(1) for t in table])
+
+
+# ===================== ИНДЕКС =====================
+
+class EmbeddingIndex:
+    """
+    Поиск ближайших по косинусу среди L2-нормированных эмбеддингов.
+
+    storage: fp32; fp16 — вдвое меньше, скалярные произведения считаются
+    блоками в fp32; pq — 64 байта на вектор вместо 2048. payloads — по
+    одной JSON-записи на вектор (путь, класс). Хранится одним .npz.
+    """
+
+    def __init__(self, storage="fp16", meta=None):
+        if storage not in STORAGES:
+            raise ValueError(f"Неизвестный формат хранения: {storage}")
+        self.storage = storage
+        self.meta = dict(meta or {})
+        self.data = np.zeros((0, PQ_SUBSPACES if storage == "pq" else EMBED_DIM),
+                             dtype={"fp32": np.float32, "fp16": np.float16, "pq": np.uint8}[storage])
+        self.pq = None
+        self.payloads = []
+
+    @classmethod
+    def build(cls, vectors, payloads, storage="fp16", meta=None):
+        index = cls(storage, meta)
+        if storage == "pq":
+            index.pq = ProductQuantizer().train(vectors)
+        index.add(vectors, payloads)
+        return index
+
+    def add(self, vectors, payloads):
+        data = self.pq.encode(vectors) if self.storage == "pq" else vectors.astype(self.data.dtype)
+        self.data = np.concatenate([self.data, data])
+        self.payloads.extend(payloads)
+
+    def __len__(self):
+        return len(self.payloads)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + (self.pq.centroids.nbytes if self.pq is not None else 0)
+
+    def similarities(self, queries):
+        queries = np.asarray(queries, dtype=np.float32)
+        if self.storage == "pq":
+            return self.pq.scores(queries, self.data)
+        return np.concatenate([
+            queries @ self.data[i:i + SEARCH_CHUNK].astype(np.float32).T
+            for i in range(0, len(self.data), SEARCH_CHUNK)
+        ] or [np.zeros((len(queries), 0), np.float32)], axis=1)
+
+    def search(self, queries, k=5):
+        """(косинусные сходства [Q, k], номера [Q, k]) по убыванию сходства."""
+        sims = self.similarities(queries)
+        k = min(k, sims.shape[1])
+        if k == 0:
+            return sims[:, :0], np.zeros((len(sims), 0), dtype=np.int64)
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        top_sims = np.take_along_axis(sims, top, axis=1)
+        order = np.argsort(-top_sims, axis=1)
+        return np.take_along_axis(top_sims, order, axis=1), np.take_along_axis(top, order, axis=1)
+
+    def save(self, path):
+        meta = dict(self.meta, storage=self.storage, payloads=self.payloads)
+        arrays = {"data": self.data, "meta": np.array(json.dumps(meta, ensure_ascii=False))}
+        if self.pq is not None:
+            arrays["centroids"] = self.pq.centroids
+        _save_npz(path, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            meta = json.loads(str(f["meta"]))
+            index = cls(meta.pop("storage"))
+            index.payloads = meta.pop("payloads")
+            index.meta = meta
+            index.data = f["data"]
+            if "centroids" in f:
+                index.pq = ProductQuantizer(f["centroids"])
+        return index
+
+
+# ===================== ПОЧТИ-ДУБЛИКАТЫ =====================
+
+class NearDuplicateCache:
+    """
+    Кольцо последних классифицированных эмбеддингов и их логитов.
+
+    Если новое изображение ближе NEAR_DUP_DISTANCE (1 - cos) к одному из
+    них — это пересжатие или обрезка уже виденного, и отдаются сохранённые
+    логиты. В памяти fp32 (10 000 × 512 = 20 МБ), на диске — fp16; файл
+    привязан к версии модели и сохраняется каждые SAVE_EVERY новых записей:
+    под замком снимается копия, запись на диск — в фоновом потоке, чтобы
+    не держать замок и воркер планировщика.
+    """
+
+    def __init__(self, name, num_classes, version="", capacity=NEAR_DUP_CAPACITY,
+                 distance=NEAR_DUP_DISTANCE, path=None):
+        self.name = name
+        self.version = version
+        self.distance = distance
+        self.path = path
+        self.vectors = np.zeros((capacity, EMBED_DIM), dtype=np.float32)
+        self.logits = np.zeros((capacity, num_classes), dtype=np.float32)
+        self.size = 0
+        self.pos = 0
+        self._unsaved = 0
+        self._saving = False
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            self._load()
+
+    def lookup(self, vectors):
+        """(маска попаданий [N], логиты попаданий [hits, C])."""
+        with self._lock:
+            if self.size == 0:
+                return np.zeros(len(vectors), dtype=bool), self.logits[:0]
+            sims = vectors @ self.vectors[:self.size].T
+            best = sims.argmax(1)
+            hits = 1 - sims[np.arange(len(vectors)), best] <= self.distance
+            return hits, self.logits[best[hits]].copy()
+
+    def add(self, vectors, logits):
+        snapshot = None
+        with self._lock:
+            capacity = len(self.vectors)
+            for vector, row in zip(vectors, logits):
+                self.vectors[self.pos] = vector
+                self.logits[self.pos] = row
+                self.pos = (self.pos + 1) % capacity
+                self.size = min(self.size + 1, capacity)
+            self._unsaved += len(vectors)
+            # Пока идёт прошлое сохранение, новое не начинаем: записи дождутся следующего
+            if self.path and self._unsaved >= SAVE_EVERY and not self._saving:
+                snapshot = self._snapshot()
+                self._unsaved = 0
+                self._saving = True
+        if snapshot is not None:
+            threading.Thread(target=self._save, args=(snapshot,), daemon=True,
+                             name=f"near-dup-save-{self.name}").start()
+
+    def _snapshot(self):
+        # Вызывается под self._lock; astype и copy — копии, кольцо можно менять дальше
+        return {"vectors": self.vectors[:self.size].astype(np.float16),
+                "logits": self.logits[:self.size].copy(),
+                "pos": self.pos, "version": np.array(self.version)}
+
+    def _save(self, snapshot):
+        try:
+            _save_npz(self.path, **snapshot)
+        except OSError as e:
+            logger.warning("Не удалось сохранить %s: %s", self.path, e)
+        finally:
+            with self._lock:
+                self._saving = False
+
+    def _load(self):
+        with np.load(self.path) as f:
+            if str(f["version"]) != self.version or f["logits"].shape[1] != self.logits.shape[1]:
+                return
+            n = min(len(f["vectors"]), len(self.vectors))
+            self.vectors[:n] = f["vectors"][:n]
+            self.logits[:n] = f["logits"][:n]
+            self.size, self.pos = n, int(f["pos"]) % len(self.vectors)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_near_duplicate_cache(name):
+    """Кэш почти-дубликатов модели (один на процесс и версию чекпоинта)."""
+    spec = MODEL_SPECS[name]
+    version = spec_version(spec)
+    with _caches_lock:
+        cache = _caches.get(name)
+        if cache is None or cache.version != version:
+            cache = NearDuplicateCache(name, spec.num_classes, version,
+                                       path=os.path.join(INDEX_DIR, f"{name}-recent.npz"))
+            _caches[name] = cache
+        return cache
+
+
+class IndexedModel:
+    """
+    Модель страницы с ответом для почти-дубликатов.
+
+    Ствол считается всегда (эмбеддинг avgpool — побочный продукт обычного
+    forward); для попаданий в NearDuplicateCache голова и всё, что после
+    неё, не выполняются, а в Prediction.tier пишется "near_dup". Forward идёт
+    в воркерах планировщика, но без склейки микробатчей — страница и так
+    присылает батч целиком. Входы другого размера (малое разрешение каскада)
+    проходят без индекса. record=False (прогрев) — тот же путь, но кэш не
+    читается и не пополняется: шумовые картинки не должны попасть в ответы.
+    """
+
+    def __init__(self, name, record=True):
+        self.name = name
+        self.record = record
+        self.resolution = PREPROCESS_SPECS[name].output_size
+
+    def forward_with_tiers(self, batch):
+        job = self._forward if tuple(batch.shape[2:]) == self.resolution else self._plain
+        return get_scheduler().submit(self.name, partial(job, batch), batch.shape[0]).result()
+
+    def _plain(self, batch):
+        with torch.no_grad():
+            return get_model(self.name)(batch), [None] * batch.shape[0]
+
+    def _forward(self, batch):
+        model = get_model(self.name)
+        cache = get_near_duplicate_cache(self.name) if self.record else None
+        with torch.no_grad():
+            vectors, features = embed(model, batch)
+            vectors = vectors.numpy()
+            if cache is not None:
+                hits, cached = cache.lookup(vectors)
+            else:
+                hits, cached = np.zeros(len(vectors), dtype=bool), None
+            logits = torch.empty(batch.shape[0], model.fc.out_features)
+            misses = ~hits
+            if misses.any():
+                logits[torch.from_numpy(misses)] = model.fc(features[torch.from_numpy(misses)])
+                if cache is not None:
+                    cache.add(vectors[misses], logits[torch.from_numpy(misses)].numpy())
+            if hits.any():
+                logits[torch.from_numpy(hits)] = torch.from_numpy(cached)
+        count("near_duplicate_hits_total", int(hits.sum()), model=self.name)
+        return logits, [TIER_NEAR_DUP if h else None for h in hits.tolist()]
+
+    def __call__(self, batch):
+        return self.forward_with_tiers(batch)[0]
+
+    def eval(self):
+        return self
+
+    def to(self, *args, **kwargs):
+        return self
+
+
+def maybe_indexed(name, model, record=True):
+    """Для моделей из NEAR_DUPLICATES (eager fp32) — IndexedModel, иначе model как есть."""
+    spec = MODEL_SPECS[name]
+    if name not in NEAR_DUPLICATE_MODELS:
+        return model
+    if spec.precision != "fp32" or spec.backend != "eager":
+        logger.warning("NEAR_DUPLICATES для %s работает только с eager fp32", name)
+        return model
+    if not has_trunk(spec):
+        logger.warning("NEAR_DUPLICATES для %s работает только с ResNet18 (сейчас %s)", name, spec.arch)
+        return model
+    return IndexedModel(name, record)
+
+
+# ===================== ПОХОЖИЕ ИЗ ОБУЧАЮЩЕЙ ВЫБОРКИ =====================
+
+def training_index_path(name):
+    return os.path.join(INDEX_DIR, f"{name}-train.npz")
+
+
+def build_training_index(name, root, storage="pq", batch_size=64, workers=0, log=print):
+    """Эмбеддинги всех изображений ImageFolder-дерева root -> data/index/<модель>-train.npz."""
+    from torchvision import datasets
+
+    spec = MODEL_SPECS[name]
+    model = get_model(name)
+    folder = datasets.ImageFolder(root, transform=get_preprocessor(name).reference_transform())
+    loader = torch.utils.data.DataLoader(folder, batch_size=batch_size, num_workers=workers)
+    vectors = []
+    with torch.inference_mode():
+        for images, _ in loader:
+            vectors.append(embed(model, images)[0].numpy())
+            log(f"{sum(len(v) for v in vectors)}/{len(folder)} изображений")
+    payloads = [{"path": os.path.relpath(path), "label": folder.classes[target]}
+                for path, target in folder.samples]
+    meta = {"model": name, "root": os.path.abspath(root),
+            "source_version": checkpoint_version(spec.path)}
+    index = EmbeddingIndex.build(np.concatenate(vectors), payloads, storage, meta)
+    index.save(training_index_path(name))
+    return index
+
+
+_training = {}
+_training_lock = threading.Lock()
+
+
+def get_training_index(name):
+    """
+    Индекс обучающей выборки или None. Перечитывается при изменении файла
+    индекса или чекпоинта; индекс, построенный другой версией чекпоинта,
+    не используется — его эмбеддинги несравнимы с эмбеддингами новой модели.
+    """
+    spec = MODEL_SPECS[name]
+    path = training_index_path(name)
+    if not has_trunk(spec) or not os.path.exists(path):
+        return None
+    key = (os.path.getmtime(path), checkpoint_version(spec.path))
+    with _training_lock:
+        entry = _training.get(name)
+        if entry is None or entry[0] != key:
+            index = EmbeddingIndex.load(path)
+            if index.meta.get("source_version") != key[1]:
+                logger.warning("%s построен для другой версии чекпоинта, пересоберите: "
+                               "python -m models.embedding_index build %s <root>", path, name)
+                index = None
+            entry = (key, index)
+            _training[name] = entry
+        return entry[1]
+
+
+def similar_images(name, image, n=5):
+    """[(payload, сходство)] — n ближайших к PIL-изображению из обучающей выборки."""
+    index = get_training_index(name)
+    if index is None:
+        return []
+    batch = get_preprocessor(name)(image).unsqueeze(0)
+
+    def job():
+        with torch.no_grad():
+            return embed(get_model(name), batch)[0].numpy()
+
+    vectors = get_scheduler().submit(name, job, 1).result()
+    sims, ids = index.search(vectors, n)
+    return [(index.payloads[i], float(s)) for s, i in zip(sims[0], ids[0])]
+
+
+if __name__ == "__main__":
+    # python -m models.embedding_index build intel data/intel/seg_train/seg_train --storage pq
+    # python -m models.embedding_index query intel images/sea_for_intel.jpg -n 5
+    parser = argparse.ArgumentParser(description="Индекс эмбеддингов avgpool")
+    sub = parser.add_subparsers(dest="command", required=True)
+    bd = sub.add_parser("build", help="проиндексировать обучающую выборку (ImageFolder)")
+    bd.add_argument("model", choices=list(MODEL_SPECS))
+    bd.add_argument("root")
+    bd.add_argument("--storage", choices=STORAGES, default="pq")
+    bd.add_argument("--batch-size", type=int, default=64)
+    bd.add_argument("--workers", type=int, default=0)
+    qr = sub.add_parser("query", help="похожие изображения из обучающей выборки")
+    qr.add_argument("model", choices=list(MODEL_SPECS))
+    qr.add_argument("image")
+    qr.add_argument("-n", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        index = build_training_index(args.model, args.root, args.storage, args.batch_size,
+                                     args.workers, log=lambda msg: None)
+        fp32_mb = len(index) * EMBED_DIM * 4 / 1024 / 1024
+        print(f"{args.model}: {len(index)} изображений, {args.storage} "
+              f"{index.nbytes / 1024 / 1024:.1f} МБ (fp32 было бы {fp32_mb:.1f} МБ) "
+              f"-> {training_index_path(args.model)}")
+    else:
+        preprocessor = get_preprocessor(args.model)
+        with open(args.image, "rb") as f:
+            image = preprocessor.decode(f.read())
+        similar_images(args.model, image, args.n)   # загрузка модели и индекса
+        start = time.perf_counter()
+        results = similar_images(args.model, image, args.n)
+        elapsed = time.perf_counter() - start
+        for payload, sim in results:
+            print(f"{sim:.4f}  {payload['label']:<12} {payload['path']}")
+        print(f"{elapsed * 1000:.1f} мс (эмбеддинг + поиск)")
@@ -0,0 +1,333 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, Subset
+
+from models.metrics import MetricsAccumulator
+from models.shared_trunk import STAGES, run_stages
+
+# ===================== КОНСТАНТЫ =====================
+
+FEATURE_ROOT = os.path.join("data", "cache", "features")
+FEATURES_FILE = "features.npy"
+LABELS_FILE = "labels.npy"
+META_FILE = "meta.json"
+EXTRACT_BATCH = 128
+
+
+# ===================== ЗАМОРОЖЕННОЕ НАЧАЛО СЕТИ =====================
+
+def frozen_prefix(model, optimizer=None):
+    """
+    Сколько первых стадий STAGES не обучается.
+
+    Если передан optimizer, обучаемыми считаются только параметры из его
+    param_groups (в ноутбуке Intel layer4 разморожена, но оптимизатор
+    обновляет только fc); иначе — параметры с requires_grad.
+    Стадии без параметров (relu, maxpool, avgpool) не прерывают префикс.
+    fc всегда остаётся обучаемой частью.
+    """
+    if optimizer is not None:
+        trainable = {id(p) for group in optimizer.param_groups for p in group["params"]}
+    else:
+        trainable = {id(p) for p in model.parameters() if p.requires_grad}
+
+    n = 0
+    for stage in STAGES[:-1]:
+        if any(id(p) in trainable for p in model.get_submodule(stage).parameters()):
+            break
+        n += 1
+    return n
+
+
+class Suffix(nn.Module):
+    """Стадии STAGES[prefix:] модели — то, что обучается на кэшированных признаках."""
+
+    def __init__(self, model, prefix):
+        super().__init__()
+        self.names = STAGES[prefix:]
+        # Только модули хвоста: train()/eval() не трогают BatchNorm начала сети
+        self.stages = nn.ModuleList(model.get_submodule(s) for s in self.names)
+
+    def forward(self, x):
+        for name, stage in zip(self.names, self.stages):
+            if name == "fc":
+                x = torch.flatten(x, 1)
+            x = stage(x)
+        return x
+
+
+# ===================== ОТПЕЧАТКИ ДЛЯ ИНВАЛИДАЦИИ =====================
+
+def prefix_fingerprint(model, prefix):
+    """Хеш весов и буферов (BatchNorm) замороженных стадий."""
+    h = hashlib.sha256()
+    for stage in STAGES[:prefix]:
+        h.update(stage.encode())
+        for name, t in model.get_submodule(stage).state_dict().items():
+            h.update(name.encode())
+            h.update(t.detach().cpu().contiguous().numpy().tobytes())
+    return h.hexdigest()
+
+
+def dataset_fingerprint(dataset):
+    """
+    Хеш того, что подаётся на вход: файлы, порядок и предобработка.
+
+    Понимает Subset (random_split), CachedImageDataset (meta кэша)
+    и ImageFolder (пути + repr(transform)).
+    """
+    h = hashlib.sha256()
+    if isinstance(dataset, Subset):
+        h.update(dataset_fingerprint(dataset.dataset).encode())
+        h.update(np.asarray(dataset.indices, dtype=np.int64).tobytes())
+    elif hasattr(dataset, "meta"):
+        meta = {k: v for k, v in dataset.meta.items() if k != "build_time"}
+        h.update(json.dumps(meta, sort_keys=True).encode())
+        h.update(str(getattr(dataset, "normalize", True)).encode())
+    else:
+        h.update(repr(getattr(dataset, "transform", None)).encode())
+        for path, label in getattr(dataset, "samples", []):
+            h.update(f"{path}\t{label}\n".encode())
+        h.update(str(len(dataset)).encode())
+    return h.hexdigest()
+
+
+def check_deterministic(dataset, what="Признаки"):
+    """
+    Кэш привязан к индексу изображения: при случайной аугментации обучение
+    видело бы не ту картинку, по которой посчитаны признаки (или логиты учителя).
+    """
+    base = dataset.dataset if isinstance(dataset, Subset) else dataset
+    if getattr(base, "hflip", 0):
+        raise ValueError(f"{what} нельзя кэшировать при случайной аугментации (hflip > 0)")
+
+
+# ===================== КЭШ ПРИЗНАКОВ =====================
+
+class FeatureCache:
+    """Признаки [N, ...] (mmap, float16/float32) и метки для одного датасета."""
+
+    def __init__(self, cache_dir):
+        with open(os.path.join(cache_dir, META_FILE), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.features = np.load(os.path.join(cache_dir, FEATURES_FILE), mmap_mode="r")
+        self.labels = torch.from_numpy(np.load(os.path.join(cache_dir, LABELS_FILE)))
+
+    def __len__(self):
+        return len(self.labels)
+
+    def batches(self, batch_size, shuffle=False, generator=None):
+        """(признаки float32, метки) батчами; индексы внутри батча читаются по порядку."""
+        order = torch.randperm(len(self), generator=generator) if shuffle else torch.arange(len(self))
+        for start in range(0, len(self), batch_size):
+            idx = order[start:start + batch_size].sort().values.numpy()
+            yield torch.from_numpy(self.features[idx]).float(), self.labels[idx]
+
+
+def extract_features(model, dataset, prefix, cache_dir, fp16=False,
+                     batch_size=EXTRACT_BATCH, workers=0):
+    """Один проход датасета через замороженное начало сети с записью в mmap."""
+    check_deterministic(dataset)
+    if len(dataset) == 0:
+        # Иначе mmap не создаётся (форма признаков известна только по первому батчу)
+        raise ValueError("Пустой датасет: признаки извлекать не из чего")
+    model.eval()
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=workers)
+    tmp_dir = cache_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    features, labels, offset = None, np.empty(len(dataset), dtype=np.int64), 0
+    start = time.perf_counter()
+    with torch.inference_mode():
+        for images, targets in loader:
+            out = run_stages(model, images, STAGES[:prefix])
+            if features is None:
+                features = np.lib.format.open_memmap(
+                    os.path.join(tmp_dir, FEATURES_FILE), mode="w+",
+                    dtype=np.float16 if fp16 else np.float32,
+                    shape=(len(dataset), *out.shape[1:]),
+                )
+            n = out.shape[0]
+            features[offset:offset + n] = out.numpy()
+            labels[offset:offset + n] = targets.numpy()
+            offset += n
+    features.flush()
+    del features
+    np.save(os.path.join(tmp_dir, LABELS_FILE), labels)
+    return tmp_dir, time.perf_counter() - start
+
+
+def cached_features(model, dataset, prefix, fp16=False, cache_root=FEATURE_ROOT,
+                    workers=0, log=print):
+    """
+    FeatureCache для (замороженные веса, датасет, предобработка).
+
+    Каталог кэша — по хешу от всех трёх, поэтому изменение весов начала сети
+    или предобработки автоматически даёт новый кэш, а старый не используется.
+    """
+    key = hashlib.sha256(
+        f"{prefix_fingerprint(model, prefix)}:{dataset_fingerprint(dataset)}:{prefix}:{fp16}".encode()
+    ).hexdigest()
+    cache_dir = os.path.join(cache_root, key[:16])
+    meta_path = os.path.join(cache_dir, META_FILE)
+    if os.path.exists(meta_path):
+        cache = FeatureCache(cache_dir)
+        if cache.meta.get("key") == key:
+            return cache
+
+    log(f"Извлечение признаков до стадии {STAGES[prefix - 1]} для {len(dataset)} изображений...")
+    tmp_dir, elapsed = extract_features(model, dataset, prefix, cache_dir, fp16, workers=workers)
+    meta = {"key": key, "prefix": prefix, "last_stage": STAGES[prefix - 1], "fp16": fp16,
+            "count": len(dataset), "extract_time": elapsed}
+    with open(os.path.join(tmp_dir, META_FILE), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.replace(tmp_dir, cache_dir)
+    log(f"Признаки сохранены в {cache_dir} за {elapsed:.1f} с")
+    return FeatureCache(cache_dir)
+
+
+# ===================== ОБУЧЕНИЕ ХВОСТА =====================
+
+def _run_epoch(suffix, cache, criterion, num_classes, optimizer=None, batch_size=64,
+               generator=None):
+    """(средний loss, MetricsAccumulator) за эпоху."""
+    training = optimizer is not None
+    suffix.train(training)
+    metrics = MetricsAccumulator(num_classes)
+    total_loss, seen = 0.0, 0
+    with torch.set_grad_enabled(training):
+        for x, y in cache.batches(batch_size, shuffle=training, generator=generator):
+            logits = suffix(x)
+            loss = criterion(logits, y)
+            if training:
+                optimizer.zero_grad()
+                loss.backward()
+                optimizer.step()
+            total_loss += loss.item() * len(y)
+            seen += len(y)
+            metrics.update(logits, y)
+    return total_loss / max(seen, 1), metrics
+
+
+def fit_head(model, train_dataset, valid_dataset, optimizer, n_epochs, criterion=None,
+             batch_size=64, fp16=False, cache_root=FEATURE_ROOT, workers=0, seed=42, log=print):
+    """
+    Обучение при замороженном начале сети: начало считается один раз.
+
+    Замороженный префикс определяется по optimizer (см. frozen_prefix),
+    признаки берутся из кэша или извлекаются, дальше n_epochs эпох
+    обучается только хвост (для фазы «только fc» — один Linear).
+    BatchNorm замороженной части работает в eval-режиме, как при инференсе.
+    Возвращает (история, метрики валидации последней эпохи): история —
+    {train_loss, train_acc, train_f1, valid_loss, valid_acc, valid_f1, epoch_time}
+    и extract_time — время извлечения признаков (0, если кэш уже был);
+    метрики — MetricsAccumulator (None при n_epochs=0).
+    """
+    prefix = frozen_prefix(model, optimizer)
+    if prefix == 0:
+        raise ValueError("У модели нет замороженного начала — кэшировать нечего")
+    criterion = criterion or nn.CrossEntropyLoss()
+
+    start = time.perf_counter()
+    train = cached_features(model, train_dataset, prefix, fp16, cache_root, workers, log)
+    valid = cached_features(model, valid_dataset, prefix, fp16, cache_root, workers, log)
+    extract_time = time.perf_counter() - start
+
+    model.eval()
+    suffix = Suffix(model, prefix)
+    generator = torch.Generator().manual_seed(seed)
+    num_classes = model.fc.out_features
+    history = {"train_loss": [], "train_acc": [], "train_f1": [],
+               "valid_loss": [], "valid_acc": [], "valid_f1": [],
+               "epoch_time": [], "extract_time": extract_time, "prefix": STAGES[prefix - 1]}
+    valid_metrics = None
+
+    for epoch in range(n_epochs):
+        start = time.perf_counter()
+        train_loss, train_metrics = _run_epoch(suffix, train, criterion, num_classes, optimizer,
+                                               batch_size, generator)
+        valid_loss, valid_metrics = _run_epoch(suffix, valid, criterion, num_classes,
+                                               batch_size=batch_size)
+        elapsed = time.perf_counter() - start
+        for split, loss, m in (("train", train_loss, train_metrics),
+                                 ("valid", valid_loss, valid_metrics)):
+            history[f"{split}_loss"].append(loss)
+            history[f"{split}_acc"].append(m.accuracy)
+            history[f"{split}_f1"].append(m.macro_f1)
+        history["epoch_time"].append(elapsed)
+        log(f"Эпоха {epoch + 1}/{n_epochs}: train_loss {train_loss:.4f}, "
+            f"train_acc {train_metrics.accuracy:.3f}, valid_loss {valid_loss:.4f}, "
+            f"valid_acc {valid_metrics.accuracy:.3f}, valid_f1 {valid_metrics.macro_f1:.3f}, "
+            f"{elapsed:.2f} с")
+    model.eval()
+    return history, valid_metrics
+
+
+# ===================== ЗАМЕР =====================
+
+def full_epoch_time(model, dataset, optimizer, criterion, batch_size=64, workers=0):
+    """Эпоха как в ноутбуке: каждый батч проходит всю сеть."""
+    model.train()
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=True, num_workers=workers)
+    start = time.perf_counter()
+    for images, labels in loader:
+        loss = criterion(model(images), labels)
+        optimizer.zero_grad()
+        loss.backward()
+        optimizer.step()
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    # python -m models.feature_cache data/intel/seg_train/seg_train --model intel --epochs 3
+    from torchvision import datasets
+
+    from models.dataset_cache import CachedImageDataset, build_cache, default_cache_dir
+    from models.preprocessing import PREPROCESS_SPECS, Preprocessor
+    from models.registry import MODEL_SPECS, build_resnet18
+
+    parser = argparse.ArgumentParser(description="Обучение головы на кэшированных признаках")
+    parser.add_argument("root", help="каталог в формате ImageFolder")
+    parser.add_argument("--model", choices=list(MODEL_SPECS), required=True)
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--fp16", action="store_true", help="хранить признаки в float16")
+    parser.add_argument("--mmap-dataset", action="store_true",
+                        help="читать изображения из models.dataset_cache")
+    parser.add_argument("--workers", type=int, default=0)
+    args = parser.parse_args()
+
+    spec = PREPROCESS_SPECS[args.model]
+    if args.mmap_dataset:
+        cache_dir = default_cache_dir(args.model, args.root)
+        build_cache(args.root, cache_dir, spec)
+        dataset = CachedImageDataset(cache_dir)
+    else:
+        dataset = datasets.ImageFolder(args.root, transform=Preprocessor(spec).reference_transform())
+    n_train = int(0.8 * len(dataset))
+    train_set, valid_set = torch.utils.data.random_split(
+        dataset, [n_train, len(dataset) - n_train], generator=torch.Generator().manual_seed(42))
+
+    model = build_resnet18(len(dataset.classes))
+    for p in model.parameters():
+        p.requires_grad = False
+    for p in model.fc.parameters():
+        p.requires_grad = True
+    optimizer = torch.optim.Adam(model.fc.parameters(), lr=1e-3)
+    criterion = nn.CrossEntropyLoss()
+
+    full = full_epoch_time(model, train_set, optimizer, criterion, workers=args.workers)
+    history, _ = fit_head(model, train_set, valid_set, optimizer, args.epochs, criterion,
+                          fp16=args.fp16, workers=args.workers)
+    cached = sum(history["epoch_time"]) / len(history["epoch_time"])
+    print(f"Эпоха «только fc»: вся сеть {full:.1f} с, по кэшу {cached:.2f} с (x{full / cached:.0f}); "
+          f"извлечение признаков {history['extract_time']:.1f} с (один раз)")
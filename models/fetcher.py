@@ -0,0 +1,180 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from models.telemetry import timed
+
+# ===================== КОНСТАНТЫ =====================
+
+MAX_BYTES = int(os.environ.get("FETCH_MAX_BYTES", 20 * 1024 * 1024))
+MAX_WORKERS = 8
+TIMEOUT = 10
+CHUNK_SIZE = 64 * 1024
+CACHE_ENTRIES = 256
+# Кэш ETag ограничен и по байтам: 256 записей по MAX_BYTES — это гигабайты
+CACHE_MAX_BYTES = int(float(os.environ.get("FETCH_CACHE_MB", 64)) * 1024 * 1024)
+
+
+class FetchError(Exception):
+    """Не удалось скачать изображение по ссылке."""
+
+
+@dataclass
+class FetchResult:
+    url: str
+    data: bytes = None
+    content_type: str = ""
+    error: Exception = None
+    from_cache: bool = False
+    elapsed: float = 0.0
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+# ===================== ЗАГРУЗЧИК =====================
+
+class Fetcher:
+    """
+    Загрузка изображений по ссылкам.
+
+    Одна сессия с пулом соединений, параллельная загрузка нескольких ссылок,
+    потоковое чтение с лимитом размера и ранним отказом, если сервер
+    отвечает не картинкой. Ответы кэшируются по URL и перепроверяются
+    через ETag / Last-Modified.
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES, max_workers=MAX_WORKERS,
+                 timeout=TIMEOUT, cache_entries=CACHE_ENTRIES, cache_bytes=CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.cache_entries = cache_entries
+        self.cache_bytes = cache_bytes
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._cache = OrderedDict()   # url -> (etag, last_modified, data, content_type)
+        self._cached_bytes = 0
+        self._lock = threading.Lock()
+
+    # -------- Кэш --------
+
+    def _cached(self, url):
+        with self._lock:
+            entry = self._cache.get(url)
+            if entry is not None:
+                self._cache.move_to_end(url)
+            return entry
+
+    def _store(self, url, response, data, content_type):
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        if not etag and not last_modified or len(data) > self.cache_bytes:
+            return
+        with self._lock:
+            old = self._cache.pop(url, None)
+            if old is not None:
+                self._cached_bytes -= len(old[2])
+            self._cache[url] = (etag, last_modified, data, content_type)
+            self._cached_bytes += len(data)
+            while len(self._cache) > self.cache_entries or self._cached_bytes > self.cache_bytes:
+                _, evicted = self._cache.popitem(last=False)
+                self._cached_bytes -= len(evicted[2])
+
+    def cache_size(self):
+        """(записей, байт) в кэше ответов."""
+        with self._lock:
+            return len(self._cache), self._cached_bytes
+
+    # -------- Загрузка --------
+
+    def fetch(self, url):
+        """Скачивает одну ссылку; ошибки возвращаются в FetchResult.error."""
+        start = time.perf_counter()
+        try:
+            with timed("fetch"):
+                data, content_type, from_cache = self._fetch(url)
+            return FetchResult(url, data, content_type, from_cache=from_cache,
+                               elapsed=time.perf_counter() - start)
+        except Exception as e:
+            return FetchResult(url, error=e, elapsed=time.perf_counter() - start)
+
+    def _fetch(self, url):
+        cached = self._cached(url)
+        headers = {}
+        if cached is not None:
+            etag, last_modified, _, _ = cached
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+
+        with self.session.get(url, headers=headers, stream=True, timeout=self.timeout) as response:
+            if response.status_code == 304:
+                if cached is None:   # raise_for_status() на 3xx не падает — тело было бы пустым
+                    raise FetchError("Сервер ответил 304 на запрос без кэшированной копии")
+                return cached[2], cached[3], True
+            response.raise_for_status()
+
+            content_type = response.headers.get("Content-Type", "")
+            if content_type and not content_type.startswith("image/"):
+                raise FetchError(f"По ссылке не изображение: {content_type}")
+
+            length = response.headers.get("Content-Length")
+            if length is not None and int(length) > self.max_bytes:
+                raise FetchError(f"Файл больше лимита {self.max_bytes // 1024 // 1024} МБ")
+
+            chunks, size = [], 0
+            for chunk in response.iter_content(CHUNK_SIZE):
+                size += len(chunk)
+                if size > self.max_bytes:
+                    raise FetchError(f"Файл больше лимита {self.max_bytes // 1024 // 1024} МБ")
+                chunks.append(chunk)
+
+            data = b"".join(chunks)
+            self._store(url, response, data, content_type)
+            return data, content_type, False
+
+    def fetch_many(self, urls):
+        """Параллельно скачивает список ссылок; порядок результатов = порядок urls."""
+        urls = [u for u in urls if u]
+        if len(urls) <= 1:
+            return [self.fetch(u) for u in urls]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(urls))) as pool:
+            return list(pool.map(self.fetch, urls))
+
+
+_fetcher = None
+_fetcher_lock = threading.Lock()
+
+
+def get_fetcher():
+    """Единственный загрузчик на процесс — пул соединений и кэш общие."""
+    global _fetcher
+    with _fetcher_lock:
+        if _fetcher is None:
+            _fetcher = Fetcher()
+        return _fetcher
+
+
+def parse_urls(text):
+    """Ссылки из текстового поля: по одной на строку или через пробел."""
+    return [u.strip() for u in (text or "").split() if u.strip()]
+
+
+def fetch_image(url):
+    """Байты одной картинки; при ошибке — исключение."""
+    result = get_fetcher().fetch(url)
+    if not result.ok:
+        raise result.error
+    return result.data
+
@@ -0,0 +1,282 @@
+import argparse
+import functools
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import subprocess
+import sys
+import time
+from dataclasses import asdict
+
+import torch
+
+from models.preprocessing import PREPROCESS_SPECS
+from models.registry import MODEL_SPECS, build_model, checkpoint_version, load_class_names
+
+logger = logging.getLogger(__name__)
+
+# ===================== КОНСТАНТЫ =====================
+
+FORMAT = "nn_project.flat/1"
+# Раскладка совместима с safetensors: 8 байт длины заголовка, JSON, сырые тензоры
+SUFFIX = ".flat.safetensors"
+ALIGN = 64
+
+# FLAT_CHECKPOINTS=0 — всегда грузить исходный .pt через torch.load
+ENABLED = os.environ.get("FLAT_CHECKPOINTS", "1") != "0"
+
+DTYPES = {
+    "F64": torch.float64, "F32": torch.float32, "F16": torch.float16, "BF16": torch.bfloat16,
+    "I64": torch.int64, "I32": torch.int32, "U8": torch.uint8,
+}
+DTYPE_NAMES = {dtype: name for name, dtype in DTYPES.items()}
+STORAGE = {"fp32": torch.float32, "fp16": torch.float16, "bf16": torch.bfloat16}
+
+
+def flat_path(checkpoint):
+    """models/intel_model.pt -> models/intel_model.flat.safetensors"""
+    return os.path.splitext(checkpoint)[0] + SUFFIX
+
+
+@functools.lru_cache(maxsize=16)
+def _sha256(path, version):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_sha256(path):
+    return _sha256(path, checkpoint_version(path))
+
+
+# ===================== ЗАПИСЬ =====================
+
+def save_flat(state_dict, path, metadata=None, storage="fp32"):
+    """
+    state_dict -> плоский файл: u64 длина заголовка, JSON-заголовок, сырые байты.
+
+    Вещественные тензоры хранятся в storage (fp32 / fp16 / bf16), остальные
+    (num_batches_tracked) — как есть. Тензоры идут по убыванию размера
+    элемента от границы ALIGN, поэтому каждый выровнен по своему типу и
+    читается через mmap без копии. Метаданные — строки JSON, как требует safetensors.
+    """
+    target = STORAGE[storage]
+    tensors = {}
+    for name, tensor in state_dict.items():
+        tensor = tensor.detach().cpu()
+        if tensor.is_floating_point():
+            tensor = tensor.to(target)
+        tensors[name] = tensor.contiguous()
+    order = sorted(tensors, key=lambda n: -tensors[n].element_size())
+
+    header = {"__metadata__": {k: json.dumps(v, ensure_ascii=False)
+                               for k, v in (metadata or {}).items()}}
+    offset = 0
+    for name in order:
+        tensor = tensors[name]
+        size = tensor.numel() * tensor.element_size()
+        header[name] = {"dtype": DTYPE_NAMES[tensor.dtype], "shape": list(tensor.shape),
+                        "data_offsets": [offset, offset + size]}
+        offset += size
+    raw = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    raw += b" " * (-(8 + len(raw)) % ALIGN)
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(struct.pack("<Q", len(raw)))
+        f.write(raw)
+        for name in order:
+            f.write(tensors[name].reshape(-1).view(torch.uint8).numpy())
+    os.replace(tmp, path)
+
+
+def checkpoint_metadata(spec, storage):
+    return {
+        "format": FORMAT,
+        "model": spec.name,
+        "num_classes": spec.num_classes,
+        "arch": spec.arch,
+        "class_names": load_class_names(spec.name),
+        "preprocess": asdict(PREPROCESS_SPECS[spec.name]),
+        "storage": storage,
+        "source": os.path.basename(spec.path),
+        "source_sha256": file_sha256(spec.path),
+        "source_version": checkpoint_version(spec.path),
+    }
+
+
+def convert(spec, storage="fp32"):
+    """Исходный .pt модели страницы -> flat_path(spec.path)."""
+    state_dict = torch.load(spec.path, map_location="cpu")
+    path = flat_path(spec.path)
+    save_flat(state_dict, path, checkpoint_metadata(spec, storage), storage)
+    return path
+
+
+# ===================== ЧТЕНИЕ =====================
+
+def read_header(path):
+    """(заголовок тензоров, метаданные, смещение данных) без чтения весов."""
+    with open(path, "rb") as f:
+        (length,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(length))
+    metadata = {k: json.loads(v) for k, v in header.pop("__metadata__", {}).items()}
+    return header, metadata, 8 + length
+
+
+def load_flat(path, widen=True):
+    """
+    (state_dict, метаданные) поверх mmap файла.
+
+    Отображение MAP_PRIVATE: страницы общие с page cache, а значит и между
+    процессами, пока их никто не пишет; запись (например, fuse при
+    квантовании) копирует только затронутые страницы. fp32 читается без
+    копии; fp16/bf16 при widen=True расширяются до fp32 — это уже частная память.
+    """
+    header, metadata, start = read_header(path)
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    state_dict = {}
+    for name, info in header.items():
+        dtype = DTYPES[info["dtype"]]
+        begin, end = info["data_offsets"]
+        count = (end - begin) // torch.empty((), dtype=dtype).element_size()
+        tensor = torch.frombuffer(buffer, dtype=dtype, count=count, offset=start + begin)
+        tensor = tensor.reshape(info["shape"])
+        if widen and tensor.is_floating_point() and dtype != torch.float32:
+            tensor = tensor.float()
+        state_dict[name] = tensor
+    return state_dict, metadata
+
+
+def is_fresh(spec, metadata):
+    """Плоский файл собран из текущего .pt: по mtime+размеру, а при расхождении — по sha256."""
+    if metadata.get("format") != FORMAT or metadata.get("num_classes") != spec.num_classes:
+        return False
+    if metadata.get("arch", "resnet18") != spec.arch:
+        return False
+    if metadata.get("source_version") == checkpoint_version(spec.path):
+        return True
+    return metadata.get("source_sha256") == file_sha256(spec.path)
+
+
+def load_fresh(spec):
+    """state_dict из плоского файла модели или None, если его нет, он устарел или выключен."""
+    path = flat_path(spec.path)
+    if not ENABLED or not os.path.exists(path):
+        return None
+    _, metadata, _ = read_header(path)
+    if not is_fresh(spec, metadata):
+        logger.warning("%s устарел относительно %s, используется torch.load", path, spec.path)
+        return None
+    state_dict, _ = load_flat(path)
+    return state_dict
+
+
+# ===================== ЗАМЕР =====================
+
+def _rss():
+    """RssAnon (частная память процесса) и RssFile (общие страницы файлов), МБ."""
+    values = {}
+    with open("/proc/self/status", encoding="ascii") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in ("RssAnon", "RssFile"):
+                values[key] = int(value.split()[0]) / 1024
+    return values
+
+
+def _drop_page_cache(path):
+    # Чистые страницы файла выбрасываются из page cache без root-прав
+    if hasattr(os, "posix_fadvise"):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def probe(name, fmt):
+    """
+    Загрузка одной модели в этом процессе: время и прирост RSS. Каркас в обоих
+    случаях на meta-устройстве (как в registry.load_eager) — различается только формат.
+    """
+    spec = MODEL_SPECS[name]
+    before = _rss()
+    start = time.perf_counter()
+    with torch.device("meta"):
+        model = build_model(spec.arch, spec.num_classes)
+    if fmt == "pickle":
+        state_dict = torch.load(spec.path, map_location="cpu")
+    else:
+        state_dict, _ = load_flat(flat_path(spec.path))
+    model.load_state_dict(state_dict, assign=True)
+    model.eval()
+    with torch.no_grad():
+        model(torch.zeros(1, 3, 224, 224))   # страницы весов действительно прочитаны
+    load_time = time.perf_counter() - start
+    after = _rss()
+    return {"format": fmt, "load_s": load_time,
+            "anon_mb": after["RssAnon"] - before["RssAnon"],
+            "file_mb": after["RssFile"] - before["RssFile"]}
+
+
+def benchmark(name, cold=True):
+    """Холодная загрузка в отдельных процессах: pickle (.pt) против плоского файла."""
+    spec = MODEL_SPECS[name]
+    results = []
+    for fmt, path in (("pickle", spec.path), ("flat", flat_path(spec.path))):
+        if cold:
+            _drop_page_cache(path)
+        out = subprocess.run([sys.executable, "-m", "models.flat_checkpoint", "probe", name, fmt],
+                             check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+    return results
+
+
+if __name__ == "__main__":
+    # python -m models.flat_checkpoint convert --storage fp16
+    # python -m models.flat_checkpoint benchmark intel
+    parser = argparse.ArgumentParser(description="Плоские mmap-чекпоинты (формат safetensors)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    cv = sub.add_parser("convert", help="собрать *.flat.safetensors из .pt")
+    # choices с nargs="*" в Python 3.11 отвергает пустой список — имена проверяются ниже
+    cv.add_argument("models", nargs="*", help=f"по умолчанию все: {', '.join(MODEL_SPECS)}")
+    cv.add_argument("--storage", choices=list(STORAGE), default="fp32",
+                    help="fp16/bf16 вдвое меньше на диске, но при загрузке расширяются (копия)")
+    bm = sub.add_parser("benchmark", help="время холодной загрузки и RSS до и после")
+    bm.add_argument("models", nargs="*", help="по умолчанию все")
+    bm.add_argument("--warm", action="store_true", help="не сбрасывать page cache")
+    pr = sub.add_parser("probe")   # внутренний: один замер в чистом процессе
+    pr.add_argument("model", choices=list(MODEL_SPECS))
+    pr.add_argument("format", choices=("pickle", "flat"))
+    args = parser.parse_args()
+    unknown = [name for name in getattr(args, "models", []) if name not in MODEL_SPECS]
+    if unknown:
+        parser.error(f"неизвестные модели: {', '.join(unknown)} (доступны: {', '.join(MODEL_SPECS)})")
+
+    if args.command == "probe":
+        print(json.dumps(probe(args.model, args.format)))
+    elif args.command == "convert":
+        for name in args.models or list(MODEL_SPECS):
+            spec = MODEL_SPECS[name]
+            if not os.path.exists(spec.path):
+                print(f"{name}: нет {spec.path}, пропущено")
+                continue
+            path = convert(spec, args.storage)
+            print(f"{name}: {spec.path} ({os.path.getsize(spec.path) / 1024 / 1024:.1f} МБ) -> "
+                  f"{path} ({os.path.getsize(path) / 1024 / 1024:.1f} МБ, {args.storage})")
+    else:
+        for name in args.models or list(MODEL_SPECS):
+            if not os.path.exists(flat_path(MODEL_SPECS[name].path)):
+                print(f"{name}: сначала python -m models.flat_checkpoint convert {name}")
+                continue
+            for r in benchmark(name, cold=not args.warm):
+                print(f"{name} {r['format']:>6}: загрузка {r['load_s'] * 1000:.0f} мс, "
+                      f"частная память +{r['anon_mb']:.0f} МБ, общие страницы файла "
+                      f"+{r['file_mb']:.0f} МБ")
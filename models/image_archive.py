@@ -0,0 +1,140 @@
+import os
+import threading
+import time
+import weakref
+from dataclasses import dataclass
+from io import BytesIO
+
+from PIL import Image
+
+# ===================== КОНСТАНТЫ =====================
+
+THUMBNAIL_SIZE = 256
+SESSION_BUDGET_MB = float(os.environ.get("ARCHIVE_SESSION_BUDGET_MB", 64))
+GLOBAL_BUDGET_MB = float(os.environ.get("ARCHIVE_GLOBAL_BUDGET_MB", 512))
+# Тот же лимит, что у models.preprocessing (модуль без torch, поэтому читаем env сами)
+MAX_PIXELS = int(os.environ.get("PREPROCESS_MAX_PIXELS", 50_000_000))
+
+
+# ===================== ЗАПИСЬ АРХИВА =====================
+
+@dataclass
+class ArchivedImage:
+    """Исходные сжатые байты файла и маленькая превью-картинка."""
+    data: bytes
+    thumbnail: bytes
+    name: str
+    width: int
+    height: int
+    added_at: float
+
+    @property
+    def nbytes(self):
+        return len(self.data) + len(self.thumbnail)
+
+    def decode(self):
+        """Полноразмерное RGB-изображение — только когда нужно для инференса."""
+        return Image.open(BytesIO(self.data)).convert("RGB")
+
+
+def make_thumbnail(data, size=THUMBNAIL_SIZE, max_pixels=MAX_PIXELS):
+    """Превью в JPEG; для JPEG декодируется сразу в уменьшенном масштабе."""
+    img = Image.open(BytesIO(data))
+    width, height = img.size
+    # Размер известен из заголовка — «бомбу» отсекаем до декодирования
+    if width * height > max_pixels:
+        raise ValueError(f"Слишком большое изображение: {width}×{height} "
+                         f"(лимит {max_pixels} пикселей)")
+    img.draft("RGB", (size, size))
+    img = img.convert("RGB")
+    img.thumbnail((size, size))
+    buf = BytesIO()
+    img.save(buf, format="JPEG", quality=85)
+    return buf.getvalue(), width, height
+
+
+# ===================== АРХИВ =====================
+
+_archives = weakref.WeakSet()
+_archives_lock = threading.RLock()
+
+
+def global_footprint():
+    """Сколько байт занимают архивы всех живых сессий."""
+    with _archives_lock:
+        return sum(a.footprint() for a in list(_archives))
+
+
+class ImageArchive:
+    """
+    Архив изображений одной сессии.
+
+    Хранит сжатые байты и превью вместо декодированных RGB-картинок.
+    Ограничен лимитом на сессию и общим лимитом на процесс: при
+    превышении удаляются самые старые записи.
+    """
+
+    def __init__(self, session_budget_mb=SESSION_BUDGET_MB, global_budget_mb=GLOBAL_BUDGET_MB):
+        self.session_budget = int(session_budget_mb * 1024 * 1024)
+        self.global_budget = int(global_budget_mb * 1024 * 1024)
+        self._items = []
+        self._bytes = 0
+        self.evicted = 0
+        with _archives_lock:
+            _archives.add(self)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(list(self._items))
+
+    def __getitem__(self, i):
+        return self._items[i]
+
+    def footprint(self):
+        return self._bytes
+
+    def add(self, data, name=""):
+        """Добавляет файл; возвращает, сколько старых записей этой сессии вытеснено."""
+        thumbnail, width, height = make_thumbnail(data)
+        item = ArchivedImage(data, thumbnail, name, width, height, time.time())
+
+        with _archives_lock:
+            self._items.append(item)
+            self._bytes += item.nbytes
+            before = self.evicted
+            self._enforce_budgets()
+            return self.evicted - before
+
+    def raw_images(self):
+        return [item.data for item in self._items]
+
+    def clear(self):
+        with _archives_lock:
+            self._items = []
+            self._bytes = 0
+
+    def _pop_oldest(self):
+        item = self._items.pop(0)
+        self._bytes -= item.nbytes
+        self.evicted += 1
+        return item
+
+    def _enforce_budgets(self):
+        # Лимит сессии: удаляем свои самые старые записи (последнюю оставляем)
+        while self._bytes > self.session_budget and len(self._items) > 1:
+            self._pop_oldest()
+
+        # Общий лимит: удаляем самую старую запись среди всех сессий
+        while global_footprint() > self.global_budget:
+            candidates = [a for a in _archives if a._items and (a is not self or len(a._items) > 1)]
+            if not candidates:
+                break
+            oldest = min(candidates, key=lambda a: a._items[0].added_at)
+            oldest._pop_oldest()
+
+    def describe(self):
+        """Строка для счётчика на главной странице."""
+        return f"{len(self)} шт., {self._bytes / 1024 / 1024:.1f} МБ"
+
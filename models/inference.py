@@ -0,0 +1,126 @@
+import time
+from dataclasses import dataclass
+
+import torch
+
+from models.telemetry import timed, observe_batch
+
+# ===================== КОНСТАНТЫ =====================
+
+DEFAULT_BATCH_SIZE = 32
+
+
+# ===================== РЕЗУЛЬТАТ =====================
+
+@dataclass
+class Prediction:
+    """Результат классификации одного изображения."""
+    label: str
+    class_id: int
+    confidence: float
+    batch_index: int
+    batch_size: int
+    batch_time: float   # время всего батча, секунды
+    image_time: float   # доля батча на одно изображение, секунды
+    cached: bool = False
+    top_k: list = None  # [(label, probability), ...] при top_k > 1
+    tier: str = None    # кто ответил: "low" / "full" (models.cascade), "near_dup" (models.embedding_index)
+
+
+def class_label(class_names, class_id):
+    """Название класса по индексу (список или словарь {id: name})."""
+    try:
+        return class_names[class_id]
+    except (IndexError, KeyError):
+        return f"ID {class_id}"
+
+
+def forward_with_tiers(model, batch):
+    """(логиты, уровень для каждого изображения): обёртки вроде CascadeModel сообщают, кто ответил."""
+    if hasattr(model, "forward_with_tiers"):
+        return model.forward_with_tiers(batch)
+    return model(batch), [None] * batch.shape[0]
+
+
+# ===================== БАТЧЕВОЕ ПРЕДСКАЗАНИЕ =====================
+
+def iter_batches(items, batch_size):
+    """Делит последовательность на куски по batch_size."""
+    batch_size = max(1, int(batch_size))
+    for start in range(0, len(items), batch_size):
+        yield items[start:start + batch_size]
+
+
+def predict_tensor_batch(model, batch, class_names, batch_index=0, device="cpu", model_name="",
+                         top_k=1):
+    """Один forward по уже собранному тензору [N, 3, H, W]."""
+    start = time.perf_counter()
+    n = batch.shape[0]
+    observe_batch(n, model_name)
+
+    with torch.no_grad():
+        with timed("forward", model_name):
+            logits, tiers = forward_with_tiers(model, batch.to(device))
+        with timed("softmax", model_name):
+            probs = torch.softmax(logits, dim=1)
+            confidence, pred_class = torch.max(probs, dim=1)
+            if top_k > 1:
+                top_probs, top_ids = torch.topk(probs, min(top_k, probs.shape[1]), dim=1)
+                tops = [
+                    [(class_label(class_names, c), p) for c, p in zip(ids, ps)]
+                    for ids, ps in zip(top_ids.tolist(), top_probs.tolist())
+                ]
+            else:
+                tops = [None] * n
+
+    elapsed = time.perf_counter() - start
+
+    return [
+        Prediction(
+            label=class_label(class_names, class_id),
+            class_id=class_id,
+            confidence=conf,
+            batch_index=batch_index,
+            batch_size=n,
+            batch_time=elapsed,
+            image_time=elapsed / n,
+            top_k=top,
+            tier=tier,
+        )
+        for conf, class_id, top, tier in zip(confidence.tolist(), pred_class.tolist(), tops, tiers)
+    ]
+
+
+def predict_batch(model, images, transform, class_names,
+                  batch_size=DEFAULT_BATCH_SIZE, device="cpu", model_name=""):
+    """
+    Классифицирует список PIL-изображений батчами.
+
+    Изображения проходят transform (transforms.Compose или Preprocessor
+    из models.preprocessing), складываются в тензор по batch_size штук,
+    на каждый батч выполняется один forward под torch.no_grad().
+    Возвращает список Prediction в порядке входных изображений.
+    """
+    results = []
+
+    for batch_index, chunk in enumerate(iter_batches(list(images), batch_size)):
+        start = time.perf_counter()
+        with timed("preprocess", model_name):
+            if hasattr(transform, "batch"):
+                # Preprocessor: весь батч пишется в переиспользуемый тензор
+                batch = transform.batch(chunk)
+            else:
+                batch = torch.stack([transform(img) for img in chunk])
+        preprocess_time = time.perf_counter() - start
+
+        predictions = predict_tensor_batch(model, batch, class_names, batch_index, device,
+                                           model_name)
+
+        # В стоимость изображения включаем и предобработку батча
+        for p in predictions:
+            p.batch_time += preprocess_time
+            p.image_time = p.batch_time / p.batch_size
+
+        results.extend(predictions)
+
+    return results
@@ -0,0 +1,238 @@
+import argparse
+import json
+
+import torch
+
+from models.specs import metrics_path   # реэкспорт: путь нужен и страницам без torch
+
+# ===================== КОНСТАНТЫ =====================
+
+TOP_K = (1, 5)
+
+
+# ===================== НАКОПИТЕЛЬ =====================
+
+class MetricsAccumulator:
+    """
+    Матрица ошибок и top-k, обновляемые одной векторной операцией на батч.
+
+    update(logits, labels) или update(preds, labels) — без списков
+    предсказаний в Python и без sklearn. Из матрицы считаются accuracy,
+    macro / weighted F1, precision / recall по классам; top-k — по логитам
+    (или по готовым id через update_topk). Накопители из разных процессов
+    складываются через merge() или all_reduce(); state_dict() — в JSON.
+    """
+
+    def __init__(self, num_classes, top_k=TOP_K, class_names=None):
+        self.num_classes = num_classes
+        self.top_k = tuple(k for k in top_k if k <= num_classes)
+        self.class_names = class_names
+        self.cm = torch.zeros(num_classes, num_classes, dtype=torch.long)
+        self.topk_correct = {k: 0 for k in self.top_k}
+        self.topk_known = True   # False, если хоть раз пришли только классы без логитов
+
+    # -------- Обновление --------
+
+    def update(self, output, labels):
+        """output — логиты [N, C] или предсказанные классы [N]; labels — [N]."""
+        labels = labels.reshape(-1).long().cpu()
+        if output.dim() == 2:
+            output = output.detach().cpu()
+            top = output.topk(max(self.top_k), dim=1).indices if self.top_k else None
+            preds = output.argmax(dim=1)
+            if top is not None:
+                hits = top == labels.unsqueeze(1)
+                for k in self.top_k:
+                    self.topk_correct[k] += hits[:, :k].any(dim=1).sum().item()
+        else:
+            preds = output.reshape(-1).long().cpu()
+            self.topk_known = False
+        n = self.num_classes
+        self.cm += torch.bincount(labels * n + preds, minlength=n * n).view(n, n)
+        return self
+
+    def update_topk(self, top_ids, labels):
+        """top_ids — [N, K] id классов по убыванию вероятности (например, из Prediction.top_k)."""
+        top_ids = torch.as_tensor(top_ids).long().reshape(len(labels), -1)
+        labels = torch.as_tensor(labels).long()
+        n = self.num_classes
+        self.cm += torch.bincount(labels * n + top_ids[:, 0], minlength=n * n).view(n, n)
+        hits = top_ids == labels.unsqueeze(1)
+        for k in self.top_k:
+            if k <= top_ids.shape[1]:
+                self.topk_correct[k] += hits[:, :k].any(dim=1).sum().item()
+        return self
+
+    # -------- Объединение --------
+
+    def merge(self, other):
+        if other.num_classes != self.num_classes:
+            raise ValueError(f"Разное число классов: {self.num_classes} и {other.num_classes}")
+        self.cm += other.cm
+        self.topk_known &= other.topk_known
+        for k in self.top_k:
+            self.topk_correct[k] += other.topk_correct.get(k, 0)
+        return self
+
+    def all_reduce(self):
+        """Сумма по всем процессам torch.distributed (если он инициализирован)."""
+        import torch.distributed as dist
+        if dist.is_available() and dist.is_initialized():
+            dist.all_reduce(self.cm)
+            counts = torch.tensor([self.topk_correct[k] for k in self.top_k], dtype=torch.long)
+            dist.all_reduce(counts)
+            self.topk_correct = dict(zip(self.top_k, counts.tolist()))
+        return self
+
+    def state_dict(self):
+        return {
+            "num_classes": self.num_classes,
+            "class_names": self.class_names,
+            "confusion_matrix": self.cm.tolist(),
+            "topk_correct": ({str(k): v for k, v in self.topk_correct.items()}
+                             if self.topk_known else {}),
+        }
+
+    @classmethod
+    def from_state_dict(cls, state):
+        topk = {int(k): v for k, v in state.get("topk_correct", {}).items()}
+        acc = cls(state["num_classes"], tuple(topk) or TOP_K, state.get("class_names"))
+        acc.cm = torch.tensor(state["confusion_matrix"], dtype=torch.long)
+        acc.topk_correct.update(topk)
+        acc.topk_known = bool(topk)
+        return acc
+
+    # -------- Метрики --------
+
+    @property
+    def total(self):
+        return int(self.cm.sum())
+
+    @property
+    def support(self):
+        return self.cm.sum(dim=1)
+
+    @property
+    def accuracy(self):
+        return self.cm.diag().sum().item() / max(self.total, 1)
+
+    @property
+    def precision(self):
+        return self.cm.diag().double() / self.cm.sum(dim=0).clamp(min=1)
+
+    @property
+    def recall(self):
+        return self.cm.diag().double() / self.cm.sum(dim=1).clamp(min=1)
+
+    @property
+    def f1(self):
+        p, r = self.precision, self.recall
+        return 2 * p * r / (p + r).clamp(min=1e-12)
+
+    @property
+    def macro_f1(self):
+        """
+        Среднее F1 по классам, встретившимся в метках или предсказаниях, —
+        как sklearn f1_score(average="macro"): на выборке из части классов
+        (bulk по 10 картинкам из 100) отсутствующие классы не тянут вниз.
+        """
+        present = (self.cm.sum(dim=1) > 0) | (self.cm.sum(dim=0) > 0)
+        if not present.any():
+            return 0.0
+        return self.f1[present].mean().item()
+
+    @property
+    def weighted_f1(self):
+        support = self.support.double()
+        return (self.f1 * support).sum().item() / max(support.sum().item(), 1)
+
+    def topk_accuracy(self, k):
+        return self.topk_correct[k] / max(self.total, 1)
+
+    def label(self, i):
+        names = self.class_names
+        if isinstance(names, dict):
+            return names.get(i, names.get(str(i), str(i)))
+        return names[i] if names else str(i)
+
+    def summary(self):
+        """Всё, что нужно странице «Сводная информация» и отчётам, в одном словаре."""
+        precision, recall, f1 = self.precision.tolist(), self.recall.tolist(), self.f1.tolist()
+        return {
+            "total": self.total,
+            "accuracy": self.accuracy,
+            "macro_f1": self.macro_f1,
+            "weighted_f1": self.weighted_f1,
+            "top_k": ({str(k): self.topk_accuracy(k) for k in self.top_k}
+                      if self.topk_known else {}),
+            "per_class": [
+                {"class": self.label(i), "precision": precision[i], "recall": recall[i],
+                 "f1": f1[i], "support": int(self.support[i])}
+                for i in range(self.num_classes)
+            ],
+        }
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(dict(self.state_dict(), summary=self.summary()), f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_state_dict(json.load(f))
+
+
+# ===================== ОЦЕНКА МОДЕЛИ =====================
+
+def evaluate(model, loader, num_classes, class_names=None, top_k=TOP_K):
+    """Один проход по DataLoader без накопления предсказаний в списках."""
+    acc = MetricsAccumulator(num_classes, top_k, class_names)
+    model.eval()
+    with torch.inference_mode():
+        for images, labels in loader:
+            acc.update(model(images), labels)
+    return acc
+
+
+if __name__ == "__main__":
+    # python -m models.metrics eval intel data/intel/seg_test/seg_test
+    # python -m models.metrics merge part1.metrics.json part2.metrics.json -o all.metrics.json
+    parser = argparse.ArgumentParser(description="Матрица ошибок и метрики по классам")
+    sub = parser.add_subparsers(dest="command", required=True)
+    ev = sub.add_parser("eval", help="оценить модель страницы на ImageFolder")
+    ev.add_argument("model")
+    ev.add_argument("root")
+    ev.add_argument("--batch-size", type=int, default=64)
+    ev.add_argument("--workers", type=int, default=0)
+    ev.add_argument("-o", "--output", help="по умолчанию рядом с чекпоинтом (*.metrics.json)")
+    mg = sub.add_parser("merge", help="сложить накопители из разных процессов")
+    mg.add_argument("inputs", nargs="+")
+    mg.add_argument("-o", "--output", required=True)
+    args = parser.parse_args()
+
+    if args.command == "eval":
+        from torchvision import datasets
+
+        from models.preprocessing import get_preprocessor
+        from models.registry import MODEL_SPECS, get_model, load_class_names
+
+        spec = MODEL_SPECS[args.model]
+        dataset = datasets.ImageFolder(args.root, transform=get_preprocessor(args.model))
+        loader = torch.utils.data.DataLoader(dataset, batch_size=args.batch_size,
+                                             num_workers=args.workers)
+        result = evaluate(get_model(args.model), loader, spec.num_classes,
+                          load_class_names(args.model))
+        output = args.output or metrics_path(spec.path)
+    else:
+        accs = [MetricsAccumulator.load(p) for p in args.inputs]
+        result = accs[0]
+        for other in accs[1:]:
+            result.merge(other)
+        output = args.output
+
+    result.save(output)
+    s = result.summary()
+    print(f"{s['total']} изображений: accuracy {s['accuracy']:.4f}, macro F1 {s['macro_f1']:.4f}, "
+          f"weighted F1 {s['weighted_f1']:.4f}, "
+          + ", ".join(f"top-{k} {v:.4f}" for k, v in s["top_k"].items())
+          + f" -> {output}")
@@ -5,8 +5,10 @@ import torch.nn as nn
 NUM_CLASSES = 4
 
 
-def build_model():
-    model = resnet18(weights=ResNet18_Weights.DEFAULT)
+def build_model(pretrained=False):
+    # ImageNet-веса нужны только для обучения: при загрузке чекпоинта они перезаписываются
+    weights = ResNet18_Weights.DEFAULT if pretrained else None
+    model = resnet18(weights=weights)
     model.fc = nn.Linear(model.fc.in_features, NUM_CLASSES)
     return model
 
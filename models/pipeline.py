@@ -0,0 +1,129 @@
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from models.inference import DEFAULT_BATCH_SIZE, predict_tensor_batch
+from models.telemetry import gauge
+
+# ===================== КОНСТАНТЫ =====================
+
+DECODE_WORKERS = int(os.environ.get("PIPELINE_DECODE_WORKERS", min(4, os.cpu_count() or 1)))
+QUEUE_SIZE = 64
+
+
+# ===================== КОНВЕЙЕР =====================
+
+def _prepare(preprocessor, source):
+    # Выполняется в пуле: декодирование и resize в PIL отпускают GIL
+    return preprocessor(preprocessor.open(source))
+
+
+def stream_predictions(model, sources, preprocessor, class_names,
+                       batch_size=DEFAULT_BATCH_SIZE, decode_workers=DECODE_WORKERS,
+                       queue_size=QUEUE_SIZE, device="cpu", model_name="", top_k=1):
+    """
+    Декодирование в пуле потоков параллельно с forward.
+
+    sources — байты, пути или файловые объекты; читаются лениво, так что
+    это может быть и генератор на миллионы файлов. preprocessor — Preprocessor
+    из models.preprocessing. Пока модель считает батч, пул готовит следующие
+    изображения (не больше queue_size наперёд). Батч отправляется в модель,
+    как только набран batch_size или следующее изображение ещё не готово,
+    поэтому первые результаты появляются до окончания декодирования.
+
+    Выдаёт (index, Prediction | None, error | None) в порядке входа.
+    """
+    sources = enumerate(sources)
+    queue_size = max(queue_size, batch_size)
+    pending = deque()
+    exhausted = False
+    batch_index = 0
+
+    with ThreadPoolExecutor(max_workers=max(1, decode_workers)) as pool:
+
+        def refill():
+            nonlocal exhausted
+            while not exhausted and len(pending) < queue_size:
+                item = next(sources, None)
+                if item is None:
+                    exhausted = True
+                    break
+                index, source = item
+                pending.append((index, pool.submit(_prepare, preprocessor, source)))
+
+        refill()
+        while pending:
+            gauge("pipeline_queue_depth", len(pending), model=model_name or "unknown")
+            indices, tensors = [], []
+
+            # Набираем батч: ждём только первый элемент, остальные — если уже готовы
+            while pending and len(tensors) < batch_size:
+                index, future = pending[0]
+                if tensors and not future.done():
+                    break
+                pending.popleft()
+                try:
+                    tensors.append(future.result())
+                    indices.append(index)
+                except Exception as e:
+                    yield index, None, e
+                refill()
+
+            if not tensors:
+                continue
+
+            batch = torch.stack(tensors)
+            try:
+                predictions = predict_tensor_batch(model, batch, class_names, batch_index, device,
+                                                   model_name, top_k)
+            except Exception as e:
+                # Например, SchedulerBusy: ошибка достаётся каждому изображению батча
+                for index in indices:
+                    yield index, None, e
+                continue
+            batch_index += 1
+            for index, pred in zip(indices, predictions):
+                yield index, pred, None
+
+        gauge("pipeline_queue_depth", 0, model=model_name or "unknown")
+
+
+# ===================== СРАВНЕНИЕ С ПОСЛЕДОВАТЕЛЬНЫМ ЦИКЛОМ =====================
+
+def compare_with_serial(model, sources, preprocessor, class_names, batch_size=DEFAULT_BATCH_SIZE):
+    """Время старого цикла «по одному» и конвейера на одних и тех же данных."""
+    start = time.perf_counter()
+    with torch.no_grad():
+        for src in sources:
+            model(preprocessor(preprocessor.open(src)).unsqueeze(0))
+    serial = time.perf_counter() - start
+
+    start = time.perf_counter()
+    first = None
+    for _ in stream_predictions(model, sources, preprocessor, class_names, batch_size):
+        if first is None:
+            first = time.perf_counter() - start
+    pipelined = time.perf_counter() - start
+    return {"serial": serial, "pipelined": pipelined, "first_result": first}
+
+
+if __name__ == "__main__":
+    # python -m models.pipeline [N] — N копий изображений из images/
+    from models.preprocessing import get_preprocessor
+    from models.registry import build_resnet18
+
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    files = [os.path.join("images", f) for f in sorted(os.listdir("images"))
+             if f.endswith((".jpg", ".png"))]
+    raw = [open(f, "rb").read() for f in files]
+    sources = [raw[i % len(raw)] for i in range(n)]
+
+    model = build_resnet18(6).eval()
+    result = compare_with_serial(model, sources, get_preprocessor("intel"), list(range(6)))
+    print(f"{n} изображений: последовательно {result['serial']:.2f} с, "
+          f"конвейер {result['pipelined']:.2f} с (x{result['serial'] / result['pipelined']:.1f}), "
+          f"первый результат через {result['first_result']:.2f} с")
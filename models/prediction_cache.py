@@ -0,0 +1,169 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import replace
+
+from models.registry import get_registry
+from models.telemetry import count
+
+# ===================== КОНСТАНТЫ =====================
+
+DEFAULT_MAX_ENTRIES = int(os.environ.get("PREDICTION_CACHE_SIZE", 4096))
+
+
+# ===================== КЭШ =====================
+
+class PredictionCache:
+    """
+    Кэш предсказаний, общий для всех сессий процесса.
+
+    Ключ — sha256 исходных байтов изображения плюс имя модели и версия
+    чекпоинта, так что после переобучения старые ответы не возвращаются.
+    Размер ограничен, при переполнении удаляется самая старая запись.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(data, model_name, version):
+        digest = hashlib.sha256(data).hexdigest()
+        return f"{model_name}:{version}:{digest}"
+
+    def get(self, key):
+        model = key.split(":", 1)[0]
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self._data.move_to_end(key)
+                self.hits += 1
+        count("prediction_cache_misses_total" if value is None else "prediction_cache_hits_total",
+              model=model)
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_prediction_cache():
+    """Единственный экземпляр кэша на процесс."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = PredictionCache()
+        return _cache
+
+
+def describe_cache():
+    """Короткая строка со счётчиками кэша для подписи на странице."""
+    stats = get_prediction_cache().stats()
+    return (f"Кэш предсказаний: {stats['size']}/{stats['max_entries']} записей, "
+            f"попаданий {stats['hits']}, промахов {stats['misses']} "
+            f"({stats['hit_rate']:.0%})")
+
+
+# ===================== ПРЕДСКАЗАНИЕ С КЭШЕМ =====================
+
+def predict_cached(model_name, raw_images, decode, predict_many, cache=None):
+    """
+    Предсказания для списка сырых байтов изображений.
+
+    Через predict_many(list[PIL.Image]) проходят только промахи кэша,
+    декодируются тоже только они. Возвращает (predictions, errors):
+    predictions[i] — Prediction или None, errors — {i: исключение декодирования}.
+    """
+    cache = cache or get_prediction_cache()
+    info = get_registry().info(model_name)
+    version = info.version if info else ""
+
+    predictions = [None] * len(raw_images)
+    errors = {}
+    miss_keys, miss_idx, miss_images = [], [], []
+
+    for i, data in enumerate(raw_images):
+        start = time.perf_counter()
+        key = cache.make_key(data, model_name, version)
+        cached = cache.get(key)
+        if cached is not None:
+            lookup = time.perf_counter() - start
+            predictions[i] = replace(cached, cached=True, image_time=lookup)
+            continue
+        try:
+            miss_images.append(decode(data))
+        except Exception as e:
+            errors[i] = e
+            continue
+        miss_keys.append(key)
+        miss_idx.append(i)
+
+    if miss_images:
+        for i, key, pred in zip(miss_idx, miss_keys, predict_many(miss_images)):
+            cache.put(key, pred)
+            predictions[i] = pred
+
+    return predictions, errors
+
+
+def stream_cached(model_name, raw_images, stream_misses, cache=None):
+    """
+    Потоковый вариант predict_cached.
+
+    Попадания кэша выдаются сразу, промахи (сырые байты) уходят в
+    stream_misses(list[bytes]) — например, models.pipeline.stream_predictions —
+    и выдаются по мере готовности. Выдаёт (index, Prediction | None, error | None).
+    """
+    cache = cache or get_prediction_cache()
+    info = get_registry().info(model_name)
+    version = info.version if info else ""
+
+    miss_keys, miss_idx, miss_data = [], [], []
+    for i, data in enumerate(raw_images):
+        start = time.perf_counter()
+        key = cache.make_key(data, model_name, version)
+        cached = cache.get(key)
+        if cached is not None:
+            yield i, replace(cached, cached=True, image_time=time.perf_counter() - start), None
+            continue
+        miss_keys.append(key)
+        miss_idx.append(i)
+        miss_data.append(data)
+
+    if miss_data:
+        for j, pred, error in stream_misses(miss_data):
+            if pred is not None:
+                cache.put(miss_keys[j], pred)
+            yield miss_idx[j], pred, error
@@ -0,0 +1,219 @@
+import os
+import sys
+import threading
+from dataclasses import dataclass
+from io import BytesIO
+
+import numpy as np
+import torch
+from PIL import Image
+from torchvision import transforms
+
+from models.telemetry import timed
+
+# ===================== КОНСТАНТЫ =====================
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+# Защита от «бомб» вида 20000×20000: проверяется до декодирования
+MAX_PIXELS = int(os.environ.get("PREPROCESS_MAX_PIXELS", 50_000_000))
+
+# Быстрое декодирование JPEG (draft) меняет пиксели относительно прежних
+# transforms, поэтому включается явно: PREPROCESS_FAST_DECODE=1
+FAST_DECODE = os.environ.get("PREPROCESS_FAST_DECODE", "0") == "1"
+# При быстром декодировании JPEG масштаб выбирается так, чтобы картинка
+# осталась минимум в DRAFT_FACTOR раз больше, чем нужно для Resize
+DRAFT_FACTOR = 2
+# Допуски сравнения с torchvision (в единицах нормализованного тензора):
+# полное декодирование — до ошибки float32, draft — в среднем по пикселям
+EXACT_TOLERANCE = 1e-5
+FAST_DECODE_MEAN_TOLERANCE = 0.05
+
+
+@dataclass(frozen=True)
+class PreprocessSpec:
+    """
+    Параметры предобработки страницы.
+
+    resize — int (меньшая сторона, как transforms.Resize(256))
+    или (h, w) (как transforms.Resize((224, 224))); crop — размер CenterCrop или None.
+    """
+    resize: object
+    crop: object = None
+    mean: tuple = IMAGENET_MEAN
+    std: tuple = IMAGENET_STD
+
+    @property
+    def output_size(self):
+        if self.crop is not None:
+            return (self.crop, self.crop)
+        return tuple(self.resize)
+
+
+# Ровно те же преобразования, что были на страницах
+PREPROCESS_SPECS = {
+    "sports": PreprocessSpec(resize=256, crop=224),
+    "blood_cells": PreprocessSpec(resize=256, crop=224),   # ResNet18_Weights.DEFAULT.transforms()
+    "intel": PreprocessSpec(resize=(224, 224)),
+}
+
+
+# ===================== ПРЕДОБРАБОТКА =====================
+
+def resized_size(width, height, resize):
+    """Размер после transforms.Resize — та же арифметика, что в torchvision."""
+    if isinstance(resize, int):
+        short, long = (width, height) if width <= height else (height, width)
+        new_short, new_long = resize, int(resize * long / short)
+        return (new_short, new_long) if width <= height else (new_long, new_short)
+    h, w = resize
+    return (w, h)
+
+
+class Preprocessor:
+    """
+    Декодирование + Resize/CenterCrop + нормализация одним шагом.
+
+    Вызов preprocessor(img) совместим с transforms.Compose и возвращает
+    тензор [3, H, W]. Метод batch(images) пишет весь батч в заранее
+    выделенный тензор, который переиспользуется между вызовами (свой на поток):
+    результат действителен до следующего вызова batch в этом потоке.
+    """
+
+    def __init__(self, spec, fast_decode=FAST_DECODE, max_pixels=MAX_PIXELS, name=""):
+        self.spec = spec
+        self.name = name
+        self.fast_decode = fast_decode
+        self.max_pixels = max_pixels
+        std = torch.tensor(spec.std).view(3, 1, 1)
+        mean = torch.tensor(spec.mean).view(3, 1, 1)
+        # (x / 255 - mean) / std == x * scale - shift
+        self._scale = 1.0 / (255.0 * std)
+        self._shift = mean / std
+        self._local = threading.local()
+
+    # -------- Декодирование --------
+
+    def _draft_size(self, width, height):
+        if isinstance(self.spec.resize, int):
+            k = DRAFT_FACTOR * self.spec.resize / min(width, height)
+        else:
+            h, w = self.spec.resize
+            k = DRAFT_FACTOR * max(w / width, h / height)
+        k = min(1.0, k)
+        return (int(width * k), int(height * k))
+
+    def open(self, source):
+        """Открывает файл/байты с проверкой числа пикселей (и draft-декодированием JPEG при fast_decode)."""
+        with timed("decode", self.name):
+            if isinstance(source, (bytes, bytearray)):
+                source = BytesIO(source)
+            img = Image.open(source)
+            width, height = img.size
+            if width * height > self.max_pixels:
+                raise ValueError(
+                    f"Слишком большое изображение: {width}×{height} "
+                    f"(лимит {self.max_pixels} пикселей)"
+                )
+            if self.fast_decode:
+                img.draft("RGB", self._draft_size(width, height))
+            return img.convert("RGB")
+
+    decode = open
+
+    # -------- Геометрия --------
+
+    def resize_crop(self, img):
+        spec = self.spec
+        size = resized_size(img.width, img.height, spec.resize)
+        if size != img.size:
+            img = img.resize(size, Image.BILINEAR)
+        if spec.crop is not None:
+            # transforms.CenterCrop: отступы округляются так же, как в torchvision
+            left = int(round((img.width - spec.crop) / 2.0))
+            top = int(round((img.height - spec.crop) / 2.0))
+            img = img.crop((left, top, left + spec.crop, top + spec.crop))
+        return img
+
+    # -------- Тензоры --------
+
+    def _buffer(self, n):
+        buf = getattr(self._local, "buffer", None)
+        if buf is None or buf.shape[0] < n:
+            h, w = self.spec.output_size
+            buf = torch.empty((n, 3, h, w), dtype=torch.float32)
+            self._local.buffer = buf
+        return buf[:n]
+
+    def _fill(self, out, img):
+        # np.asarray над PIL — только для чтения; пишем в numpy-вид out (HWC),
+        # без torch.from_numpy над неизменяемым массивом и без лишней копии
+        arr = np.asarray(self.resize_crop(img))
+        np.copyto(out.numpy().transpose(1, 2, 0), arr)
+
+    def __call__(self, img):
+        out = torch.empty((3, *self.spec.output_size), dtype=torch.float32)
+        self._fill(out, img)
+        return out.mul_(self._scale).sub_(self._shift)
+
+    def batch(self, images):
+        """Список PIL-изображений (или байтов) -> нормализованный батч [N, 3, H, W]."""
+        out = self._buffer(len(images))
+        for i, img in enumerate(images):
+            if not isinstance(img, Image.Image):
+                img = self.open(img)
+            self._fill(out[i], img)
+        return out.mul_(self._scale).sub_(self._shift)
+
+    def reference_transform(self):
+        """torchvision-эквивалент — для проверки совпадения результатов."""
+        spec = self.spec
+        steps = [transforms.Resize(spec.resize)]
+        if spec.crop is not None:
+            steps.append(transforms.CenterCrop(spec.crop))
+        steps += [transforms.ToTensor(), transforms.Normalize(list(spec.mean), list(spec.std))]
+        return transforms.Compose(steps)
+
+
+_preprocessors = {}
+
+
+def get_preprocessor(name):
+    """Общий Preprocessor для модели по имени из PREPROCESS_SPECS."""
+    if name not in _preprocessors:
+        _preprocessors[name] = Preprocessor(PREPROCESS_SPECS[name], name=name)
+    return _preprocessors[name]
+
+
+# ===================== ПРОВЕРКА ЭКВИВАЛЕНТНОСТИ =====================
+
+def diff_stats(spec, paths, fast_decode=False):
+    """
+    (max |diff|, mean |diff|) с текущим torchvision-преобразованием.
+
+    Эталон — полное декодирование + transforms; проверяемый путь декодирует
+    файлы сам (с draft при fast_decode), как это делают страницы.
+    """
+    reference = Preprocessor(spec).reference_transform()
+    candidate = Preprocessor(spec, fast_decode=fast_decode)
+    expected = torch.stack([reference(Image.open(p).convert("RGB")) for p in paths])
+    diff = (candidate.batch([candidate.open(p) for p in paths]) - expected).abs()
+    return diff.max().item(), diff.mean().item()
+
+
+if __name__ == "__main__":
+    # python -m models.preprocessing images/*.jpg (то же проверяет tests/test_preprocessing.py)
+    paths = sys.argv[1:] or [
+        os.path.join("images", f) for f in sorted(os.listdir("images"))
+        if f.endswith((".jpg", ".png"))
+    ]
+    failed = False
+    for name, spec in PREPROCESS_SPECS.items():
+        exact, _ = diff_stats(spec, paths)
+        _, fast_mean = diff_stats(spec, paths, fast_decode=True)
+        ok = exact < EXACT_TOLERANCE and fast_mean < FAST_DECODE_MEAN_TOLERANCE
+        failed |= not ok
+        print(f"{name:12s} max |diff| = {exact:.2e}, draft mean |diff| = {fast_mean:.2e} "
+              f"{'OK' if ok else 'FAIL'}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,247 @@
+import argparse
+import json
+import logging
+import os
+import time
+
+import torch
+import torch.nn as nn
+from torch.ao.quantization import get_default_qconfig
+from torchvision import datasets
+from torchvision.models.quantization import resnet18 as quantizable_resnet18
+
+from models.backends import TorchScriptModel
+from models.metrics import evaluate as evaluate_loader
+from models.preprocessing import get_preprocessor
+from models.registry import MODEL_SPECS, checkpoint_version, load_eager, load_weights
+from models.training import DATA_DIRS
+
+logger = logging.getLogger(__name__)
+
+# ===================== КОНСТАНТЫ =====================
+
+QUANT_BACKEND = "x86"
+CALIBRATION_IMAGES = 64
+# INT8 включается, только если accuracy на отложенной выборке упала не больше чем на столько
+MAX_ACCURACY_DROP = float(os.environ.get("QUANT_MAX_ACCURACY_DROP", 0.01))
+
+# Калибровка — на обучающей выборке своей модели, проверка — на отложенной.
+# Без отдельной валидации в DATA_DIRS (blood_cells) — папка TEST датасета
+EVAL_DIRS = {name: valid or os.path.join(os.path.dirname(train), "TEST")
+             for name, (train, valid) in DATA_DIRS.items()}
+
+# Значения, которые сейчас показывает страница «Сводная информация»
+SUMMARY_METRICS = {
+    "sports": ("accuracy", 0.96),
+    "blood_cells": ("f1", 0.82),
+    "intel": ("accuracy", 0.901),
+}
+
+
+def quantized_path(spec):
+    """models/intel_model.pt -> models/intel_model.int8.pt"""
+    root, _ = os.path.splitext(spec.path)
+    return root + ".int8.pt"
+
+
+def _meta_path(spec):
+    return quantized_path(spec) + ".json"
+
+
+class QuantizationRejected(RuntimeError):
+    """INT8-модель теряет больше MAX_ACCURACY_DROP — в кэш она не сохраняется."""
+
+    def __init__(self, message, check):
+        super().__init__(message)
+        self.check = check
+
+
+# ===================== КВАНТОВАНИЕ =====================
+
+def build_quantizable(spec):
+    """ResNet18 со QuantStub/DeQuantStub и весами из чекпоинта."""
+    model = quantizable_resnet18(weights=None, quantize=False)
+    model.fc = nn.Linear(model.fc.in_features, spec.num_classes)
+    model.load_state_dict(load_weights(spec))
+    model.eval()
+    return model
+
+
+def calibration_batches(spec, sources, batch_size=16):
+    """Батчи для калибровки с той же предобработкой, что на странице."""
+    preprocessor = get_preprocessor(spec.name)
+    for start in range(0, len(sources), batch_size):
+        chunk = [preprocessor.open(s) for s in sources[start:start + batch_size]]
+        yield preprocessor.batch(chunk).clone()
+
+
+def quantize_static(spec, sources):
+    """Post-training static INT8: fuse -> prepare -> калибровка -> convert."""
+    torch.backends.quantized.engine = QUANT_BACKEND
+    model = build_quantizable(spec)
+    model.fuse_model(is_qat=False)
+    model.qconfig = get_default_qconfig(QUANT_BACKEND)
+    torch.ao.quantization.prepare(model, inplace=True)
+
+    with torch.no_grad():
+        for batch in calibration_batches(spec, sources):
+            model(batch)
+
+    torch.ao.quantization.convert(model, inplace=True)
+    return model
+
+
+def folder_sources(root, limit=CALIBRATION_IMAGES):
+    """Равномерная выборка из ImageFolder-дерева."""
+    dataset = datasets.ImageFolder(root)
+    step = max(1, len(dataset.samples) // limit)
+    return [path for path, _ in dataset.samples[::step]][:limit]
+
+
+# ===================== КЭШ НА ДИСКЕ =====================
+
+def _require_dir(path, what):
+    if not path or not os.path.isdir(path):
+        raise FileNotFoundError(f"Нет {what} {path!r}: INT8 калибруется и проверяется "
+                                f"только на данных своей модели")
+    return path
+
+
+def build_quantized(spec, calib_dir=None, eval_dir=None, max_drop=MAX_ACCURACY_DROP):
+    """
+    Квантует модель на калибровочном наборе своей задачи и сравнивает с fp32
+    на отложенной выборке. TorchScript рядом с исходным чекпоинтом
+    сохраняется, только если accuracy упала не больше max_drop, иначе —
+    QuantizationRejected. Возвращает (модель, результат проверки).
+    """
+    calib_dir = _require_dir(calib_dir or DATA_DIRS[spec.name][0], "калибровочного набора")
+    eval_dir = _require_dir(eval_dir or EVAL_DIRS[spec.name], "отложенной выборки")
+    sources = folder_sources(calib_dir)
+    model = quantize_static(spec, sources)
+
+    fp32_metrics = evaluate(load_eager(spec), spec, eval_dir)
+    int8_metrics = evaluate(model, spec, eval_dir)
+    check = {"fp32": fp32_metrics, "int8": int8_metrics, "eval_dir": eval_dir,
+             "accuracy_drop": fp32_metrics["accuracy"] - int8_metrics["accuracy"],
+             "max_drop": max_drop}
+    if check["accuracy_drop"] > max_drop:
+        raise QuantizationRejected(
+            f"{spec.name}: INT8 теряет {check['accuracy_drop']:.2%} accuracy "
+            f"(допустимо {max_drop:.2%}) — INT8 не включён", check)
+
+    h, w = get_preprocessor(spec.name).spec.output_size
+    scripted = torch.jit.trace(model, torch.zeros(1, 3, h, w))
+    torch.jit.save(scripted, quantized_path(spec))
+    with open(_meta_path(spec), "w", encoding="utf-8") as f:
+        json.dump({"source_version": checkpoint_version(spec.path),
+                   "backend": QUANT_BACKEND,
+                   "calibration_dir": calib_dir,
+                   "calibration_images": len(sources),
+                   **check}, f, ensure_ascii=False)
+    return scripted, check
+
+
+def load_quantized(spec):
+    """
+    INT8-модель из кэша, собранного и проверенного build_quantized.
+
+    Страница не квантует сама: если кэша нет, он устарел или не прошёл
+    проверку точности, грузится fp32 (с предупреждением в логе).
+    """
+    torch.backends.quantized.engine = QUANT_BACKEND
+    path = quantized_path(spec)
+    try:
+        with open(_meta_path(spec), encoding="utf-8") as f:
+            meta = json.load(f)
+        fresh = (meta["source_version"] == checkpoint_version(spec.path)
+                 and meta["accuracy_drop"] <= MAX_ACCURACY_DROP)
+    except (OSError, ValueError, KeyError):
+        fresh = False
+    if not fresh or not os.path.exists(path):
+        logger.warning("INT8 для %s не собран, устарел или не прошёл проверку точности — "
+                       "используется fp32 (python -m models.quantization --model %s)",
+                       spec.name, spec.name)
+        return load_eager(spec)
+    model = torch.jit.load(path, map_location="cpu")
+    model.eval()
+    # Упакованные INT8-веса не видны в state_dict() TorchScript — размер по файлу
+    return TorchScriptModel(model, os.path.getsize(path))
+
+
+# ===================== ОТЧЁТ =====================
+
+def measure_latency(model, shape, runs=20, warmup=3):
+    x = torch.randn(*shape)
+    with torch.no_grad():
+        for _ in range(warmup):
+            model(x)
+        start = time.perf_counter()
+        for _ in range(runs):
+            model(x)
+    return (time.perf_counter() - start) / runs
+
+
+def evaluate(model, spec, root, batch_size=64):
+    """Accuracy и macro F1 на ImageFolder-наборе."""
+    preprocessor = get_preprocessor(spec.name)
+    dataset = datasets.ImageFolder(root, transform=preprocessor)
+    loader = torch.utils.data.DataLoader(dataset, batch_size=batch_size)
+    metrics = evaluate_loader(model, loader, spec.num_classes)
+    return {"accuracy": metrics.accuracy, "f1": metrics.macro_f1}
+
+
+def report(name, calib_dir=None, eval_dir=None, batch_size=1, max_drop=MAX_ACCURACY_DROP):
+    """Латентность, размер на диске и изменение метрики fp32 -> int8; accepted — прошла ли проверка."""
+    spec = MODEL_SPECS[name]
+    metric, summary_value = SUMMARY_METRICS[name]
+    result = {"model": name, "summary_" + metric: summary_value}
+    try:
+        int8, check = build_quantized(spec, calib_dir, eval_dir, max_drop)
+        result["accepted"] = True
+    except QuantizationRejected as e:
+        int8, check = None, e.check
+        result["accepted"] = False
+    result.update({"fp32_" + metric: check["fp32"][metric], "int8_" + metric: check["int8"][metric],
+                   "delta_" + metric: check["int8"][metric] - check["fp32"][metric],
+                   "accuracy_drop": check["accuracy_drop"], "max_drop": max_drop})
+    if int8 is None:
+        return result
+
+    fp32 = load_eager(spec)
+    h, w = get_preprocessor(name).spec.output_size
+    shape = (batch_size, 3, h, w)
+    result.update({
+        "fp32_latency_ms": measure_latency(fp32, shape) * 1000,
+        "int8_latency_ms": measure_latency(int8, shape) * 1000,
+        "fp32_size_mb": os.path.getsize(spec.path) / 1024 / 1024,
+        "int8_size_mb": os.path.getsize(quantized_path(spec)) / 1024 / 1024,
+    })
+    return result
+
+
+if __name__ == "__main__":
+    # python -m models.quantization --model intel (наборы по умолчанию — как в models.training)
+    parser = argparse.ArgumentParser(description="INT8-квантование моделей страниц")
+    parser.add_argument("--model", choices=list(MODEL_SPECS), action="append",
+                        help="какую модель квантовать (по умолчанию все)")
+    parser.add_argument("--calib-dir", help="ImageFolder для калибровки (по умолчанию train модели)")
+    parser.add_argument("--eval-dir", help="ImageFolder для проверки (по умолчанию валидация модели)")
+    parser.add_argument("--max-drop", type=float, default=MAX_ACCURACY_DROP,
+                        help="допустимое падение accuracy")
+    parser.add_argument("--batch-size", type=int, default=1)
+    args = parser.parse_args()
+    names = args.model or list(MODEL_SPECS)
+    # Наборы у каждой модели свои: один каталог на несколько моделей откалибровал бы
+    # и проверил бы, например, sports на снимках intel
+    if (args.calib_dir or args.eval_dir) and len(names) != 1:
+        parser.error("--calib-dir и --eval-dir задаются только вместе с одной --model")
+
+    rejected = []
+    for name in names:
+        result = report(name, args.calib_dir, args.eval_dir, args.batch_size, args.max_drop)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        if not result["accepted"]:
+            rejected.append(name)
+    if rejected:
+        raise SystemExit(f"INT8 не включён для {', '.join(rejected)}: падение accuracy "
+                         f"больше {args.max_drop:.2%}")
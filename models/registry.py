@@ -0,0 +1,277 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import torch
+import torch.nn as nn
+from torchvision.models import mobilenet_v3_large, mobilenet_v3_small, resnet18
+from torchvision.models.resnet import BasicBlock, ResNet
+
+# Описание моделей живёт в models.specs (без torch) — реэкспорт для старых импортов
+from models.specs import (ARCHS, BACKENDS, CHECKPOINTS, CLASS_NAMES, MODEL_SPECS, PRECISIONS,
+                          TEACHER_ARCH, ModelSpec, load_class_names, student_path)
+
+# ===================== КОНСТАНТЫ =====================
+
+# Лимит памяти под веса всех загруженных моделей (МБ)
+DEFAULT_BUDGET_MB = float(os.environ.get("MODEL_REGISTRY_BUDGET_MB", 512))
+
+
+@dataclass
+class ModelInfo:
+    """Метаданные загруженной модели."""
+    name: str
+    path: str
+    version: str        # mtime_ns + размер файла чекпоинта (+ режим исполнения)
+    size_bytes: int     # параметры + буферы
+    load_time: float    # секунды
+    loaded_at: float
+    hits: int = 0
+
+
+# ===================== ПОСТРОЕНИЕ МОДЕЛИ =====================
+
+def build_resnet18(num_classes):
+    """ResNet18 без предобученных весов — они всё равно будут перезаписаны чекпоинтом."""
+    model = resnet18(weights=None)
+    model.fc = nn.Linear(model.fc.in_features, num_classes)
+    return model
+
+
+def build_resnet10(num_classes):
+    """ResNet по одному BasicBlock на стадию: вдвое меньше блоков, чем у ResNet18, те же имена слоёв."""
+    return ResNet(BasicBlock, [1, 1, 1, 1], num_classes=num_classes)
+
+
+def build_mobilenet(arch, num_classes, weights=None):
+    model = {"mobilenet_v3_small": mobilenet_v3_small,
+             "mobilenet_v3_large": mobilenet_v3_large}[arch](weights=weights)
+    model.classifier[-1] = nn.Linear(model.classifier[-1].in_features, num_classes)
+    return model
+
+
+ARCH_BUILDERS = {
+    "resnet18": build_resnet18,
+    "resnet10": build_resnet10,
+    "mobilenet_v3_small": lambda n: build_mobilenet("mobilenet_v3_small", n),
+    "mobilenet_v3_large": lambda n: build_mobilenet("mobilenet_v3_large", n),
+}
+
+
+def build_model(arch, num_classes):
+    """Каркас архитектуры без весов (см. ARCH_BUILDERS)."""
+    if arch not in ARCH_BUILDERS:
+        raise ValueError(f"Неизвестная архитектура {arch!r}, доступны: {', '.join(ARCH_BUILDERS)}")
+    return ARCH_BUILDERS[arch](num_classes)
+
+
+def load_weights(spec):
+    """state_dict чекпоинта: из плоского mmap-файла, если он собран и свежий, иначе torch.load."""
+    from models.flat_checkpoint import load_fresh
+    state_dict = load_fresh(spec)
+    if state_dict is None:
+        state_dict = torch.load(spec.path, map_location="cpu")
+    return state_dict
+
+
+def load_eager(spec):
+    # Каркас на meta-устройстве: веса не инициализируются и не копируются,
+    # параметры становятся тензорами из state_dict (в т.ч. поверх mmap)
+    with torch.device("meta"):
+        model = build_model(spec.arch, spec.num_classes)
+    model.load_state_dict(load_weights(spec), assign=True)
+    model.eval()
+    return model
+
+
+def load_checkpoint(spec):
+    """Модель в режиме, заданном в spec (precision, backend)."""
+    if spec.precision == "int8":
+        if spec.arch != TEACHER_ARCH:
+            raise ValueError(f"{spec.name}: INT8 (models.quantization) есть только для ResNet18")
+        from models.quantization import load_quantized
+        return load_quantized(spec)
+    if spec.backend != "eager":
+        from models.backends import load_backend
+        return load_backend(spec)
+    return load_eager(spec)
+
+
+def _nbytes(value):
+    if isinstance(value, torch.Tensor):
+        return value.numel() * value.element_size()
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    return 0
+
+
+def model_size_bytes(model):
+    """Сколько памяти занимают веса и буферы модели (в т.ч. упакованные INT8)."""
+    if hasattr(model, "size_bytes"):   # обёртки над внешними движками (ONNX Runtime)
+        return model.size_bytes
+    return sum(_nbytes(v) for v in model.state_dict().values())
+
+
+def unique_size_bytes(models):
+    """Память под веса нескольких моделей: тензоры, общие для них, считаются один раз."""
+    seen, total = set(), 0
+    for model in models:
+        if hasattr(model, "size_bytes") or not isinstance(model, nn.Module):
+            total += model_size_bytes(model)
+            continue
+        for value in model.state_dict().values():
+            if isinstance(value, torch.Tensor):
+                if value.data_ptr() in seen:
+                    continue
+                seen.add(value.data_ptr())
+            total += _nbytes(value)
+    return total
+
+
+def checkpoint_version(path):
+    st = os.stat(path)
+    return f"{st.st_mtime_ns}-{st.st_size}"
+
+
+def spec_version(spec):
+    """Версия для сравнения при перезагрузке и для ключей кэша предсказаний."""
+    version = checkpoint_version(spec.path)
+    if spec.precision != "fp32":
+        return f"{version}-{spec.precision}"
+    if spec.backend != "eager":
+        return f"{version}-{spec.backend}"
+    return version
+
+
+# ===================== РЕЕСТР =====================
+
+class ModelRegistry:
+    """
+    Общий для процесса реестр моделей.
+
+    Модель загружается при первом обращении, повторно — только если
+    изменился файл чекпоинта. При превышении лимита памяти выгружается
+    модель, к которой дольше всего не обращались.
+
+    Общий замок держится только на словаре и LRU. Загрузка (torch.load,
+    квантование, экспорт) идёт под замком своей модели: её ждут только
+    запросы к этой же модели, остальные уже загруженные отвечают сразу.
+    """
+
+    def __init__(self, specs=None, budget_mb=DEFAULT_BUDGET_MB, loader=load_checkpoint):
+        self.specs = dict(specs or MODEL_SPECS)
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self.loader = loader
+        self._models = OrderedDict()   # name -> (model, ModelInfo), порядок = LRU
+        self._lock = threading.RLock()
+        self._load_locks = {}          # name -> Lock загрузки этой модели
+        self.evictions = 0
+
+    def register(self, spec):
+        with self._lock:
+            self.specs[spec.name] = spec
+            self._models.pop(spec.name, None)
+
+    def get(self, name):
+        """Возвращает модель, при необходимости (пере)загружая её."""
+        spec = self.specs[name]
+        version = spec_version(spec)
+
+        model = self._cached(name, version)
+        if model is not None:
+            return model
+        with self._lock:
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+        with load_lock:
+            # Пока ждали замок, модель мог загрузить другой поток
+            model = self._cached(name, version)
+            if model is not None:
+                return model
+            entry = self._load(spec, version)
+            with self._lock:
+                self._models[name] = entry
+                return self._touch(name, entry)
+
+    def _cached(self, name, version):
+        with self._lock:
+            entry = self._models.get(name)
+            if entry is None or entry[1].version != version:
+                return None
+            return self._touch(name, entry)
+
+    def _touch(self, name, entry):
+        # Вызывается под self._lock
+        self._models.move_to_end(name)
+        entry[1].hits += 1
+        self._evict(keep=name)
+        return entry[0]
+
+    def info(self, name):
+        """ModelInfo загруженной модели или None."""
+        with self._lock:
+            entry = self._models.get(name)
+            return entry[1] if entry else None
+
+    def stats(self):
+        with self._lock:
+            return [info for _, info in self._models.values()]
+
+    def resident_bytes(self):
+        """Занято весами загруженных моделей; общие стадии (shared_trunk) — один раз."""
+        with self._lock:
+            return unique_size_bytes([model for model, _ in self._models.values()])
+
+    def unload(self, name):
+        with self._lock:
+            self._models.pop(name, None)
+
+    def _load(self, spec, version):
+        """(model, ModelInfo) — без общего замка."""
+        start = time.perf_counter()
+        model = self.loader(spec)
+        info = ModelInfo(
+            name=spec.name,
+            path=spec.path,
+            version=version,
+            size_bytes=model_size_bytes(model),
+            load_time=time.perf_counter() - start,
+            loaded_at=time.time(),
+        )
+        return model, info
+
+    def _evict(self, keep):
+        # Выгружаем самые старые модели, пока не уложимся в лимит
+        while self.resident_bytes() > self.budget_bytes and len(self._models) > 1:
+            oldest = next(iter(self._models))
+            if oldest == keep:
+                break
+            self._models.pop(oldest)
+            self.evictions += 1
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """Единственный экземпляр реестра на процесс."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ModelRegistry()
+        return _registry
+
+
+def get_model(name):
+    return get_registry().get(name)
+
+
+def describe_model(name):
+    """Короткая строка о загруженной модели для подписи на странице."""
+    info = get_registry().info(name)
+    if info is None:
+        return ""
+    return (f"Модель `{info.name}`: загружена за {info.load_time * 1000:.0f} мс, "
+            f"{info.size_bytes / 1024 / 1024:.1f} МБ в памяти")
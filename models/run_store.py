@@ -0,0 +1,149 @@
+import argparse
+import functools
+import os
+import sqlite3
+from contextlib import closing
+from dataclasses import dataclass, field
+from urllib.parse import quote
+
+# ===================== КОНСТАНТЫ =====================
+
+# Хранилища MLflow (SQLite), которые читает «Сводная информация»
+DB_PATHS = tuple(p for p in os.environ.get("MLFLOW_DBS", "mlflow.db,notebooks/mlflow.db").split(",")
+                 if p)
+
+# Эксперименты из ноутбуков по моделям страниц; запуски models.training
+# узнаются по имени "<модель>_script" в любом эксперименте
+MODEL_EXPERIMENTS = {
+    "sports": ("SIC100",),
+    "blood_cells": (),
+    "intel": (),
+}
+
+
+@dataclass
+class Run:
+    run_id: str
+    name: str
+    experiment: str
+    status: str
+    start_time: float           # секунды (в MLflow — миллисекунды)
+    end_time: float
+    db: str
+    params: dict = field(default_factory=dict)
+    metrics: dict = field(default_factory=dict)   # последние значения (latest_metrics)
+
+    @property
+    def duration(self):
+        return self.end_time - self.start_time if self.end_time else None
+
+    @property
+    def epochs(self):
+        return int(self.params["epochs"]) if "epochs" in self.params else None
+
+
+# ===================== ЧТЕНИЕ (ТОЛЬКО ЧТЕНИЕ, С КЭШЕМ) =====================
+
+def _connect(path):
+    # mode=ro: страница не может ни изменить, ни создать базу
+    return sqlite3.connect(f"file:{quote(os.path.abspath(path))}?mode=ro", uri=True,
+                           check_same_thread=False)
+
+
+def db_version(path):
+    """Ключ кэша: mtime базы и её WAL-журнала (пока журнал не сброшен, сама база не меняется)."""
+    stamps = [os.stat(p).st_mtime_ns for p in (path, path + "-wal") if os.path.exists(p)]
+    return max(stamps) if stamps else None
+
+
+@functools.lru_cache(maxsize=8)
+def _read_runs(path, version):
+    with closing(_connect(path)) as conn:
+        rows = conn.execute(
+            "SELECT r.run_uuid, r.name, e.name, r.status, r.start_time, r.end_time "
+            "FROM runs r JOIN experiments e ON e.experiment_id = r.experiment_id "
+            "WHERE r.lifecycle_stage = 'active' ORDER BY r.start_time DESC"
+        ).fetchall()
+        runs = {
+            run_id: Run(run_id, name, experiment, status, (start or 0) / 1000,
+                        end / 1000 if end else None, path)
+            for run_id, name, experiment, status, start, end in rows
+        }
+        for run_id, key, value in conn.execute("SELECT run_uuid, key, value FROM params"):
+            if run_id in runs:
+                runs[run_id].params[key] = value
+        for run_id, key, value in conn.execute(
+                "SELECT run_uuid, key, value FROM latest_metrics WHERE is_nan = 0"):
+            if run_id in runs:
+                runs[run_id].metrics[key] = value
+    return tuple(runs.values())
+
+
+@functools.lru_cache(maxsize=64)
+def _read_history(path, version, run_id):
+    history = {}
+    with closing(_connect(path)) as conn:
+        rows = conn.execute(
+            "SELECT key, step, value FROM metrics WHERE run_uuid = ? AND is_nan = 0 "
+            "ORDER BY key, step, timestamp", (run_id,))
+        for key, step, value in rows:
+            steps, values = history.setdefault(key, ([], []))
+            if steps and steps[-1] == step:
+                values[-1] = value          # повторная запись того же шага — берём последнюю
+            else:
+                steps.append(step)
+                values.append(value)
+    return history
+
+
+# ===================== ЗАПРОСЫ =====================
+
+def list_runs(paths=DB_PATHS):
+    """Все запуски из существующих баз, свежие первыми. Битая или пустая база пропускается."""
+    runs = []
+    for path in paths:
+        version = db_version(path)
+        if version is None:
+            continue
+        try:
+            runs.extend(_read_runs(path, version))
+        except sqlite3.DatabaseError:
+            continue
+    return sorted(runs, key=lambda r: r.start_time, reverse=True)
+
+
+def runs_for(model_name, paths=DB_PATHS):
+    experiments = MODEL_EXPERIMENTS.get(model_name, ())
+    return [r for r in list_runs(paths)
+            if r.experiment in experiments or r.name == f"{model_name}_script"]
+
+
+def best_run(runs, key="valid_acc"):
+    """Завершённый запуск с лучшим последним значением метрики (или None)."""
+    finished = [r for r in runs if r.status == "FINISHED" and key in r.metrics]
+    return max(finished, key=lambda r: r.metrics[key], default=None)
+
+
+def metric_history(run):
+    """{ключ: ([шаги], [значения])} — ряды метрик запуска по эпохам."""
+    return _read_history(run.db, db_version(run.db), run.run_id)
+
+
+def format_duration(seconds):
+    """605.8 -> "10 мин 6 сек" (как на странице до появления запусков)."""
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    return f"{minutes} мин {seconds} сек" if minutes else f"{seconds} сек"
+
+
+if __name__ == "__main__":
+    # python -m models.run_store sports
+    parser = argparse.ArgumentParser(description="Запуски обучения из mlflow.db (только чтение)")
+    parser.add_argument("model", nargs="?", help="только запуски этой модели")
+    args = parser.parse_args()
+
+    runs = runs_for(args.model) if args.model else list_runs()
+    for run in runs:
+        duration = format_duration(run.duration) if run.duration else "—"
+        metrics = ", ".join(f"{k} {v:.4f}" for k, v in sorted(run.metrics.items()))
+        print(f"{run.experiment}/{run.name} [{run.status}] {duration}, "
+              f"эпох {run.epochs or '—'}: {metrics} ({run.db})")
@@ -0,0 +1,192 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+
+from models.telemetry import count, gauge, timed, TELEMETRY, ENABLED
+
+# ===================== КОНСТАНТЫ =====================
+
+CPU_COUNT = os.cpu_count() or 1
+
+# Воркеров, одновременно выполняющих forward
+WORKERS = int(os.environ.get("INFERENCE_WORKERS", min(2, CPU_COUNT)))
+# Потоков torch на воркер: WORKERS × THREADS_PER_WORKER не больше числа ядер
+THREADS_PER_WORKER = int(os.environ.get("INFERENCE_THREADS_PER_WORKER",
+                                        max(1, CPU_COUNT // WORKERS)))
+# Сколько изображений может ждать в очереди; сверх этого — сразу «занято»
+QUEUE_LIMIT = int(os.environ.get("INFERENCE_QUEUE_LIMIT", 256))
+RETRY_AFTER = 1.0
+
+# Приоритеты: меньше — раньше
+INTERACTIVE = 0
+BULK = 1
+# Запрос от стольких изображений считается пакетной загрузкой
+BULK_MIN_BATCH = 8
+
+
+class SchedulerBusy(RuntimeError):
+    """Очередь инференса переполнена — запрос отклонён, повторите позже."""
+
+    def __init__(self, queued, limit, retry_after=RETRY_AFTER):
+        self.queued = queued
+        self.limit = limit
+        self.retry_after = retry_after
+        super().__init__(f"Сервер занят: в очереди {queued} изображений (лимит {limit}), "
+                         f"повторите через {retry_after:g} с")
+
+
+def priority_for(size):
+    """Приоритет по размеру запроса: одиночные картинки — вперёд пакетных загрузок."""
+    return BULK if size >= BULK_MIN_BATCH else INTERACTIVE
+
+
+class _Job:
+    __slots__ = ("model", "fn", "size", "priority", "enqueued", "future")
+
+    def __init__(self, model, fn, size, priority, enqueued):
+        self.model = model
+        self.fn = fn
+        self.size = size
+        self.priority = priority
+        self.enqueued = enqueued
+        self.future = Future()
+
+
+# ===================== ПЛАНИРОВЩИК =====================
+
+class InferenceScheduler:
+    """
+    Фиксированный пул воркеров с бюджетом потоков и очередями по моделям.
+
+    У каждой модели своя очередь с приоритетами. Свободный воркер берёт
+    задание с наименьшим приоритетом среди голов всех очередей, а при равенстве —
+    у модели, которую обслуживали дольше всех: пакетная загрузка на одной
+    странице не задерживает одиночные запросы на другой.
+
+    Очередь ограничена QUEUE_LIMIT изображениями: admit() сразу бросает
+    SchedulerBusy, а не копит запросы. Время ожидания в очереди и время
+    вычисления пишутся отдельными стадиями queue_wait и compute.
+    """
+
+    def __init__(self, workers=WORKERS, threads_per_worker=THREADS_PER_WORKER,
+                 queue_limit=QUEUE_LIMIT):
+        self.workers = max(1, workers)
+        self.threads_per_worker = max(1, threads_per_worker)
+        self.queue_limit = queue_limit
+        self._cond = threading.Condition()
+        self._queues = {}        # модель -> heap[(priority, seq, job)]
+        self._served = {}        # модель -> номер последнего обслуживания
+        self._seq = itertools.count()
+        self._queued = 0         # изображений допущено, но ещё не взято воркером
+        self.rejected = 0
+
+        self._threads = [
+            threading.Thread(target=self._worker, daemon=True, name=f"inference-worker-{i}")
+            for i in range(self.workers)
+        ]
+        for t in self._threads:
+            t.start()
+
+    # -------- Допуск --------
+
+    def admit(self, model, size):
+        """Резервирует место под size изображений или бросает SchedulerBusy."""
+        with self._cond:
+            # Пустая очередь принимает любой запрос, даже больше лимита
+            if self._queued and self._queued + size > self.queue_limit:
+                self.rejected += 1
+                count("inference_rejected_total", model=model)
+                raise SchedulerBusy(self._queued, self.queue_limit)
+            self._queued += size
+            gauge("scheduler_queued_images", self._queued)
+
+    def release(self, size):
+        """Возвращает место, зарезервированное admit(), если задание не будет отправлено."""
+        with self._cond:
+            self._queued -= size
+            gauge("scheduler_queued_images", self._queued)
+
+    # -------- Задания --------
+
+    def submit(self, model, fn, size=1, priority=None, admitted=False, enqueued=None):
+        """
+        Ставит fn() в очередь модели; возвращает concurrent.futures.Future.
+
+        admitted=True — место уже зарезервировано через admit().
+        enqueued — моменты поступления исходных запросов (для queue_wait).
+        """
+        if not admitted:
+            self.admit(model, size)
+        job = _Job(model, fn, size, priority_for(size) if priority is None else priority,
+                   enqueued or (time.perf_counter(),))
+        with self._cond:
+            heapq.heappush(self._queues.setdefault(model, []), (job.priority, next(self._seq), job))
+            self._served.setdefault(model, -1)
+            self._cond.notify()
+        return job.future
+
+    def _next(self):
+        with self._cond:
+            while True:
+                heads = [(heap[0][0], self._served[m], m) for m, heap in self._queues.items() if heap]
+                if heads:
+                    break
+                self._cond.wait()
+            _, _, model = min(heads)
+            _, _, job = heapq.heappop(self._queues[model])
+            self._served[model] = next(self._seq)
+            self._queued -= job.size
+            gauge("scheduler_queued_images", self._queued)
+            return job
+
+    def _worker(self):
+        # Бюджет потоков: без него одновременные forward делят ядра N×M раз.
+        # Задаётся только здесь, не в __init__ (его вызывает поток сессии Streamlit).
+        # В сборках torch с общим пулом intra-op настройка всё равно действует
+        # на весь процесс — это и есть бюджет на инференс
+        torch.set_num_threads(self.threads_per_worker)
+        while True:
+            job = self._next()
+            if not job.future.set_running_or_notify_cancel():
+                continue
+            if ENABLED:
+                started = time.perf_counter()
+                for t in job.enqueued:
+                    TELEMETRY.observe("inference_stage_seconds", started - t,
+                                      stage="queue_wait", model=job.model)
+            try:
+                with timed("compute", job.model):
+                    result = job.fn()
+            except Exception as e:
+                job.future.set_exception(e)
+            else:
+                job.future.set_result(result)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "workers": self.workers,
+                "threads_per_worker": self.threads_per_worker,
+                "queued": self._queued,
+                "queue_limit": self.queue_limit,
+                "rejected": self.rejected,
+                "per_model": {m: len(h) for m, h in self._queues.items()},
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Один планировщик на процесс."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = InferenceScheduler()
+        return _scheduler
@@ -0,0 +1,213 @@
+import threading
+import time
+from functools import partial
+
+import torch
+import torch.nn as nn
+from torchvision.models import ResNet
+
+from models.inference import Prediction, class_label
+from models.preprocessing import PREPROCESS_SPECS, get_preprocessor
+from models.registry import TEACHER_ARCH, MODEL_SPECS, get_registry, unique_size_bytes
+from models.scheduler import get_scheduler
+from models.telemetry import timed
+
+# ===================== СТАДИИ RESNET18 =====================
+
+# Порядок вычислений ResNet18 с точностью до BasicBlock
+STAGES = (
+    "conv1", "bn1", "relu", "maxpool",
+    "layer1.0", "layer1.1", "layer2.0", "layer2.1",
+    "layer3.0", "layer3.1", "layer4.0", "layer4.1",
+    "avgpool", "fc",
+)
+
+
+def _stage_tensors(model, stage):
+    module = model.get_submodule(stage)
+    return list(module.state_dict().values())
+
+
+def _same_stage(models, stage):
+    reference = _stage_tensors(models[0], stage)
+    for other in models[1:]:
+        tensors = _stage_tensors(other, stage)
+        if len(tensors) != len(reference):
+            return False
+        if not all(torch.equal(a, b) for a, b in zip(reference, tensors)):
+            return False
+    return True
+
+
+def shared_prefix(models):
+    """Сколько первых стадий побитово совпадает у всех моделей."""
+    n = 0
+    for stage in STAGES:
+        if stage == "fc" or not _same_stage(models, stage):
+            break
+        n += 1
+    return n
+
+
+def _replace(model, stage, module):
+    parent_name, _, child = stage.rpartition(".")
+    parent = model.get_submodule(parent_name) if parent_name else model
+    setattr(parent, child, module)
+
+
+def share_weights(models, prefix):
+    """
+    Оставляет одну копию весов общих стадий: модули первой модели
+    подставляются во все остальные. Стадии побитово равны (shared_prefix),
+    поэтому ответы моделей не меняются. Возвращает сэкономленные байты.
+    """
+    saved = 0
+    for stage in STAGES[:prefix]:
+        module = models[0].get_submodule(stage)
+        for other in models[1:]:
+            duplicate = other.get_submodule(stage)
+            if duplicate is module:
+                continue
+            saved += sum(t.numel() * t.element_size() for t in duplicate.state_dict().values())
+            _replace(other, stage, module)
+    return saved
+
+
+def resident_bytes(models):
+    """(сумма весов по моделям, реально занято с учётом общих тензоров)"""
+    return sum(unique_size_bytes([m]) for m in models), unique_size_bytes(models)
+
+
+def run_stages(model, x, stages):
+    for stage in stages:
+        if stage == "fc":
+            x = torch.flatten(x, 1)
+        x = model.get_submodule(stage)(x)
+    return x
+
+
+# ===================== МНОГОГОЛОВАЯ МОДЕЛЬ =====================
+
+class MultiHeadModel(nn.Module):
+    """
+    Несколько ResNet18 с общим началом сети.
+
+    Общий «ствол» считается один раз, дальше каждая модель досчитывает
+    свои оставшиеся слои и голову. forward возвращает {имя: logits}.
+    """
+
+    def __init__(self, models):
+        super().__init__()
+        self.names = list(models)
+        self.heads = nn.ModuleDict(models)
+        heads = list(models.values())
+        self.prefix = shared_prefix(heads) if len(heads) > 1 else 0
+
+    @property
+    def trunk_stages(self):
+        return STAGES[:self.prefix]
+
+    def forward(self, x):
+        first = self.heads[self.names[0]]
+        x = run_stages(first, x, self.trunk_stages)
+        rest = STAGES[self.prefix:]
+        return {name: run_stages(self.heads[name], x, rest) for name in self.names}
+
+
+def preprocess_groups(names):
+    """Модели с одинаковой предобработкой можно гнать одним входом."""
+    groups = {}
+    for name in names:
+        groups.setdefault(PREPROCESS_SPECS[name], []).append(name)
+    return list(groups.values())
+
+
+def _eager_models(names):
+    # Стадии STAGES есть только у ResNet18: ученики (MODEL_ARCH) считаются отдельно
+    registry = get_registry()
+    names = [name for name in names if MODEL_SPECS[name].arch == TEACHER_ARCH]
+    models = {name: registry.get(name) for name in names}
+    return {name: m for name, m in models.items() if isinstance(m, ResNet)}
+
+
+_share_lock = threading.Lock()
+
+
+def build_multi_head(names):
+    """
+    Модели из реестра, сгруппированные по предобработке.
+
+    Веса общего начала делятся между самими моделями реестра, без копий:
+    реестр считает общие тензоры один раз (unique_size_bytes), так что
+    экономия видна в его бюджете памяти. Общий проход считается внутри
+    группы с одинаковым входом. Возвращает (список MultiHeadModel,
+    сэкономленные байты).
+    """
+    models = _eager_models(names)
+    saved = 0
+    if len(models) > 1:
+        heads = list(models.values())
+        with _share_lock:
+            saved = share_weights(heads, shared_prefix(heads))
+    groups = [MultiHeadModel({n: models[n] for n in group if n in models})
+              for group in preprocess_groups(names) if any(n in models for n in group)]
+    return groups, saved
+
+
+def _forward_timed(multi, batch):
+    start = time.perf_counter()
+    with torch.no_grad(), timed("forward", "+".join(multi.names)):
+        logits = multi(batch)
+    return logits, time.perf_counter() - start
+
+
+def classify_with_all(raw_images, class_names, names=None):
+    """
+    Каждое изображение — во все модели сразу.
+
+    class_names — {имя модели: список/словарь классов}. Возвращает
+    {имя модели: [Prediction, ...]} в порядке raw_images и список
+    MultiHeadModel (по нему видно, сколько стадий оказалось общими).
+    Forward идёт через планировщик инференса: при переполненной очереди
+    бросается SchedulerBusy, как на страницах отдельных моделей.
+    """
+    names = names or list(class_names)
+    results = {}
+    groups, _ = build_multi_head(names)
+    for multi in groups:
+        preprocessor = get_preprocessor(multi.names[0])
+        batch = preprocessor.batch([preprocessor.open(data) for data in raw_images])
+
+        n = batch.shape[0]
+        logits, elapsed = get_scheduler().submit(
+            "+".join(multi.names), partial(_forward_timed, multi, batch), n).result()
+
+        for name, out in logits.items():
+            confidence, pred_class = torch.max(torch.softmax(out, dim=1), dim=1)
+            results[name] = [
+                Prediction(
+                    label=class_label(class_names[name], class_id),
+                    class_id=class_id,
+                    confidence=conf,
+                    batch_index=0,
+                    batch_size=n,
+                    batch_time=elapsed,
+                    image_time=elapsed / n,
+                )
+                for conf, class_id in zip(confidence.tolist(), pred_class.tolist())
+            ]
+    # Остальные (ученики, INT8, ONNX) — своим обычным путём, как на их страницах
+    for name in names:
+        if name not in results:
+            results[name] = _predict_alone(name, raw_images, class_names[name])
+    return results, groups
+
+
+def _predict_alone(name, raw_images, class_names):
+    from models.batching import get_batched_model
+    from models.inference import predict_batch
+
+    preprocessor = get_preprocessor(name)
+    images = [preprocessor.open(data) for data in raw_images]
+    return predict_batch(get_batched_model(name), images, preprocessor, class_names,
+                         batch_size=max(1, len(images)), model_name=name)
@@ -0,0 +1,81 @@
+import json
+import os
+from dataclasses import dataclass
+
+# Описание моделей без torch: его читают и лёгкие страницы (сводка),
+# и models.registry, который строит по нему сами модели
+
+# ===================== КОНСТАНТЫ =====================
+
+def _per_model(var):
+    """Настройка по моделям из переменной окружения вида "intel=int8,sports=onnx"."""
+    return dict(item.split("=", 1) for item in os.environ.get(var, "").split(",") if "=" in item)
+
+
+# Режим исполнения по моделям, например MODEL_PRECISION="intel=int8"
+PRECISIONS = _per_model("MODEL_PRECISION")
+# Движок по моделям: eager | torchscript | onnx, например MODEL_BACKEND="sports=onnx"
+BACKENDS = _per_model("MODEL_BACKEND")
+# Архитектура по моделям: resnet18 (учитель) | resnet10 | mobilenet_v3_small | mobilenet_v3_large,
+# например MODEL_ARCH="intel=mobilenet_v3_small" — страница грузит ученика (models.distillation)
+ARCHS = _per_model("MODEL_ARCH")
+
+TEACHER_ARCH = "resnet18"
+
+
+@dataclass
+class ModelSpec:
+    """Описание модели: где лежит чекпоинт и сколько классов у головы."""
+    name: str
+    path: str
+    num_classes: int
+    precision: str = "fp32"     # "fp32" | "int8"
+    backend: str = "eager"      # "eager" | "torchscript" | "onnx" (для fp32)
+    arch: str = TEACHER_ARCH    # см. ARCHS
+
+
+# Чекпоинты учителей (ResNet18 из ноутбуков)
+CHECKPOINTS = {
+    "sports": ("models/model_sic100.pt", 100),
+    "blood_cells": ("models/blood_cells.pth", 4),
+    "intel": ("models/intel_model.pt", 6),
+}
+
+
+def student_path(checkpoint, arch):
+    """models/intel_model.pt -> models/intel_model.mobilenet_v3_small.pt"""
+    root, ext = os.path.splitext(checkpoint)
+    return f"{root}.{arch}{ext}"
+
+
+def _spec(name):
+    path, num_classes = CHECKPOINTS[name]
+    arch = ARCHS.get(name, TEACHER_ARCH)
+    if arch != TEACHER_ARCH:
+        path = student_path(path, arch)
+    return ModelSpec(name, path, num_classes, PRECISIONS.get(name, "fp32"),
+                     BACKENDS.get(name, "eager"), arch)
+
+
+MODEL_SPECS = {name: _spec(name) for name in CHECKPOINTS}
+
+# Названия классов — те же, что на страницах
+CLASS_NAMES = {
+    "sports": "models/classes_sic100.json",
+    "blood_cells": ["EOSINOPHIL", "LYMPHOCYTE", "MONOCYTE", "NEUTROPHIL"],
+    "intel": ["buildings", "forest", "glacier", "mountain", "sea", "street"],
+}
+
+
+def load_class_names(name):
+    """Список классов или {id: name} из JSON (для спортивной модели)."""
+    classes = CLASS_NAMES[name]
+    if isinstance(classes, str):
+        with open(classes, "r", encoding="utf-8") as f:
+            return {int(k): v for k, v in json.load(f).items()}
+    return classes
+
+
+def metrics_path(checkpoint):
+    """models/model_sic100.pt -> models/model_sic100.metrics.json (читает «Сводная информация»)."""
+    return os.path.splitext(checkpoint)[0] + ".metrics.json"
@@ -0,0 +1,244 @@
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ===================== КОНСТАНТЫ =====================
+
+ENABLED = os.environ.get("TELEMETRY", "1") != "0"
+# По умолчанию эндпоинт виден только локально; METRICS_HOST=0.0.0.0 — для внешнего Prometheus
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 9108))
+
+# Границы корзин гистограмм времени, секунды
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+HELP = {
+    "inference_stage_seconds": "Время стадии обработки (fetch/decode/preprocess/queue_wait/compute/forward/softmax)",
+    "inference_requests_total": "Число классифицированных изображений",
+    "inference_batch_size": "Размер батча, отправленного в модель",
+    "inference_microbatch_size": "Размер батча, собранного сервером микробатчей",
+    "prediction_cache_hits_total": "Попадания в кэш предсказаний",
+    "prediction_cache_misses_total": "Промахи кэша предсказаний",
+    "pipeline_queue_depth": "Изображений в очереди декодирования",
+    "scheduler_queued_images": "Изображений в очереди планировщика инференса",
+    "inference_rejected_total": "Запросов отклонено из-за переполненной очереди",
+    "warmup_seconds": "Время прогрева модели при старте сервера (загрузка + пробные батчи)",
+    "warmup_ready": "1, когда фоновый прогрев моделей завершён",
+    "cascade_images_total": "Изображений, на которые ответил уровень каскада (low / full)",
+    "near_duplicate_hits_total": "Почти-дубликатов, получивших ответ из кэша эмбеддингов",
+}
+
+
+# ===================== ТИПЫ МЕТРИК =====================
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Оценка квантиля по корзинам (верхняя граница корзины)."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            seen += n
+            if seen >= target:
+                return bound if bound != float("inf") else self.buckets[-1]
+        return self.buckets[-1]
+
+
+class Telemetry:
+    """Счётчики, gauge и гистограммы в памяти процесса."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}     # (name, labels) -> float
+        self.gauges = {}       # (name, labels) -> float
+        self.histograms = {}   # (name, labels) -> Histogram
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram(buckets)
+            hist.observe(value)
+
+    def snapshot(self):
+        """Копии (counters, gauges, histograms) — для чтения без гонок."""
+        with self._lock:
+            histograms = {}
+            for key, h in self.histograms.items():
+                copy = Histogram(h.buckets)
+                copy.counts, copy.sum, copy.count = list(h.counts), h.sum, h.count
+                histograms[key] = copy
+            return dict(self.counters), dict(self.gauges), histograms
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    # -------- Prometheus exposition format --------
+
+    def render(self):
+        lines, seen = [], set()
+        with self._lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            histograms = {k: (h.buckets, list(h.counts), h.sum, h.count)
+                          for k, h in self.histograms.items()}
+
+        def header(name, kind):
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"# HELP {name} {HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(counters.items()):
+            header(name, "counter")
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for (name, labels), value in sorted(gauges.items()):
+            header(name, "gauge")
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for (name, labels), (buckets, counts, total, count) in sorted(histograms.items()):
+            header(name, "histogram")
+            cumulative = 0
+            for bound, n in zip(buckets, counts):
+                cumulative += n
+                lines.append(f"{name}_bucket{_labels(labels + (('le', repr(bound)),))} {cumulative}")
+            lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{_labels(labels)} {total}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    inner = ",".join(f'{k}="{v}"' for k, v in labels)
+    return "{" + inner + "}"
+
+
+TELEMETRY = Telemetry()
+
+
+# ===================== API ДЛЯ ГОРЯЧЕГО ПУТИ =====================
+
+class _NoopTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopTimer()
+
+
+@contextmanager
+def _stage_timer(stage, model):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        TELEMETRY.observe("inference_stage_seconds", time.perf_counter() - start,
+                          stage=stage, model=model or "unknown")
+
+
+def timed(stage, model=""):
+    """with timed("forward", "intel"): ... — при TELEMETRY=0 ничего не стоит."""
+    if not ENABLED:
+        return _NOOP
+    return _stage_timer(stage, model)
+
+
+def count(name, value=1, **labels):
+    if ENABLED:
+        TELEMETRY.inc(name, value, **labels)
+
+
+def gauge(name, value, **labels):
+    if ENABLED:
+        TELEMETRY.set(name, value, **labels)
+
+
+def observe_batch(size, model=""):
+    if ENABLED:
+        TELEMETRY.observe("inference_batch_size", size, buckets=SIZE_BUCKETS,
+                          model=model or "unknown")
+        TELEMETRY.inc("inference_requests_total", size, model=model or "unknown")
+
+
+# ===================== HTTP-ЭНДПОИНТ =====================
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = TELEMETRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+_server = None
+_server_error = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """
+    Поднимает http://host:port/metrics в фоне (один раз на процесс).
+    Если порт занят (например, второй процесс Streamlit), ошибка
+    запоминается и повторных попыток на каждом rerun страницы нет.
+    """
+    global _server, _server_error
+    with _server_lock:
+        if _server is None and _server_error is None and ENABLED:
+            try:
+                _server = ThreadingHTTPServer((host, port), _Handler)
+            except OSError as e:
+                _server_error = e
+                return None
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+        return _server
+
+
+def metrics_server_error():
+    """Почему эндпоинт не поднялся (OSError) или None."""
+    return _server_error
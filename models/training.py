@@ -0,0 +1,306 @@
+import argparse
+import json
+import os
+import time
+from contextlib import nullcontext
+from dataclasses import asdict, dataclass
+
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, random_split
+from torchvision import datasets
+from torchvision.models import resnet18, ResNet18_Weights
+
+from models.metrics import MetricsAccumulator, metrics_path
+from models.preprocessing import PREPROCESS_SPECS, Preprocessor
+from models.registry import MODEL_SPECS
+
+try:
+    import mlflow
+except ImportError:   # mlflow нужен только для --mlflow-uri
+    mlflow = None
+
+# ===================== РАСПИСАНИЯ =====================
+
+@dataclass(frozen=True)
+class Phase:
+    """Фаза дообучения: размораживается stage (вдобавок к предыдущим фазам)."""
+    stage: str
+    epochs: int
+    lr: float
+
+
+# Те же фазы, что в ноутбуках
+SCHEDULES = {
+    # blood_cells_final.ipynb: fc -> +layer4 -> +layer3
+    "blood_cells": (Phase("fc", 5, 1e-3), Phase("layer4", 8, 1e-4), Phase("layer3", 10, 5e-5)),
+    # intel.ipynb: оптимизатор обновляет только fc
+    "intel": (Phase("fc", 5, 1e-3),),
+    # Ноутбука нет в репозитории: 15 эпох и разморозка L3, L4, FC, как на странице сводки
+    "sports": (Phase("fc", 5, 1e-3), Phase("layer4", 5, 1e-4), Phase("layer3", 5, 5e-5)),
+}
+
+# Где ноутбуки ищут данные: (train, отдельная валидация или None -> 80/20 от train)
+DATA_DIRS = {
+    "blood_cells": ("data/dataset2-master/dataset2-master/images/TRAIN", None),
+    "intel": ("data/intel/seg_train/seg_train", "data/intel/seg_test/seg_test"),
+    "sports": ("data/sports/train", "data/sports/valid"),
+}
+
+BATCH_SIZE = 64
+SEED = 42
+
+
+# ===================== МОДЕЛЬ И ДАННЫЕ =====================
+
+def initial_model(num_classes):
+    """ResNet18 с весами ImageNet и новой головой, всё заморожено — как в ноутбуках."""
+    model = resnet18(weights=ResNet18_Weights.DEFAULT)
+    for p in model.parameters():
+        p.requires_grad = False
+    model.fc = nn.Linear(model.fc.in_features, num_classes)
+    return model
+
+
+def make_datasets(model_name, train_dir, valid_dir=None, mmap_dataset=False):
+    """(train, valid, classes): отдельная папка валидации или 80/20 с seed 42."""
+    spec = PREPROCESS_SPECS[model_name]
+    if mmap_dataset:
+        from models.dataset_cache import cached_image_folder
+
+        def load(root):
+            return cached_image_folder(root, model_name)
+    else:
+        # Тот же Compose, что в ноутбуках (и он pickle-совместим для воркеров)
+        transform = Preprocessor(spec).reference_transform()
+
+        def load(root):
+            return datasets.ImageFolder(root, transform=transform)
+
+    train = load(train_dir)
+    classes = train.classes
+    if valid_dir:
+        valid = load(valid_dir)
+    else:
+        n_train = int(0.8 * len(train))
+        train, valid = random_split(train, [n_train, len(train) - n_train],
+                                    generator=torch.Generator().manual_seed(SEED))
+    return train, valid, classes
+
+
+def make_loader(dataset, batch_size, shuffle, workers):
+    return DataLoader(
+        dataset, batch_size=batch_size, shuffle=shuffle, num_workers=workers,
+        persistent_workers=workers > 0, prefetch_factor=4 if workers > 0 else None,
+        pin_memory=torch.cuda.is_available(),
+    )
+
+
+def save_checkpoint(model, path):
+    """Ровно тот state_dict, который грузят страницы: float32, обычная раскладка NCHW."""
+    state = {k: v.detach().cpu().contiguous() for k, v in model.state_dict().items()}
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    torch.save(state, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+# ===================== ЭПОХА =====================
+
+class Trainer:
+    """
+    Обучение/валидация на CPU.
+
+    bf16 — autocast в bfloat16 (веса и оптимизатор остаются в float32);
+    channels_last — раскладка NHWC для свёрток; accum_steps — накопление
+    градиента на несколько батчей. Метрики train считаются по ходу эпохи,
+    без второго прохода по обучающей выборке.
+    """
+
+    def __init__(self, model, num_classes, bf16=False, channels_last=False, accum_steps=1):
+        self.model = model
+        self.num_classes = num_classes
+        self.bf16 = bf16
+        self.memory_format = torch.channels_last if channels_last else torch.contiguous_format
+        self.accum_steps = max(1, accum_steps)
+        self.criterion = nn.CrossEntropyLoss()
+        self.model.to(memory_format=self.memory_format)
+
+    def _autocast(self):
+        return torch.autocast("cpu", dtype=torch.bfloat16) if self.bf16 else nullcontext()
+
+    def loss(self, logits, batch):
+        """Функция потерь на батче (images, labels, ...) — переопределяется дистилляцией."""
+        return self.criterion(logits, batch[1])
+
+    def run_epoch(self, loader, optimizer=None):
+        """Возвращает (loss, MetricsAccumulator)."""
+        training = optimizer is not None
+        self.model.train(training)
+        metrics = MetricsAccumulator(self.num_classes)
+        total_loss, seen = 0.0, 0
+
+        with torch.set_grad_enabled(training):
+            for step, batch in enumerate(loader):
+                images, labels = batch[0], batch[1]
+                images = images.contiguous(memory_format=self.memory_format)
+                with self._autocast():
+                    logits = self.model(images)
+                    loss = self.loss(logits, batch)
+                if training:
+                    (loss / self.accum_steps).backward()
+                    if (step + 1) % self.accum_steps == 0 or step + 1 == len(loader):
+                        optimizer.step()
+                        optimizer.zero_grad(set_to_none=True)
+                total_loss += loss.item() * len(labels)
+                seen += len(labels)
+                metrics.update(logits, labels)
+
+        return total_loss / max(seen, 1), metrics
+
+
+# ===================== ФАЗЫ =====================
+
+def unfreeze(model, stage):
+    for p in model.get_submodule(stage).parameters():
+        p.requires_grad = True
+
+
+def train(model_name, train_dir=None, valid_dir=None, output=None, phases=None,
+          batch_size=BATCH_SIZE, workers=0, bf16=False, channels_last=False, accum_steps=1,
+          feature_cache=False, mmap_dataset=False, log=print):
+    """
+    Фазовое дообучение по расписанию SCHEDULES[model_name].
+
+    После каждой фазы чекпоинт сохраняется в output. Возвращает отчёт
+    {"model", "classes", "phases": [{stage, epochs, lr, wall_time, history}], "total_time"}.
+    """
+    torch.manual_seed(SEED)
+    default_train, default_valid = DATA_DIRS[model_name]
+    train_dir = train_dir or default_train
+    valid_dir = valid_dir or (default_valid if train_dir == default_train else None)
+    phases = phases or SCHEDULES[model_name]
+    output = output or trained_path(model_name)
+
+    train_set, valid_set, classes = make_datasets(model_name, train_dir, valid_dir, mmap_dataset)
+    model = initial_model(len(classes))
+    trainer = Trainer(model, len(classes), bf16, channels_last, accum_steps)
+    # Загрузчики общие для всех фаз: воркеры не пересоздаются
+    train_loader = make_loader(train_set, batch_size, True, workers)
+    valid_loader = make_loader(valid_set, batch_size, False, workers)
+
+    report = {"model": model_name, "classes": classes, "phases": [],
+              "settings": {"batch_size": batch_size, "workers": workers, "bf16": bf16,
+                           "channels_last": channels_last, "accum_steps": accum_steps}}
+    start_all = time.perf_counter()
+
+    for phase in phases:
+        unfreeze(model, phase.stage)
+        optimizer = torch.optim.Adam([p for p in model.parameters() if p.requires_grad],
+                                     lr=phase.lr)
+        log(f"Фаза {phase.stage}: {phase.epochs} эпох, lr={phase.lr:g}")
+        start = time.perf_counter()
+        last_valid = None
+
+        if feature_cache and phase.stage == "fc":
+            from models.feature_cache import fit_head
+            history, last_valid = fit_head(model, train_set, valid_set, optimizer, phase.epochs,
+                                           batch_size=batch_size, workers=workers, log=log)
+            history = {k: history[k] for k in ("train_loss", "train_acc", "train_f1", "valid_loss",
+                                               "valid_acc", "valid_f1", "epoch_time")}
+            if last_valid is not None:
+                last_valid.class_names = classes
+        else:
+            history = {"train_loss": [], "train_acc": [], "train_f1": [],
+                       "valid_loss": [], "valid_acc": [], "valid_f1": [], "epoch_time": []}
+            for epoch in range(phase.epochs):
+                epoch_start = time.perf_counter()
+                train_loss, train_metrics = trainer.run_epoch(train_loader, optimizer)
+                valid_loss, valid_metrics = trainer.run_epoch(valid_loader)
+                for prefix, loss, m in (("train", train_loss, train_metrics),
+                                        ("valid", valid_loss, valid_metrics)):
+                    history[f"{prefix}_loss"].append(loss)
+                    history[f"{prefix}_acc"].append(m.accuracy)
+                    history[f"{prefix}_f1"].append(m.macro_f1)
+                history["epoch_time"].append(time.perf_counter() - epoch_start)
+                log(f"  эпоха {epoch + 1}/{phase.epochs}: "
+                    f"train loss {train_loss:.4f} acc {train_metrics.accuracy:.3f} "
+                    f"f1 {train_metrics.macro_f1:.3f} | valid loss {valid_loss:.4f} "
+                    f"acc {valid_metrics.accuracy:.3f} f1 {valid_metrics.macro_f1:.3f} | "
+                    f"{history['epoch_time'][-1]:.1f} с")
+                valid_metrics.class_names = classes
+                last_valid = valid_metrics
+
+        wall_time = time.perf_counter() - start
+        save_checkpoint(model, output)
+        report["phases"].append(dict(asdict(phase), wall_time=wall_time, history=history))
+        if last_valid is not None:
+            # Матрица ошибок последней эпохи — для плиток и heatmap на странице сводки
+            last_valid.save(metrics_path(output))
+        log(f"Фаза {phase.stage} заняла {wall_time:.1f} с, чекпоинт: {output}")
+
+    report["total_time"] = time.perf_counter() - start_all
+    report["checkpoint"] = output
+    return report
+
+
+def trained_path(model_name):
+    """models/<чекпоинт>.trained.<ext> — рядом с тем, что грузит страница, не поверх него."""
+    root, ext = os.path.splitext(MODEL_SPECS[model_name].path)
+    return f"{root}.trained{ext}"
+
+
+def report_path(checkpoint):
+    return os.path.splitext(checkpoint)[0] + ".training.json"
+
+
+def log_to_mlflow(report, tracking_uri, experiment):
+    """Метрики по эпохам под теми же ключами, что в notebooks/mlflow.db, + время фаз."""
+    mlflow.set_tracking_uri(tracking_uri)
+    mlflow.set_experiment(experiment)
+    with mlflow.start_run(run_name=f"{report['model']}_script"):
+        mlflow.log_params(report["settings"])
+        step = 0
+        for phase in report["phases"]:
+            mlflow.log_metric(f"phase_time_{phase['stage']}", phase["wall_time"])
+            history = phase["history"]
+            for i in range(len(history["epoch_time"])):
+                for key in ("train_loss", "train_acc", "valid_loss", "valid_acc"):
+                    mlflow.log_metric(key, history[key][i], step=step)
+                step += 1
+        mlflow.log_metric("total_time", report["total_time"])
+
+
+if __name__ == "__main__":
+    # python -m models.training blood_cells --workers 4 --bf16 --channels-last
+    parser = argparse.ArgumentParser(description="Фазовое дообучение ResNet18 на CPU")
+    parser.add_argument("model", choices=list(SCHEDULES))
+    parser.add_argument("--train-dir", help="ImageFolder для обучения (по умолчанию как в ноутбуке)")
+    parser.add_argument("--valid-dir", help="ImageFolder для валидации (иначе 80/20 от train)")
+    parser.add_argument("-o", "--output", help="куда сохранить state_dict")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument("--bf16", action="store_true", help="autocast в bfloat16")
+    parser.add_argument("--channels-last", action="store_true")
+    parser.add_argument("--accum-steps", type=int, default=1, help="накопление градиента")
+    parser.add_argument("--feature-cache", action="store_true",
+                        help="фаза fc — на кэшированных признаках (models.feature_cache)")
+    parser.add_argument("--mmap-dataset", action="store_true",
+                        help="изображения из кэша models.dataset_cache")
+    parser.add_argument("--mlflow-uri", help="например sqlite:///notebooks/mlflow.db")
+    parser.add_argument("--experiment", default="scripted-training")
+    args = parser.parse_args()
+
+    report = train(args.model, args.train_dir, args.valid_dir, args.output,
+                   batch_size=args.batch_size, workers=args.workers, bf16=args.bf16,
+                   channels_last=args.channels_last, accum_steps=args.accum_steps,
+                   feature_cache=args.feature_cache, mmap_dataset=args.mmap_dataset)
+    with open(report_path(report["checkpoint"]), "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.mlflow_uri:
+        if mlflow is None:
+            raise SystemExit("Для --mlflow-uri нужен mlflow")
+        log_to_mlflow(report, args.mlflow_uri, args.experiment)
+
+    for phase in report["phases"]:
+        print(f"{phase['stage']:8s} {phase['epochs']:3d} эпох  {phase['wall_time']:8.1f} с")
+    print(f"Всего: {report['total_time']:.1f} с -> {report['checkpoint']}")
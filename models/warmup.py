@@ -0,0 +1,141 @@
+import logging
+import os
+import threading
+import time
+
+from models.telemetry import gauge
+
+logger = logging.getLogger(__name__)
+
+# ===================== КОНСТАНТЫ =====================
+
+# WARMUP=0 — модели грузятся при первом открытии страницы, как раньше
+ENABLED = os.environ.get("WARMUP", "1") != "0"
+# Размеры батчей для прогона; по умолчанию 1 и BATCH_MAX_SIZE сервера микробатчей
+BATCH_SIZES = tuple(int(x) for x in os.environ.get("WARMUP_BATCH_SIZES", "").split(",") if x)
+# Прогонов на каждый размер: первый создаёт примитивы oneDNN, остальные — уже «тёплые»
+RUNS = int(os.environ.get("WARMUP_RUNS", 2))
+# Размер фиктивного изображения до предобработки (как типичное фото со страницы)
+IMAGE_SIZE = (640, 480)
+# Метка в телеметрии, чтобы прогрев не смешивался с запросами пользователей
+TELEMETRY_MODEL = "warmup"
+
+
+# ===================== ПРОГРЕВ =====================
+
+class Warmup:
+    """
+    Фоновый прогрев всех моделей реестра при старте сервера.
+
+    torch/torchvision импортируются только в фоновом потоке, поэтому
+    главная страница рисуется сразу. Для каждой модели — тот же путь, что у
+    страниц: реестр -> Preprocessor -> микробатчинг -> планировщик -> forward,
+    на размерах батча batch_sizes. ready — threading.Event, выставляется,
+    когда прогрев закончился (в т.ч. с ошибками по отдельным моделям).
+    """
+
+    def __init__(self, names=None, batch_sizes=BATCH_SIZES, runs=RUNS):
+        self.names = names
+        self.batch_sizes = batch_sizes
+        self.runs = max(1, runs)
+        self.ready = threading.Event()
+        self.timings = {}    # модель -> {"load_s", "batches": {размер: {"first_s", "steady_s"}}}
+        self.errors = {}     # модель -> текст ошибки
+        self.import_time = None
+        self.started_at = None
+        self.elapsed = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        self.started_at = time.time()
+        threading.Thread(target=self._run, name="warmup", daemon=True).start()
+        return self
+
+    def _run(self):
+        start = time.perf_counter()
+        try:
+            from models.batching import MAX_BATCH
+            from models.registry import MODEL_SPECS
+            self.import_time = time.perf_counter() - start
+            batch_sizes = self.batch_sizes or tuple(sorted({1, MAX_BATCH}))
+            for name in self.names or list(MODEL_SPECS):
+                try:
+                    timings = self._warm(name, batch_sizes)
+                except Exception as exc:   # например, нет файла чекпоинта
+                    logger.exception("прогрев %s не удался", name)
+                    with self._lock:
+                        self.errors[name] = f"{type(exc).__name__}: {exc}"
+                    continue
+                with self._lock:
+                    self.timings[name] = timings
+                gauge("warmup_seconds", timings["total_s"], model=name)
+        except Exception as exc:   # torch не импортируется — страницы покажут ту же ошибку
+            logger.exception("прогрев не удался")
+            with self._lock:
+                self.errors["*"] = f"{type(exc).__name__}: {exc}"
+        finally:
+            self.elapsed = time.perf_counter() - start
+            gauge("warmup_ready", 1)
+            self.ready.set()
+
+    def _warm(self, name, batch_sizes):
+        from PIL import Image
+
+        from models.batching import get_batched_model
+        from models.inference import predict_batch
+        from models.preprocessing import get_preprocessor
+        from models.registry import load_class_names
+
+        start = time.perf_counter()
+        # Шумовые картинки прогрева не должны попасть в кэш почти-дубликатов
+        model = get_batched_model(name, record=False)
+        load_time = time.perf_counter() - start
+        preprocessor = get_preprocessor(name)
+        class_names = load_class_names(name)
+        image = Image.effect_noise(IMAGE_SIZE, 64).convert("RGB")
+
+        batches = {}
+        for size in batch_sizes:
+            times = []
+            for _ in range(self.runs):
+                run_start = time.perf_counter()
+                predict_batch(model, [image] * size, preprocessor, class_names,
+                              batch_size=size, model_name=TELEMETRY_MODEL)
+                times.append(time.perf_counter() - run_start)
+            batches[size] = {"first_s": times[0], "steady_s": times[-1]}
+        return {"load_s": load_time, "batches": batches, "total_s": time.perf_counter() - start}
+
+    def status(self):
+        with self._lock:
+            return {
+                "ready": self.ready.is_set(),
+                "started_at": self.started_at,
+                "elapsed": self.elapsed,
+                "import_time": self.import_time,
+                "timings": dict(self.timings),
+                "errors": dict(self.errors),
+            }
+
+
+_warmup = None
+_warmup_lock = threading.Lock()
+
+
+def start_warmup():
+    """Запускает прогрев один раз на процесс (main.py выполняется при каждом rerun)."""
+    global _warmup
+    with _warmup_lock:
+        if _warmup is None and ENABLED:
+            _warmup = Warmup().start()
+        return _warmup
+
+
+def is_ready():
+    """True, когда прогрев завершён (или не запускался в этом процессе)."""
+    return _warmup is None or _warmup.ready.is_set()
+
+
+def warmup_status():
+    if _warmup is None:
+        return {"ready": True, "enabled": ENABLED, "timings": {}, "errors": {}}
+    return dict(_warmup.status(), enabled=True)
@@ -1,15 +1,16 @@
 import streamlit as st
-import torch
-import torch.nn as nn
-import torch.nn.functional as F
-from torchvision import models, transforms
-from PIL import Image
-import requests
-from io import BytesIO
-import time
 import json
 import os
 
+from models.pipeline import stream_predictions
+from models.preprocessing import get_preprocessor
+from models.prediction_cache import stream_cached, describe_cache
+from models.registry import describe_model
+from models.batching import get_batched_model
+from models.scheduler import SchedulerBusy
+from models.image_archive import ImageArchive
+from models.fetcher import get_fetcher, parse_urls
+
 # --- 1. ЗАГРУЗКА ДАННЫХ ---
 
 @st.cache_data
@@ -25,59 +26,53 @@ def load_class_names(json_path):
         st.warning(f"Файл {json_path} не найден! Проверьте наличие classes.json в папке models.")
         return {i: f"Класс №{i}" for i in range(100)}
 
-@st.cache_resource
-def load_trained_model(model_path):
-    """Загружает архитектуру и веса модели."""
-    model = models.resnet18()
-    model.fc = nn.Linear(model.fc.in_features, 100) 
-    state_dict = torch.load(model_path, map_location='cpu')
-    model.load_state_dict(state_dict)
-    model.eval()
-    return model
-
 # Настройки путей и объектов
-MODEL_PATH = 'models/model_sic100.pt'
 JSON_PATH = 'models/classes_sic100.json'
+BATCH_SIZE = 32
 
 CLASS_LABELS = load_class_names(JSON_PATH)
-model = load_trained_model(MODEL_PATH)
+model = get_batched_model("sports")
 
-# Преобразования для ResNet
-preprocess = transforms.Compose([
-    transforms.Resize(256),
-    transforms.CenterCrop(224),
-    transforms.ToTensor(),
-    transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225])
-])
+# Преобразования для ResNet: Resize(256) + CenterCrop(224) + Normalize
+preprocess = get_preprocessor("sports")
 
 # --- 2. ИНТЕРФЕЙС ---
 
 st.title("⚽ Классификатор изображений видов спорта")
+st.caption(describe_model("sports"))
 
-# Хранилище в session_state (инициализируем, если пусто)
+# Хранилище в session_state: сжатые байты + превью (инициализируем, если пусто)
 if 'images_archive' not in st.session_state:
-    st.session_state.images_archive = []
+    st.session_state.images_archive = ImageArchive()
+archive = st.session_state.images_archive
 
 tab1, tab2 = st.tabs(["📥 Загрузка", "🔍 Анализ"])
 
 with tab1:
     files = st.file_uploader("Выберите фото", accept_multiple_files=True, key="uploader")
-    url = st.text_input("Или вставьте ссылку")
+    url_text = st.text_area("Или вставьте ссылки (по одной на строку)")
     
     if st.button("Добавить в список"):
+        evicted = 0
         if files:
             for f in files:
-                st.session_state.images_archive.append(Image.open(f).convert('RGB'))
-        if url:
+                try:
+                    evicted += archive.add(f.getvalue(), name=f.name)
+                except Exception as e:
+                    st.error(f"Не удалось прочитать {f.name}: {e}")
+        for res in get_fetcher().fetch_many(parse_urls(url_text)):
             try:
-                res = requests.get(url, timeout=5)
-                st.session_state.images_archive.append(Image.open(BytesIO(res.content)).convert('RGB'))
-            except:
-                st.error("Не удалось загрузить по ссылке.")
-        st.success(f"Фотографий в очереди: {len(st.session_state.images_archive)}")
+                if not res.ok:
+                    raise res.error
+                evicted += archive.add(res.data, name=res.url)
+            except Exception as e:
+                st.error(f"Не удалось загрузить по ссылке {res.url}: {e}")
+        if evicted:
+            st.warning(f"Превышен лимит памяти: удалено старых фото — {evicted}")
+        st.success(f"Фотографий в очереди: {archive.describe()}")
 
 with tab2:
-    if not st.session_state.images_archive:
+    if not len(archive):
         st.info("Загрузите изображения во вкладке выше.")
     else:
         # Кнопки управления
@@ -86,39 +81,63 @@ with tab2:
             start_analysis = st.button("🚀 НАЧАТЬ АНАЛИЗ", type="primary", use_container_width=True)
         with c_btn2:
             if st.button("🗑️ Очистить всё", use_container_width=True):
-                st.session_state.images_archive = []
+                archive.clear()
                 st.rerun()
 
-        # Цикл предсказания
-        for i, img in enumerate(st.session_state.images_archive):
+        summary = st.empty()
+
+        # Один снимок архива и для раскладки, и для предсказаний: вытеснение
+        # между ними (загрузка в другой вкладке) не сдвинет результаты
+        items = list(archive)
+
+        # Раскладка: превью слева, место под результат справа
+        slots = []
+        for i, item in enumerate(items):
             st.write("---")
             col_img, col_res = st.columns([1, 1.5])
             
             with col_img:
-                st.image(img, use_container_width=True, caption=f"Фото №{i+1}")
+                st.image(item.thumbnail, use_container_width=True,
+                         caption=f"Фото №{i+1} ({item.width}×{item.height})")
             
             with col_res:
-                if start_analysis:
-                    # Логика модели
-                    start_t = time.time()
-                    
-                    input_tensor = preprocess(img).unsqueeze(0)
-                    with torch.no_grad():
-                        output = model(input_tensor)
-                        probs = F.softmax(output, dim=1)
-                        conf, idx = torch.max(probs, dim=1)
-                    
-                    end_t = time.time()
-                    duration = (end_t - start_t) * 1000 # мс
-                    
-                    # ПРИВЯЗКА КЛАССА К НАЗВАНИЮ
-                    class_id = int(idx.item())
-                    # Берем название из словаря, если его нет — выводим ID
-                    name = CLASS_LABELS.get(class_id, f"ID {class_id}")
+                slot = st.empty()
+                slot.write("Нажмите кнопку выше для запуска.")
+                slots.append(slot)
+
+        # Предсказание: декодирование идёт параллельно с forward, результаты — по мере готовности
+        if start_analysis:
+            done = []
+            stream = stream_cached(
+                "sports", [item.data for item in items],
+                lambda raw: stream_predictions(model, raw, preprocess, CLASS_LABELS,
+                                               batch_size=BATCH_SIZE, model_name="sports")
+            )
+            for i, pred, error in stream:
+                with slots[i].container():
+                    if isinstance(error, SchedulerBusy):
+                        st.warning(f"⏳ {error}")
+                        continue
+                    if error is not None:
+                        st.error(f"Не удалось прочитать изображение: {error}")
+                        continue
+                    done.append(pred)
                     
                     # ВЫВОД РЕЗУЛЬТАТОВ
-                    st.success(f"### Результат: {name}")
-                    st.metric("Точность", f"{conf.item():.2%}")
-                    st.write(f"⏱ Время: {duration:.2f} мс")
-                else:
-                    st.write("Нажмите кнопку выше для запуска.")
+                    st.success(f"### Результат: {pred.label}")
+                    st.metric("Точность", f"{pred.confidence:.2%}")
+                    if pred.tier:
+                        st.caption("Каскад: ответ с малого разрешения" if pred.tier == "low"
+                                   else "Каскад: уточнено на полном разрешении")
+                    if pred.cached:
+                        st.write(f"⏱ Время: {pred.image_time * 1000:.3f} мс (из кэша)")
+                    else:
+                        st.write(f"⏱ Время: {pred.image_time * 1000:.2f} мс "
+                                 f"(батч №{pred.batch_index + 1}: {pred.batch_time * 1000:.2f} мс "
+                                 f"на {pred.batch_size} фото)")
+
+            total_ms = sum(p.image_time for p in done) * 1000
+            n_cached = sum(p.cached for p in done)
+            with summary.container():
+                st.info(f"⏱ Общее время: {total_ms:.2f} мс на {len(done)} фото (из кэша: {n_cached})")
+                st.caption(describe_cache())
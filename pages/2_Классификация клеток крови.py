@@ -1,61 +1,57 @@
 import streamlit as st
 import torch
-import time
-import requests
-from io import BytesIO
-from PIL import Image
-from torchvision.models import ResNet18_Weights
 
-from models.model_blood_cells import load_model
+from models.registry import describe_model
+from models.batching import get_batched_model
+from models.scheduler import SchedulerBusy
+from models.pipeline import stream_predictions
+from models.preprocessing import get_preprocessor
+from models.fetcher import get_fetcher, parse_urls
 st.set_page_config(page_title="Классификация клеток крови")
 
 # ===================== КОНСТАНТЫ =====================
 
-MODEL_PATH = "models/blood_cells.pth"
+MODEL_NAME = "blood_cells"
 
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
-weights = ResNet18_Weights.DEFAULT
-transform = weights.transforms()
+# То же, что ResNet18_Weights.DEFAULT.transforms(): Resize(256) + CenterCrop(224) + Normalize
+transform = get_preprocessor(MODEL_NAME)
 
 CLASS_NAMES = ["EOSINOPHIL", "LYMPHOCYTE", "MONOCYTE", "NEUTROPHIL"]
 
+BATCH_SIZE = 32
+
 # ===================== ЗАГРУЗКА МОДЕЛИ =====================
 
-@st.cache_resource
 def get_model():
-    model = load_model(MODEL_PATH)
+    # Запросы всех сессий склеиваются в общие батчи (models/batching.py)
+    model = get_batched_model(MODEL_NAME)
     model.to(DEVICE)
     return model
 
 
 # ===================== ПРЕДСКАЗАНИЕ =====================
 
-def predict_image(model, image: Image.Image):
-    img = transform(image).unsqueeze(0).to(DEVICE)
-
-    start = time.perf_counter()
-
-    with torch.no_grad():
-        logits = model(img)
-        probs = torch.softmax(logits, dim=1)
-        confidence, pred_class = torch.max(probs, dim=1)
-
-    elapsed = time.perf_counter() - start
-
-    return (
-        CLASS_NAMES[pred_class.item()],
-        confidence.item(),
-        elapsed
+def stream_images(model, raw_images):
+    # Декодирование следующих файлов идёт параллельно с forward текущего батча;
+    # битый файл или слишком большое изображение — ошибка только у него
+    return stream_predictions(
+        model, raw_images, transform, CLASS_NAMES,
+        batch_size=BATCH_SIZE, device=DEVICE, model_name=MODEL_NAME
     )
 
 
 # ===================== ЗАГРУЗКА ИЗ URL =====================
 
-def load_from_url(url):
-    response = requests.get(url, timeout=5)
-    response.raise_for_status()
-    img = Image.open(BytesIO(response.content)).convert("RGB")
-    return img
+def load_from_urls(urls):
+    """Параллельная загрузка; возвращает ([(url, байты)], {url: ошибка}) — декодирует конвейер."""
+    sources, errors = [], {}
+    for result in get_fetcher().fetch_many(urls):
+        if result.ok:
+            sources.append((result.url, result.data))
+        else:
+            errors[result.url] = result.error
+    return sources, errors
 
 
 # ===================== СТРАНИЦА =====================
@@ -64,6 +60,7 @@ def render():
     st.title("Классификация клеток крови")
 
     model = get_model()
+    st.caption(describe_model(MODEL_NAME))
 
 
     # -------- Загрузка изображений --------
@@ -75,44 +72,45 @@ def render():
         accept_multiple_files=True
     )
 
-    url = st.text_input("Или вставьте ссылку на изображение")
+    url_text = st.text_area("Или вставьте ссылки на изображения (по одной на строку)")
 
-    images = []
+    # (имя, сжатые байты): декодируются уже в конвейере, параллельно с forward
+    sources = [(file.name, file.getvalue()) for file in uploaded_files or []]
 
-    if uploaded_files:
-        for file in uploaded_files:
-            image = Image.open(file).convert("RGB")
-            images.append(image)
-
-    if url:
-        try:
-            image = load_from_url(url)
-            images.append(image)
-        except Exception:
-            st.error("Не удалось загрузить изображение по ссылке")
+    urls = parse_urls(url_text)
+    if urls:
+        url_sources, url_errors = load_from_urls(urls)
+        sources.extend(url_sources)
+        for failed_url in url_errors:
+            st.error(f"Не удалось загрузить изображение по ссылке: {failed_url}")
 
     # -------- Кнопка запуска --------
-    if images and st.button("Классифицировать"):
+    if sources and st.button("Классифицировать"):
 
         st.subheader("Результаты")
 
-        total_time = 0
-
-        for img in images:
-
-            st.image(img, use_container_width=True)
-
-            with st.spinner("Модель обрабатывает изображение..."):
-                pred, conf, elapsed = predict_image(model, img)
+        done = []
+        with st.spinner("Модель обрабатывает изображения..."):
+            for i, pred, error in stream_images(model, [data for _, data in sources]):
+                name, data = sources[i]
+                if isinstance(error, SchedulerBusy):
+                    st.warning(f"⏳ {error}")
+                    continue
+                if error is not None:
+                    st.error(f"Не удалось прочитать {name}: {error}")
+                    continue
+                done.append(pred)
 
-            total_time += elapsed
+                st.image(data, use_container_width=True)
 
-            st.write(f"Предсказание: **{pred}**")
-            st.write(f"Уверенность: **{conf:.4f}**")
-            st.write(f"Время ответа модели: **{elapsed:.4f} секунд**")
+                st.write(f"Предсказание: **{pred.label}**")
+                st.write(f"Уверенность: **{pred.confidence:.4f}**")
+                st.write(f"Время ответа модели: **{pred.image_time:.4f} секунд** "
+                         f"(батч из {pred.batch_size}: {pred.batch_time:.4f} секунд)")
 
-            st.divider()
+                st.divider()
 
+        total_time = sum(p.image_time for p in done)
         st.success(f"Общее время обработки: {total_time:.4f} секунд")
 
 
@@ -1,54 +1,53 @@
 import streamlit as st
-from PIL import Image
-import torch
-import torch.nn as nn
-from torchvision import models, transforms
-import requests
-from io import BytesIO
-import time
 import os
 
+from models.inference import predict_batch
+from models.preprocessing import get_preprocessor
+from models.prediction_cache import predict_cached, stream_cached, describe_cache
+from models.pipeline import stream_predictions
+from models.fetcher import get_fetcher, parse_urls
+from models.registry import describe_model
+from models.batching import get_batched_model
+from models.scheduler import SchedulerBusy
+from models.embedding_index import get_training_index, similar_images
+
+BATCH_SIZE = 32
+
 # --- Настройка страницы ---
 st.set_page_config(page_title="Intel Image Classification", layout="wide")
 st.title("🖼️ Intel Image Classification")
 st.markdown("Загрузи изображения или вставь ссылку — модель определит тип сцены!")
 
 # --- Загрузка модели ---
-@st.cache_resource
-def load_model():
-    model = models.resnet18(weights=None)
-    model.fc = nn.Linear(512, 6)
-    model.load_state_dict(
-        torch.load("models/intel_model.pt", map_location=torch.device("cpu"))
-    )
-    model.eval()
-    return model
-
 try:
-    model = load_model()
+    model = get_batched_model("intel")
     CLASS_NAMES = ['buildings', 'forest', 'glacier', 'mountain', 'sea', 'street']
 except Exception as e:
     st.error(f"❌ Не удалось загрузить модель: {e}")
     st.stop()
 
-transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-])
+st.caption(describe_model("intel"))
+
+# Resize((224, 224)) + Normalize
+transform = get_preprocessor("intel")
 
 # --- Вспомогательная функция предсказания ---
-def predict_image(image):
-    start_time = time.time()
-    input_tensor = transform(image).unsqueeze(0)
-    with torch.no_grad():
-        output = model(input_tensor)
-        probs = torch.softmax(output, dim=1)
-        confidence, idx = torch.max(probs, dim=1)
-        predicted_class = CLASS_NAMES[idx.item()]
-        conf_percent = confidence.item() * 100
-    inference_time = time.time() - start_time
-    return predicted_class, conf_percent, inference_time
+def predict_images(images):
+    return predict_batch(model, images, transform, CLASS_NAMES, batch_size=BATCH_SIZE,
+                         model_name="intel")
+
+def stream_images(raw_images):
+    # Декодирование следующих файлов идёт параллельно с forward текущего батча
+    return stream_predictions(model, raw_images, transform, CLASS_NAMES, batch_size=BATCH_SIZE,
+                              model_name="intel")
+
+def show_similar(raw, n=3):
+    """Ближайшие изображения обучающей выборки (индекс: python -m models.embedding_index build)."""
+    similar = similar_images("intel", transform.decode(raw), n)
+    for col, (payload, sim) in zip(st.columns(n), similar):
+        if os.path.exists(payload["path"]):
+            col.image(payload["path"], use_container_width=True)
+        col.caption(f"{payload['label']} · {sim:.3f}")
 
 # --- Вкладки: файлы vs URL ---
 tab1, tab2 = st.tabs(["📁 Загрузить файлы", "🔗 По ссылке"])
@@ -62,41 +61,65 @@ with tab1:
     )
     
     if uploaded_files:
-        cols = st.columns(min(3, len(uploaded_files)))
-        for i, uploaded_file in enumerate(uploaded_files):
-            try:
-                image = Image.open(uploaded_file).convert("RGB")
-                pred, conf, inf_time = predict_image(image)
-                
-                with cols[i % 3]:
-                    st.image(image, use_container_width=True)
-                    st.markdown(f"**Предсказание**: `{pred}`")
-                    st.markdown(f"**Уверенность**: {conf:.1f}%")
-                    st.caption(f"⏱️ {inf_time*1000:.1f} мс")
-            except Exception as e:
-                st.error(f"Ошибка при обработке {uploaded_file.name}: {e}")
+        raw_images = [f.getvalue() for f in uploaded_files]
+        cols = st.columns(min(3, len(raw_images)))
+        slots = [cols[i % 3].empty() for i in range(len(raw_images))]
+        with_similar = (get_training_index("intel") is not None
+                        and st.toggle("Показать похожие из обучающей выборки"))
+
+        # Результаты выводятся по мере готовности, не дожидаясь всех файлов
+        for i, pred, error in stream_cached("intel", raw_images, stream_images):
+            with slots[i].container():
+                if error is not None:
+                    st.error(f"Ошибка при обработке {uploaded_files[i].name}: {error}")
+                    continue
+                st.image(raw_images[i], use_container_width=True)
+                st.markdown(f"**Предсказание**: `{pred.label}`")
+                st.markdown(f"**Уверенность**: {pred.confidence * 100:.1f}%")
+                if pred.tier == "near_dup":
+                    st.caption("♻️ Почти-дубликат уже классифицированного изображения")
+                if with_similar:
+                    show_similar(raw_images[i])
+                if pred.cached:
+                    st.caption(f"⏱️ {pred.image_time*1000:.3f} мс (из кэша)")
+                else:
+                    st.caption(f"⏱️ {pred.image_time*1000:.1f} мс "
+                               f"(батч {pred.batch_time*1000:.1f} мс / {pred.batch_size})")
 
 # --- Вкладка 2: Загрузка по URL ---
 with tab2:
-    url = st.text_input("Вставь прямую ссылку на изображение (должна заканчиваться на .jpg / .png)")
-    if url:
+    url_text = st.text_area("Вставь прямые ссылки на изображения (по одной на строку, .jpg / .png)")
+    urls = parse_urls(url_text)
+    if urls:
+        results = get_fetcher().fetch_many(urls)
+        for r in results:
+            if not r.ok:
+                st.error(f"Не удалось загрузить изображение по ссылке {r.url}: {r.error}")
+
+        fetched = [r for r in results if r.ok]
         try:
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
-            image = Image.open(BytesIO(response.content)).convert("RGB")
-            
-            pred, conf, inf_time = predict_image(image)
-            
+            predictions, errors = predict_cached(
+                "intel", [r.data for r in fetched], transform.decode, predict_images
+            )
+        except SchedulerBusy as e:
+            st.warning(f"⏳ {e}")
+            st.stop()
+        for i, r in enumerate(fetched):
+            if i in errors:
+                st.error(f"Не удалось прочитать изображение {r.url}: {errors[i]}")
+                continue
+            pred = predictions[i]
+
             col1, col2 = st.columns([1, 2])
             with col1:
-                st.image(image, caption="Изображение из URL", use_container_width=True)
+                st.image(r.data, caption="Изображение из URL", use_container_width=True)
             with col2:
-                st.success(f"**Предсказание**: `{pred}`")
-                st.info(f"**Уверенность**: {conf:.1f}%")
-                st.metric("Время инференса", f"{inf_time*1000:.1f} мс")
-        except Exception as e:
-            st.error(f"Не удалось загрузить изображение по ссылке: {e}")
+                st.success(f"**Предсказание**: `{pred.label}`")
+                st.info(f"**Уверенность**: {pred.confidence * 100:.1f}%")
+                st.metric("Время инференса", f"{pred.image_time*1000:.1f} мс")
+                st.caption(f"⬇️ загрузка {r.elapsed*1000:.0f} мс" + (" (из кэша)" if r.from_cache else ""))
 
 # --- Подсказка ---
 st.markdown("---")
-st.caption("💡 Поддерживаемые классы: buildings, forest, glacier, mountain, sea, street")
\ No newline at end of file
+st.caption("💡 Поддерживаемые классы: buildings, forest, glacier, mountain, sea, street")
+st.caption(describe_cache())
\ No newline at end of file
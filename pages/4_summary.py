@@ -1,123 +1,273 @@
+import glob
+import io
+import json
 import streamlit as st
 from PIL import Image
 import os
 
+import altair as alt
+import pandas as pd
+
+from models.run_store import best_run, format_duration, metric_history, runs_for
+# Только описания и пути (без torch): статичная страница не грузит PyTorch
+from models.specs import CHECKPOINTS, MODEL_SPECS, metrics_path
+
 # Путь к папке, где хранятся ваши сохраненные графики
 IMG_DIR = "images"
+# Ширина превью статичных картинок; полный размер — только по запросу
+THUMB_WIDTH = 640
+
+ARCH_TITLES = {"resnet18": "ResNet18", "resnet10": "ResNet10",
+               "mobilenet_v3_small": "MobileNetV3-S", "mobilenet_v3_large": "MobileNetV3-L"}
+
+# Что показывать во вкладках. Значения "notebook" — из ноутбуков: они видны,
+# пока нет ни запусков в mlflow.db, ни файла *.metrics.json
+TABS = {
+    "sports": {
+        "tab": "⚽ Виды спорта",
+        "title": "Классификация спорта",
+        "unfreeze": "L3, L4, FC",
+        "notebook": {"time": "10 мин 6 сек", "epochs": "15", "accuracy": "96%", "f1": "0.9575"},
+        "f1_key": "weighted_f1",
+        "images": [("Распределение классов", "raspred_classes_sic100.png",
+                    "Распределение для 100 классов")],
+        "history": ("grafic_metrics_sic100.png", "Динамика Loss и Accuracy для 100 классов"),
+        "heatmap": ("heatmap_sic100_final.png", "Heatmap для 100 классов"),
+    },
+    "blood_cells": {
+        "tab": "🔬 Клетки крови",
+        "title": "Классификация клеток крови",
+        "unfreeze": "L3, L4, FC",
+        "notebook": {"time": "10 мин 6 сек", "epochs": "8", "accuracy": "82%", "f1": "0.82"},
+        "f1_key": "macro_f1",
+        "images": [("Распределение классов", "blood_raspr.png", "Распределение для 4 классов")],
+        "history": ("blood_cells_f1_3.png", "Динамика Loss и F1"),
+        "heatmap": ("blood_cells_matrix_3.png", "Heatmap для 4 классов"),
+    },
+    "intel": {
+        "tab": "🏞️ Природные сцены",
+        "title": "Intel Image Classification",
+        "unfreeze": "L4, FC",
+        "notebook": {"time": "10 мин 22 сек", "epochs": "5", "accuracy": "90.1%", "f1": "0.89"},
+        "f1_key": "macro_f1",
+        "images": [("Метрики", "metrics_intel.png", "Метрики")],
+        "history": ("graphic_intel.png", "Динамика Loss и Accuracy"),
+        "heatmap": ("Intel_heatmap.png", "Heatmap для 6 классов"),
+    },
+}
+
+
+# ===================== ДАННЫЕ =====================
+
+@st.cache_data
+def _read_json(path, mtime):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_metrics(model_name):
+    """Метрики последней оценки (training / python -m models.metrics eval) или None."""
+    path = metrics_path(MODEL_SPECS[model_name].path)
+    if not os.path.exists(path):
+        return None
+    return _read_json(path, os.path.getmtime(path))
+
+
+def load_distillation(model_name):
+    """Отчёты python -m models.distillation по ученикам модели."""
+    root = os.path.splitext(CHECKPOINTS[model_name][0])[0]
+    return [_read_json(path, os.path.getmtime(path))
+            for path in sorted(glob.glob(f"{root}.*.distillation.json"))]
+
+
+def load_training(model_name):
+    """Последний отчёт python -m models.training по модели или None."""
+    root = os.path.splitext(CHECKPOINTS[model_name][0])[0]
+    paths = glob.glob(f"{root}*.training.json")
+    if not paths:
+        return None
+    path = max(paths, key=os.path.getmtime)
+    return _read_json(path, os.path.getmtime(path))
+
+
+@st.cache_data(max_entries=64)
+def _thumbnail(path, mtime, width):
+    with Image.open(path) as img:
+        img.thumbnail((width, width * 4))
+        rgb = Image.new("RGB", img.size, "white")   # прозрачный фон графиков -> белый
+        rgb.paste(img, mask=img.convert("RGBA").getchannel("A"))
+        buffer = io.BytesIO()
+        rgb.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+# ===================== ЭЛЕМЕНТЫ СТРАНИЦЫ =====================
+
+def show_image(file_name, caption):
+    """Превью картинки; полный размер загружается, только если его попросили."""
+    path = os.path.join(IMG_DIR, file_name)
+    if not os.path.exists(path):
+        st.warning(f"Файл {path} не найден в папке images")
+        return
+    st.image(_thumbnail(path, os.path.getmtime(path), THUMB_WIDTH), caption=caption)
+    if st.toggle("Полный размер", key=f"full_{file_name}"):
+        st.image(path, use_container_width=True, caption=caption)
+
+
+def show_tiles(model_name, config, run, metrics):
+    """Плитки: запуск из mlflow.db -> файл метрик -> значения из ноутбука."""
+    values = dict(config["notebook"])
+    if run:
+        if run.duration:
+            values["time"] = format_duration(run.duration)
+        if run.epochs:
+            values["epochs"] = str(run.epochs)
+        if "valid_acc" in run.metrics:
+            values["accuracy"] = f"{run.metrics['valid_acc'] * 100:.1f}%"
+    if metrics:
+        # Оценка сохранённого чекпоинта точнее последней эпохи запуска
+        summary = metrics["summary"]
+        values["accuracy"] = f"{summary['accuracy'] * 100:.1f}%"
+        values["f1"] = f"{summary[config['f1_key']]:.4f}"
+
+    col1, col2, col3, col4, col5, col6 = st.columns(6)
+    arch = MODEL_SPECS[model_name].arch
+    col1.metric("Модель", ARCH_TITLES.get(arch, arch))
+    col2.metric("Разморозка слоев", config["unfreeze"])
+    col3.metric("Время обучения", values["time"])
+    col4.metric("Эпох", values["epochs"])
+    col5.metric("Точность (Accuracy)", values["accuracy"])
+    col6.metric("Weighted F1-Score" if config["f1_key"] == "weighted_f1" else "F1-Score",
+                values["f1"])
+
+
+def show_history(run, image, caption):
+    """Графики Loss / Accuracy из рядов метрик запуска, иначе сохранённая картинка."""
+    history = metric_history(run) if run else {}
+    if not history:
+        show_image(image, caption)
+        return
+    data = pd.DataFrame([
+        {"Эпоха": step + 1, "Значение": value, "Метрика": key,
+         "График": "Loss" if key.endswith("loss") else "Accuracy / F1"}
+        for key, (steps, values) in history.items()
+        if key.startswith(("train_", "valid_"))
+        for step, value in zip(steps, values)
+    ])
+    for col, (title, chart_data) in zip(st.columns(2), data.groupby("График", sort=False)):
+        chart = alt.Chart(chart_data).mark_line(point=True).encode(
+            x="Эпоха:Q", y=alt.Y("Значение:Q", scale=alt.Scale(zero=False)),
+            color="Метрика:N", tooltip=["Метрика", "Эпоха", "Значение"],
+        ).properties(title=title, height=300)
+        col.altair_chart(chart, use_container_width=True)
+    st.caption(f"{caption} — запуск {run.name} ({run.experiment})")
+
+
+def show_runs(runs):
+    table = pd.DataFrame([
+        {"Запуск": r.name, "Эксперимент": r.experiment, "Статус": r.status,
+         "Начало": pd.to_datetime(r.start_time, unit="s"),
+         "Время": format_duration(r.duration) if r.duration else "—",
+         "Эпох": r.epochs, "LR": r.params.get("learning_rate"),
+         "valid_acc": r.metrics.get("valid_acc"), "valid_loss": r.metrics.get("valid_loss")}
+        for r in runs
+    ])
+    st.dataframe(table, hide_index=True, use_container_width=True)
+
+
+def show_training_phases(report):
+    """Время каждой фазы скриптового обучения (то же, что уходит в mlflow как phase_time_*)."""
+    table = pd.DataFrame([
+        {"Фаза": phase["stage"], "Эпох": phase["epochs"], "LR": phase["lr"],
+         "Время": format_duration(phase["wall_time"]),
+         "valid_acc": (phase["history"]["valid_acc"] or [None])[-1]}
+        for phase in report["phases"]
+    ])
+    st.dataframe(table, hide_index=True, use_container_width=True)
+    st.caption(f"Всего {format_duration(report['total_time'])} -> {report['checkpoint']}")
+
+
+def show_heatmap(metrics, image, caption):
+    """Матрица ошибок из файла метрик, иначе сохранённая картинка."""
+    if not metrics:
+        show_image(image, caption)
+        return
+    names = [row["class"] for row in metrics["summary"]["per_class"]]
+    cm = metrics["confusion_matrix"]
+    data = pd.DataFrame([
+        {"Истинный": names[i], "Предсказанный": names[j], "Количество": cm[i][j]}
+        for i in range(len(names)) for j in range(len(names))
+    ])
+    chart = alt.Chart(data).mark_rect().encode(
+        x=alt.X("Предсказанный:N", sort=names),
+        y=alt.Y("Истинный:N", sort=names),
+        color=alt.Color("Количество:Q", scale=alt.Scale(scheme="blues")),
+        tooltip=["Истинный", "Предсказанный", "Количество"],
+    ).properties(height=max(300, 12 * len(names)))
+    st.altair_chart(chart, use_container_width=True)
+    st.caption(f"{caption} (по {metrics['summary']['total']} изображениям)")
+
+
+def show_distillation(reports):
+    """Учитель против учеников: размер, латентность и качество на одной валидации."""
+    rows = []
+    for report in reports:
+        c = report["comparison"]
+        for role, title in (("teacher", "учитель"), ("student", "ученик")):
+            m = c[role]
+            rows.append({"Модель": f"{ARCH_TITLES.get(m['arch'], m['arch'])} ({title})",
+                         "Размер, МБ": round(m["size_mb"], 1),
+                         "Параметров, M": round(m["params_m"], 2),
+                         **{f"Батч {b}, мс": round(ms, 1) for b, ms in m["latency_ms"].items()},
+                         "Accuracy": round(m["accuracy"], 4), "Macro F1": round(m["macro_f1"], 4)})
+    st.dataframe(pd.DataFrame(rows).drop_duplicates("Модель"), hide_index=True,
+                 use_container_width=True)
+    st.caption("Ученик включается на странице через MODEL_ARCH, например "
+               "MODEL_ARCH=\"intel=mobilenet_v3_small\"")
+
+
+def show_model_tab(model_name, config):
+    st.header(config["title"])
+    runs = runs_for(model_name)
+    run = best_run(runs)
+    metrics = load_metrics(model_name)
+
+    show_tiles(model_name, config, run, metrics)
+
+    for subheader, image, caption in config["images"]:
+        st.subheader(subheader)
+        show_image(image, caption)
+
+    st.subheader("Графики метрик")
+    show_history(run, *config["history"])
+
+    if runs:
+        st.subheader("Запуски обучения")
+        show_runs(runs)
+
+    training = load_training(model_name)
+    if training:
+        st.subheader("Фазы обучения (python -m models.training)")
+        show_training_phases(training)
+
+    st.subheader("Heatmap")
+    show_heatmap(metrics, *config["heatmap"])
+
+    reports = load_distillation(model_name)
+    if reports:
+        st.subheader("Дистилляция")
+        show_distillation(reports)
+
 
 def show_summary_page():
     st.title("📊 Сводная аналитика по всем моделям")
     st.info("Здесь собраны результаты обучения нейросетей для трех различных задач классификации.")
 
     # Создаем горизонтальные вкладки
-    tab_sport, tab_blood, tab_nature = st.tabs([
-        "⚽ Виды спорта", 
-        "🔬 Клетки крови", 
-        "🏞️ Природные сцены"
-    ])
-
-    # --- 1. РАЗДЕЛ: ВИДЫ СПОРТА (100 классов) ---
-    with tab_sport:
-        st.header("Классификация спорта")
-        
-        col1, col2, col3, col4, col5, col6 = st.columns(6)
-        col1.metric("Модель", "ResNet18")
-        col2.metric("Разморозка слоев", "L3, L4, FC")       
-        col3.metric("Время обучения", "10 мин 6 сек")
-        col4.metric("Эпох", "15")
-        col5.metric("Точность (Accuracy)", "96%")        
-        col6.metric("Weighted F1-Score", "0.9575")
-
-        st.subheader("Распределение классов")        
-        raspr_sport_img = os.path.join(IMG_DIR, "raspred_classes_sic100.png")
-        if os.path.exists(raspr_sport_img):
-            st.image(raspr_sport_img, use_container_width=True, caption="Распределение для 100 классов")
-        else:
-            st.warning(f"Файл {raspr_sport_img} не найден в папке images")
-
-        st.subheader("Графики метрик")
-        # Проверяем наличие файла перед выводом
-        metric_sport_img = os.path.join(IMG_DIR, "grafic_metrics_sic100.png")
-        if os.path.exists(metric_sport_img):
-            st.image(metric_sport_img, use_container_width=True, caption="Динамика Loss и Accuracy для 100 классов")
-        else:
-            st.warning(f"Файл {metric_sport_img} не найден в папке images")
-
-        st.subheader("Heatmap")        
-        heatmap_sport_img = os.path.join(IMG_DIR, "heatmap_sic100_final.png")
-        if os.path.exists(heatmap_sport_img):
-            st.image(heatmap_sport_img, use_container_width=True, caption="Heatmap для 100 классов")
-        else:
-            st.warning(f"Файл {heatmap_sport_img} не найден в папке images")
-
-    # --- 2. РАЗДЕЛ: КЛЕТКИ КРОВИ (Blood Cells) ---
-    with tab_blood:
-        st.header("Классификация клеток крови")
-        
-        col1, col2, col3, col4, col5, col6 = st.columns(6)
-        col1.metric("Модель", "ResNet18")
-        col2.metric("Разморозка слоев", "L3, L4, FC")       
-        col3.metric("Время обучения", "10 мин 6 сек")
-        col4.metric("Эпох", "8")
-        col5.metric("Точность (Accuracy)", "82%")        
-        col6.metric("F1-Score", "0.82")
-
-        st.subheader("Распределение классов")        
-        raspr_blood_img = os.path.join(IMG_DIR, "blood_raspr.png")
-        if os.path.exists(raspr_blood_img):
-            st.image(raspr_blood_img, use_container_width=True, caption="Распределение для 4 классов")
-        else:
-            st.warning(f"Файл {raspr_blood_img} не найден в папке images")        
-
-        st.subheader("Графики метрик")
-        # Проверяем наличие файла перед выводом
-        metric_blood_img = os.path.join(IMG_DIR, "blood_cells_f1_3.png")
-        if os.path.exists(metric_blood_img):
-            st.image(metric_blood_img, use_container_width=True, caption="Динамика Loss и F1")
-        else:
-            st.warning(f"Файл {metric_blood_img} не найден в папке images")
-
-        st.subheader("Heatmap")        
-        heatmap_blood_img = os.path.join(IMG_DIR, "blood_cells_matrix_3.png")
-        if os.path.exists(heatmap_blood_img):
-            st.image(heatmap_blood_img, use_container_width=True, caption="Heatmap для 4 классов")
-        else:
-            st.warning(f"Файл {heatmap_blood_img} не найден в папке images")
-
-    # --- 3. РАЗДЕЛ: ПРИРОДНЫЕ СЦЕНЫ (Intel Image) ---
-    with tab_nature:
-        st.header("Intel Image Classification")
-        
-        col1, col2, col3, col4, col5, col6 = st.columns(6)
-        col1.metric("Модель", "ResNet18")
-        col2.metric("Разморозка слоев", "L4, FC")       
-        col3.metric("Время обучения", "10 мин 22 сек")
-        col4.metric("Эпох", "5")
-        col5.metric("Точность (Accuracy)", "90.1%")        
-        col6.metric("F1-Score", "0.89")
-
-
-        st.subheader("Метрики")        
-        raspr_intel_img = os.path.join(IMG_DIR, "metrics_intel.png")
-        if os.path.exists(raspr_intel_img):
-            st.image(raspr_intel_img, use_container_width=True, caption="Метрики")
-        else:
-            st.warning(f"Файл {raspr_intel_img} не найден в папке images")
-
-        st.subheader("Графики метрик")
-        # Проверяем наличие файла перед выводом
-        metric_intel_img = os.path.join(IMG_DIR, "graphic_intel.png")
-        if os.path.exists(metric_intel_img):
-            st.image(metric_intel_img, use_container_width=True, caption="Динамика Loss и Accuracy")
-        else:
-            st.warning(f"Файл {metric_intel_img} не найден в папке images")
-
-        st.subheader("Heatmap")        
-        heatmap_intel_img = os.path.join(IMG_DIR, "Intel_heatmap.png")
-        if os.path.exists(heatmap_intel_img):
-            st.image(heatmap_intel_img, use_container_width=True, caption="Heatmap для 6 классов")
-        else:
-            st.warning(f"Файл {heatmap_intel_img} не найден в папке images")
+    tabs = st.tabs([config["tab"] for config in TABS.values()])
+    for tab, (model_name, config) in zip(tabs, TABS.items()):
+        with tab:
+            show_model_tab(model_name, config)
 
 # Если запускаем этот файл напрямую (для тестов)
 if __name__ == "__main__":
@@ -0,0 +1,57 @@
+import streamlit as st
+
+from models.registry import load_class_names
+from models.scheduler import SchedulerBusy
+from models.shared_trunk import classify_with_all, resident_bytes, STAGES
+
+# --- Настройка ---
+MODEL_TITLES = {
+    "sports": "⚽ Вид спорта",
+    "blood_cells": "🔬 Клетка крови",
+    "intel": "🏞️ Сцена",
+}
+
+st.title("🧩 Классификация всеми моделями")
+st.markdown("Изображение проходит через все три модели. Общие для ResNet18 начальные слои "
+            "хранятся в одном экземпляре и считаются один раз.")
+
+uploaded_files = st.file_uploader(
+    "Выберите одно или несколько изображений (JPG/PNG)",
+    type=["jpg", "jpeg", "png"],
+    accept_multiple_files=True
+)
+
+if uploaded_files and st.button("Классифицировать всеми моделями", type="primary"):
+    class_names = {name: load_class_names(name) for name in MODEL_TITLES}
+    raw_images = [f.getvalue() for f in uploaded_files]
+
+    try:
+        with st.spinner("Модели обрабатывают изображения..."):
+            results, groups = classify_with_all(raw_images, class_names)
+    except SchedulerBusy as e:
+        st.warning(f"⏳ {e}")
+        st.stop()
+    except Exception as e:
+        st.error(f"Не удалось выполнить классификацию: {e}")
+        st.stop()
+
+    for multi in groups:
+        shared = ", ".join(STAGES[:multi.prefix]) or "нет"
+        st.caption(f"Группа {', '.join(multi.names)}: общий проход — {shared}")
+
+    total, actual = resident_bytes([m for multi in groups for m in multi.heads.values()])
+    st.caption(f"Веса моделей в реестре: {actual / 1024 / 1024:.1f} МБ "
+               f"(без общих слоёв было бы {total / 1024 / 1024:.1f} МБ)")
+
+    for i, (f, data) in enumerate(zip(uploaded_files, raw_images)):
+        st.write("---")
+        col_img, col_res = st.columns([1, 2])
+        with col_img:
+            st.image(data, use_container_width=True, caption=f.name)
+        with col_res:
+            for name, title in MODEL_TITLES.items():
+                if name not in results:
+                    continue
+                pred = results[name][i]
+                st.markdown(f"**{title}**: `{pred.label}` — {pred.confidence:.1%} "
+                            f"(⏱ {pred.image_time * 1000:.1f} мс)")
@@ -0,0 +1,163 @@
+import streamlit as st
+
+from models.telemetry import (TELEMETRY, ENABLED, METRICS_HOST, METRICS_PORT, metrics_server_error,
+                              start_metrics_server)
+from models.prediction_cache import get_prediction_cache
+from models.registry import get_registry
+from models.scheduler import get_scheduler
+from models.cascade import TIER_FULL, TIER_LOW, flops_saved, load_config
+from models.warmup import TELEMETRY_MODEL, warmup_status
+
+# Путь к текстовому эндпоинту Prometheus
+start_metrics_server()
+
+
+def stage_rows(histograms):
+    """Строка таблицы на каждую пару (модель, стадия)."""
+    rows = []
+    for (name, labels), hist in sorted(histograms.items()):
+        if name != "inference_stage_seconds":
+            continue
+        labels = dict(labels)
+        rows.append({
+            "Модель": labels.get("model", ""),
+            "Стадия": labels.get("stage", ""),
+            "Вызовов": hist.count,
+            "Среднее, мс": round(hist.sum / hist.count * 1000, 2) if hist.count else 0,
+            "p50 ≤, мс": hist.quantile(0.5) * 1000,
+            "p95 ≤, мс": hist.quantile(0.95) * 1000,
+            "Всего, с": round(hist.sum, 3),
+        })
+    return rows
+
+
+def show_operations_page():
+    st.title("🛠️ Операционные метрики")
+
+    if not ENABLED:
+        st.warning("Инструментирование выключено (TELEMETRY=0).")
+        return
+
+    if metrics_server_error() is not None:
+        st.warning(f"Эндпоинт Prometheus не запущен ({METRICS_HOST}:{METRICS_PORT}): "
+                   f"{metrics_server_error()}")
+    else:
+        st.caption(f"Prometheus: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    if st.button("🔄 Обновить"):
+        st.rerun()
+
+    counters, gauges, histograms = TELEMETRY.snapshot()
+
+    # -------- Счётчики --------
+    cache = get_prediction_cache().stats()
+    requests_total = sum(v for (n, labels), v in counters.items()
+                         if n == "inference_requests_total"
+                         and dict(labels).get("model") != TELEMETRY_MODEL)
+    depth = sum(v for (n, _), v in gauges.items() if n == "pipeline_queue_depth")
+
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Изображений обработано", int(requests_total))
+    col2.metric("Попаданий в кэш", cache["hits"])
+    col3.metric("Доля попаданий", f"{cache['hit_rate']:.0%}")
+    col4.metric("Очередь декодирования", int(depth))
+
+    # -------- Планировщик --------
+    sched = get_scheduler().stats()
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Воркеров × потоков", f"{sched['workers']} × {sched['threads_per_worker']}")
+    col2.metric("В очереди инференса", f"{sched['queued']} / {sched['queue_limit']}")
+    col3.metric("Отклонено («занято»)", sched["rejected"])
+    st.caption("queue_wait — ожидание в очереди, compute — сам forward; "
+               "forward на страницах включает и то и другое.")
+
+    # -------- Время по стадиям --------
+    st.subheader("Время по стадиям")
+    rows = stage_rows(histograms)
+    if rows:
+        st.dataframe(rows, use_container_width=True, hide_index=True)
+        st.bar_chart(
+            {f"{r['Модель']}/{r['Стадия']}": r["Всего, с"] for r in rows},
+            horizontal=True,
+        )
+    else:
+        st.info("Пока нет данных — запустите классификацию на одной из страниц.")
+
+    # -------- Размеры батчей --------
+    st.subheader("Размеры батчей")
+    batches = [
+        {"Модель": dict(labels).get("model", ""), "Батчей": h.count,
+         "Средний размер": round(h.sum / h.count, 1) if h.count else 0}
+        for (name, labels), h in sorted(histograms.items())
+        if name == "inference_batch_size"
+    ]
+    if batches:
+        st.dataframe(batches, use_container_width=True, hide_index=True)
+
+    # -------- Каскад разрешений --------
+    tiers = {}
+    for (name, labels), value in counters.items():
+        if name == "cascade_images_total":
+            labels = dict(labels)
+            tiers.setdefault(labels["model"], {})[labels["tier"]] = value
+    if tiers:
+        st.subheader("Каскад разрешений")
+        rows = []
+        for model_name, counts in sorted(tiers.items()):
+            low, full = counts.get(TIER_LOW, 0), counts.get(TIER_FULL, 0)
+            rate = full / max(low + full, 1)
+            config = load_config(model_name)
+            rows.append({
+                "Модель": model_name,
+                "Малое разрешение": f"{config.low_res}px" if config else "—",
+                "Ответили на малом": int(low), "Эскалаций": int(full),
+                "Доля эскалаций": f"{rate:.1%}",
+                "Экономия FLOPs": f"{flops_saved(config.low_res, rate):.1%}" if config else "—",
+            })
+        st.dataframe(rows, use_container_width=True, hide_index=True)
+
+    near_dups = {dict(labels).get("model", ""): int(v) for (n, labels), v in counters.items()
+                 if n == "near_duplicate_hits_total"}
+    if near_dups:
+        st.subheader("Почти-дубликаты")
+        st.dataframe([{"Модель": m, "Ответов из кэша эмбеддингов": v}
+                      for m, v in sorted(near_dups.items())],
+                     use_container_width=True, hide_index=True)
+
+    # -------- Модели в памяти --------
+    st.subheader("Загруженные модели")
+    models = [
+        {"Модель": info.name, "Версия": info.version, "МБ": round(info.size_bytes / 1024 / 1024, 1),
+         "Загрузка, мс": round(info.load_time * 1000), "Обращений": info.hits}
+        for info in get_registry().stats()
+    ]
+    if models:
+        st.dataframe(models, use_container_width=True, hide_index=True)
+
+    # -------- Прогрев при старте --------
+    st.subheader("Прогрев при старте")
+    warmup = warmup_status()
+    if not warmup["enabled"]:
+        st.info("Прогрев выключен (WARMUP=0).")
+    elif not warmup["ready"]:
+        st.info("Прогрев ещё идёт…")
+    elif warmup.get("elapsed") is not None:
+        st.caption(f"Всего {warmup['elapsed']:.1f} с, из них импорт torch/torchvision "
+                   f"{warmup['import_time'] or 0:.1f} с")
+    rows = [
+        {"Модель": name, "Батч": size, "Загрузка, мс": round(t["load_s"] * 1000),
+         "Первый прогон, мс": round(b["first_s"] * 1000),
+         "Повторный, мс": round(b["steady_s"] * 1000)}
+        for name, t in warmup["timings"].items()
+        for size, b in t["batches"].items()
+    ]
+    if rows:
+        st.dataframe(rows, use_container_width=True, hide_index=True)
+    for name, error in warmup["errors"].items():
+        st.warning(f"{name}: {error}")
+
+    with st.expander("Текст в формате Prometheus"):
+        st.code(TELEMETRY.render(), language="text")
+
+
+if __name__ == "__main__":
+    show_operations_page()
@@ -0,0 +1,109 @@
+import threading
+import time
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from models.batching import BatchingServer, load_test
+
+SESSIONS = 16
+REQUESTS_PER_SESSION = 5
+
+
+class FixedCostModel:
+    """
+    Замена ResNet18 с предсказуемой стоимостью: вызов стоит overhead +
+    per_image × N и занимает единственный «вычислитель» (вызовы не
+    параллелятся) — как forward, который уже использует все ядра.
+    """
+
+    def __init__(self, overhead=0.02, per_image=0.001, num_classes=6):
+        self.overhead = overhead
+        self.per_image = per_image
+        self.num_classes = num_classes
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, batch):
+        with self._lock:
+            self.calls += 1
+            time.sleep(self.overhead + self.per_image * batch.shape[0])
+        return torch.zeros(batch.shape[0], self.num_classes)
+
+    def eval(self):
+        return self
+
+
+def test_micro_batching_beats_per_request_forward():
+    direct_model, batched_model = FixedCostModel(), FixedCostModel()
+    direct = load_test(direct_model, SESSIONS, REQUESTS_PER_SESSION, batching=False, size=32)
+    batched = load_test(batched_model, SESSIONS, REQUESTS_PER_SESSION, batching=True,
+                        window_ms=5, max_batch=32, size=32)
+
+    total = SESSIONS * REQUESTS_PER_SESSION
+    assert direct_model.calls == total
+    # Запросы склеиваются: forward-ов заметно меньше, чем запросов
+    assert batched_model.calls <= total / 4
+    assert batched["throughput"] > 2 * direct["throughput"]
+    assert batched["p95"] < direct["p95"]
+    assert batched["p99"] < direct["p99"]
+
+
+def test_micro_batching_single_session_overhead_is_bounded():
+    # Без конкуренции окно сборки добавляет не больше window_ms к задержке
+    window_ms = 5
+    model = FixedCostModel()
+    direct = load_test(model, 1, 10, batching=False, size=32)
+    batched = load_test(model, 1, 10, batching=True, window_ms=window_ms, size=32)
+    assert batched["p50"] < direct["p50"] + window_ms / 1000 + 0.02
+
+
+class EchoModel:
+    """Выход — функция входа: в каждой строке логитов среднее своего изображения."""
+
+    def __init__(self, num_classes=4):
+        self.num_classes = num_classes
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, batch):
+        with self._lock:
+            self.calls += 1
+            time.sleep(0.01)   # пока forward занят, соседние запросы копятся в очереди
+        return batch.mean(dim=(1, 2, 3)).unsqueeze(1).repeat(1, self.num_classes)
+
+
+def test_each_caller_gets_its_own_rows():
+    model = EchoModel()
+    server = BatchingServer(window_ms=5, max_batch=8, model_loader=lambda name: model)
+    barrier = threading.Barrier(SESSIONS)
+    results, errors = {}, []
+
+    def session(s):
+        barrier.wait()
+        try:
+            for r in range(REQUESTS_PER_SESSION):
+                # Разные размеры запросов и два разрешения (склеиваются только одинаковые)
+                n, size = 1 + (s + r) % 3, (32 if s % 2 else 48)
+                # Суммы остаются точными в float32: значения < 2**24 / (3 × 48 × 48)
+                values = [s * 100 + r * 10 + j for j in range(n)]
+                batch = torch.stack([torch.full((3, size, size), float(v)) for v in values])
+                results[(s, r)] = (values, server("echo", batch))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=session, args=(s,)) for s in range(SESSIONS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    server.close()
+
+    assert not errors
+    assert len(results) == SESSIONS * REQUESTS_PER_SESSION
+    for values, logits in results.values():
+        assert logits.shape == (len(values), model.num_classes)
+        assert logits[:, 0].tolist() == values
+    # Запросы действительно склеивались
+    assert model.calls < len(results)
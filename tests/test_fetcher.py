@@ -0,0 +1,112 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("requests")
+
+from models.fetcher import FetchError, Fetcher
+
+DELAY = 0.2
+SMALL = 1024
+BIG = 4 * 1024 * 1024
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Локальная замена внешних сайтов: задержка, большие ответы, не-картинки, ETag."""
+
+    def do_GET(self):
+        path = self.path
+        if path == "/not-modified":
+            self.send_response(304)
+            self.end_headers()
+            return
+        if path.startswith("/etag/"):
+            etag = f'"{path}"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(b"\xff" * SMALL)
+            return
+
+        time.sleep(DELAY)
+        body = b"\xff" * (BIG if "big" in path else SMALL)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html" if path.startswith("/html") else "image/jpeg")
+        if path.startswith("/sized"):
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()   # иначе без Content-Length: лимит срабатывает на потоке
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):   # клиент отказался дочитывать
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def base_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def test_parallel_fetch_is_faster(base_url):
+    urls = [f"{base_url}/img{i}.jpg" for i in range(8)]
+    fetcher = Fetcher(max_bytes=1024 * 1024)
+
+    start = time.perf_counter()
+    serial = [fetcher.fetch(u) for u in urls]
+    serial_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    parallel = fetcher.fetch_many(urls)
+    parallel_time = time.perf_counter() - start
+
+    assert all(r.ok for r in serial + parallel)
+    assert [r.url for r in parallel] == urls
+    assert serial_time >= len(urls) * DELAY
+    assert parallel_time < serial_time / 3
+
+
+@pytest.mark.parametrize("path", ["/big.jpg", "/sized-big.jpg"])
+def test_size_limit(base_url, path):
+    result = Fetcher(max_bytes=1024 * 1024).fetch(base_url + path)
+    assert isinstance(result.error, FetchError)
+    assert "лимит" in str(result.error)
+
+
+def test_rejects_non_image(base_url):
+    result = Fetcher().fetch(base_url + "/html")
+    assert isinstance(result.error, FetchError)
+
+
+def test_etag_revalidation(base_url):
+    fetcher = Fetcher()
+    first = fetcher.fetch(base_url + "/etag/a")
+    second = fetcher.fetch(base_url + "/etag/a")
+    assert first.ok and not first.from_cache
+    assert second.ok and second.from_cache and second.data == first.data
+
+
+def test_uncached_304_is_an_error(base_url):
+    result = Fetcher().fetch(base_url + "/not-modified")
+    assert isinstance(result.error, FetchError)
+
+
+def test_cache_byte_budget(base_url):
+    fetcher = Fetcher(cache_bytes=2 * SMALL + SMALL // 2)
+    for name in "abc":
+        assert fetcher.fetch(f"{base_url}/etag/{name}").ok
+    entries, size = fetcher.cache_size()
+    assert entries == 2 and size <= fetcher.cache_bytes
+    # Самая старая запись вытеснена: ответ снова скачан целиком
+    assert not fetcher.fetch(base_url + "/etag/a").from_cache
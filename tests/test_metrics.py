@@ -0,0 +1,21 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from models.metrics import MetricsAccumulator
+
+# 6 из 100 классов встречаются в метках или предсказаниях
+LABELS = [0, 0, 1, 2, 2, 3, 3, 3, 5, 5]
+PREDS = [0, 1, 1, 2, 0, 3, 3, 4, 5, 5]
+# sklearn f1_score(average="macro"): (0.5 + 2/3 + 2/3 + 0.8 + 0 + 1) / 6
+SKLEARN_MACRO_F1 = (0.5 + 2 / 3 + 2 / 3 + 0.8 + 0 + 1) / 6
+
+
+def test_macro_f1_averages_only_present_classes():
+    metrics = MetricsAccumulator(100).update(torch.tensor(PREDS), torch.tensor(LABELS))
+    assert metrics.macro_f1 == pytest.approx(SKLEARN_MACRO_F1)
+    assert metrics.accuracy == pytest.approx(0.7)
+
+
+def test_macro_f1_empty():
+    assert MetricsAccumulator(4).macro_f1 == 0.0
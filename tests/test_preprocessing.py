@@ -0,0 +1,52 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+Image = pytest.importorskip("PIL.Image")
+pytest.importorskip("torchvision")
+
+from models.preprocessing import (EXACT_TOLERANCE, FAST_DECODE, FAST_DECODE_MEAN_TOLERANCE,
+                                  PREPROCESS_SPECS, diff_stats, get_preprocessor)
+
+# Большой JPEG (draft реально уменьшает), маленький портретный JPEG и PNG
+SIZES = {"large.jpg": (1600, 1200), "portrait.jpg": (300, 500), "small.png": (240, 180)}
+
+
+@pytest.fixture(scope="module")
+def image_paths(tmp_path_factory):
+    root = tmp_path_factory.mktemp("images")
+    rng = np.random.default_rng(0)
+    paths = []
+    for name, (w, h) in SIZES.items():
+        y, x = np.mgrid[0:h, 0:w]
+        # Плавные градиенты + шум: есть и низкие, и высокие частоты
+        arr = np.stack([x * 255 // w, y * 255 // h, (x + y) * 255 // (w + h)], axis=-1)
+        arr = np.clip(arr + rng.integers(-20, 20, arr.shape), 0, 255).astype(np.uint8)
+        path = root / name
+        Image.fromarray(arr).save(path, quality=90)   # для PNG quality игнорируется
+        paths.append(str(path))
+    return paths
+
+
+@pytest.mark.parametrize("name", list(PREPROCESS_SPECS))
+def test_exact_decode_matches_transforms(name, image_paths):
+    max_diff, _ = diff_stats(PREPROCESS_SPECS[name], image_paths)
+    assert max_diff < EXACT_TOLERANCE
+
+
+@pytest.mark.parametrize("name", list(PREPROCESS_SPECS))
+def test_draft_decode_within_tolerance(name, image_paths):
+    _, mean_diff = diff_stats(PREPROCESS_SPECS[name], image_paths, fast_decode=True)
+    assert mean_diff < FAST_DECODE_MEAN_TOLERANCE
+
+
+@pytest.mark.skipif(FAST_DECODE, reason="PREPROCESS_FAST_DECODE=1: страницы декодируют с draft")
+@pytest.mark.parametrize("name", list(PREPROCESS_SPECS))
+def test_page_preprocessor_matches_transforms(name, image_paths):
+    # Тот самый путь страниц: get_preprocessor -> open -> batch
+    preprocessor = get_preprocessor(name)
+    assert not preprocessor.fast_decode
+    reference = preprocessor.reference_transform()
+    expected = torch.stack([reference(Image.open(p).convert("RGB")) for p in image_paths])
+    actual = preprocessor.batch([preprocessor.open(p) for p in image_paths])
+    assert (actual - expected).abs().max().item() < EXACT_TOLERANCE